@@ -0,0 +1,145 @@
+import os
+import json
+import time
+import numpy as np
+
+ANN_FILE = "ann_ivf.npz"
+ANN_META_FILE = "ann_ivf_meta.json"
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+# Below this many vectors an exact scan is already fast enough
+ANN_MIN_VECTORS = int(os.getenv("ANN_MIN_VECTORS", "10000"))
+
+ASSIGN_BLOCK_ROWS = 65536
+
+
+def _assign(vectors, centroids):
+    """Nearest centroid (by inner product) for every row, in blocks to bound memory"""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + ASSIGN_BLOCK_ROWS], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(vectors, n_clusters, n_iter=10, sample_size=None, seed=0):
+    """k-means on unit vectors (cosine), trained on a random sample of rows"""
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample_size = min(n, sample_size or n_clusters * 32)
+    sample_rows = np.sort(rng.choice(n, size=sample_size, replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+    centroids = sample[rng.choice(sample_size, size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        counts = np.bincount(labels, minlength=n_clusters)
+        # Per-cluster sums via one sort + reduceat (np.add.at is far slower)
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(sample[order], starts[nonempty], axis=0)
+
+        # Re-seed empty clusters from random sample points
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file (IVF-Flat) index over the rows of a vector matrix.
+
+    Rows are bucketed by nearest k-means centroid. A query scores the
+    centroids, opens the `nprobe` closest lists and scores only their rows
+    exactly, so cost grows with nprobe * n / nlist instead of n.
+    """
+
+    def __init__(self, centroids, list_offsets, list_rows, generation=None):
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+        self.generation = generation
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, nlist=None, n_iter=10, seed=0, generation=None):
+        n = len(vectors)
+        nlist = nlist or max(1, min(n, int(4 * np.sqrt(n))))
+        centroids = spherical_kmeans(vectors, nlist, n_iter=n_iter, seed=seed)
+        labels = _assign(vectors, centroids)
+
+        # CSR layout: rows of list i are list_rows[list_offsets[i]:list_offsets[i + 1]]
+        order = np.argsort(labels, kind="stable").astype(np.int32)
+        counts = np.bincount(labels, minlength=nlist)
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(counts, out=list_offsets[1:])
+        return cls(centroids, list_offsets, order, generation=generation)
+
+    def save(self, persist_dir):
+        tmp_path = os.path.join(persist_dir, ANN_FILE + ".tmp.npz")
+        np.savez(tmp_path, centroids=self.centroids, list_offsets=self.list_offsets, list_rows=self.list_rows)
+        os.replace(tmp_path, os.path.join(persist_dir, ANN_FILE))
+        with open(os.path.join(persist_dir, ANN_META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"generation": self.generation, "nlist": self.nlist, "count": int(len(self.list_rows))}, f)
+
+    @classmethod
+    def load(cls, persist_dir):
+        if not os.path.exists(os.path.join(persist_dir, ANN_META_FILE)):
+            return None
+        with open(os.path.join(persist_dir, ANN_META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with np.load(os.path.join(persist_dir, ANN_FILE)) as data:
+            return cls(data["centroids"], data["list_offsets"], data["list_rows"], generation=meta["generation"])
+
+    def candidates(self, query, nprobe):
+        """Row ids in the `nprobe` lists whose centroids are closest to the query"""
+        nprobe = min(nprobe, self.nlist)
+        centroid_scores = self.centroids @ query
+        probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probe])
+
+    def search(self, vectors, query, k, nprobe=ANN_NPROBE, row_filter=None):
+        """Top-k (rows, scores) for a unit-norm query; `row_filter(rows)` returns a keep mask"""
+        rows = np.sort(self.candidates(query, nprobe))
+        if row_filter is not None and len(rows):
+            rows = rows[row_filter(rows)]
+        if not len(rows):
+            return rows, np.zeros(0, dtype=np.float32)
+
+        scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
+
+
+def build_ann_index(persist_dir, nlist=None, min_vectors=ANN_MIN_VECTORS):
+    """Train and persist an IVF index for the memory-mapped vectors in `persist_dir`"""
+    from mmap_vector_store import MmapVectorStore
+
+    if not MmapVectorStore.exists(persist_dir):
+        print("ANN index skipped: the store does not use the memory-mapped vector format.")
+        return None
+
+    store = MmapVectorStore.from_persist_dir(persist_dir, use_ann=False)
+    count = store.persisted_count
+    if count < min_vectors:
+        # A stale index from a larger corpus would be ignored anyway; remove it
+        for name in (ANN_FILE, ANN_META_FILE):
+            if os.path.exists(os.path.join(persist_dir, name)):
+                os.remove(os.path.join(persist_dir, name))
+        print(f"ANN index skipped: {count} vectors is below ANN_MIN_VECTORS={min_vectors}; exact search is used.")
+        return None
+
+    start_time = time.time()
+    ivf = IVFIndex.build(store._vectors, nlist=nlist, generation=store.generation)
+    ivf.save(persist_dir)
+    print(f"Built IVF index with {ivf.nlist} lists over {count} vectors in {time.time() - start_time:.2f}s")
+    return ivf
@@ -0,0 +1,110 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "86400"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))
+
+
+def normalize_query(query):
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a question"""
+    query = re.sub(r"\s+", " ", query.strip().lower())
+    return query.rstrip("?!. ")
+
+
+class AnswerCache:
+    """Two-layer response cache for chat questions.
+
+    - exact: normalized query text -> entry
+    - semantic: cosine similarity of the query embedding against cached
+      entries, served when above `threshold`
+
+    Entries are keyed on the index version, so re-ingestion invalidates them,
+    and are bounded by a TTL and an LRU entry limit.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl_seconds=ANSWER_CACHE_TTL_S,
+                 max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (index_version, normalized query) -> entry
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    def _expired(self, entry):
+        return time.time() - entry["created"] > self.ttl_seconds
+
+    def _touch(self, key, entry, layer, similarity):
+        self._entries.move_to_end(key)
+        self.stats[f"{layer}_hits"] += 1
+        return {**entry, "layer": layer, "similarity": similarity}
+
+    def get_exact(self, query, index_version):
+        key = (index_version, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                del self._entries[key]
+                return None
+            return self._touch(key, entry, "exact", 1.0)
+
+    def get_semantic(self, query_embedding, index_version):
+        """Best cached answer for this index version above the similarity threshold"""
+        query = np.array(query_embedding, dtype=np.float32)  # a copy: normalized in place below
+        query /= max(np.linalg.norm(query), 1e-12)
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if self._expired(e)]:
+                del self._entries[key]
+            keys = [k for k, e in self._entries.items() if k[0] == index_version and e["embedding"] is not None]
+            if not keys:
+                self.stats["misses"] += 1
+                return None
+            similarities = np.stack([self._entries[k]["embedding"] for k in keys]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            return self._touch(keys[best], self._entries[keys[best]], "semantic", float(similarities[best]))
+
+    def get(self, query, index_version, query_embedding=None):
+        """Exact layer first (free), then the semantic layer if an embedding is given"""
+        entry = self.get_exact(query, index_version)
+        if entry is None and query_embedding is not None:
+            entry = self.get_semantic(query_embedding, index_version)
+        elif entry is None:
+            with self._lock:
+                self.stats["misses"] += 1
+        return entry
+
+    def put(self, query, index_version, answer, pages, source_nodes, query_embedding=None):
+        embedding = None
+        if query_embedding is not None:
+            embedding = np.array(query_embedding, dtype=np.float32)  # a copy: normalized in place below
+            embedding /= max(np.linalg.norm(embedding), 1e-12)
+        key = (index_version, normalize_query(query))
+        with self._lock:
+            self._entries[key] = {
+                "query": query,
+                "answer": answer,
+                "pages": pages,
+                "source_nodes": source_nodes,
+                "embedding": embedding,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
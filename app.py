@@ -1,16 +1,15 @@
 import streamlit as st
 import os
+import time
 from dotenv import load_dotenv
 import nest_asyncio
-from llama_index.core import StorageContext, load_index_from_storage, Document
-from llama_index.core.settings import Settings
-from llama_index.llms.google_genai import GoogleGenAI
-from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
-from llama_index.core.retrievers import VectorIndexRetriever
-from llama_index.retrievers.bm25 import BM25Retriever
-from llama_index.core.query_engine import RetrieverQueryEngine
-from llama_index.core.postprocessor import SentenceTransformerRerank
-from llama_index.core import QueryBundle
+from answer_cache import AnswerCache
+from warmup import EngineWarmup
+from query_service import QueryServiceClient, QueryServiceError, QUERY_SERVICE_URL
+from filter_index import filter_choices, normalize_filters, query_filters, scoped_version, describe_filters
+
+# llama_index, the Gemini clients, BM25 and the reranker are imported by the
+# warm-up threads (warmup.py) so the page renders before they have loaded.
 
 # Apply nest_asyncio
 nest_asyncio.apply()
@@ -147,70 +146,61 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Global Settings
-Settings.llm = GoogleGenAI(
-    model="gemini-3-flash-preview",
-    system_prompt="You are an expert Financial Analyst with deep knowledge in corporate finance, accounting, and investment analysis. Your goal is to provide accurate, insightful answers based ONLY on the provided context. You MUST cite your sources including page numbers for every claim you make. If you are unsure, state that you don't know."
-)
-Settings.embed_model = GoogleGenAIEmbedding(model_name="models/text-embedding-004")
-
 STORAGE_DIR = "./storage"
 
+def configure_models():
+    """Global Settings (ensure they match ingest.py); runs on a warm-up thread"""
+    from llama_index.core.settings import Settings
+    from llama_index.llms.google_genai import GoogleGenAI
+    from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+    from tracing import install_tracing
+    from micro_batch import batched_query_embedding
+
+    Settings.llm = GoogleGenAI(
+        model="gemini-3-flash-preview",
+        system_prompt="You are an expert Financial Analyst with deep knowledge in corporate finance, accounting, and investment analysis. Your goal is to provide accurate, insightful answers based ONLY on the provided context. You MUST cite your sources including page numbers for every claim you make. If you are unsure, state that you don't know."
+    )
+    # With MICRO_BATCH=1, concurrent sessions' query embeddings share requests (micro_batch.py)
+    Settings.embed_model = batched_query_embedding(GoogleGenAIEmbedding(model_name="models/text-embedding-004"))
+
+    # Per-query stage timings, tokens and cache hits -> logs/query_traces.jsonl (see the dashboard)
+    install_tracing()
+
 @st.cache_resource
-def load_query_engine():
+def get_warmup():
+    """Start loading models, index, BM25 and reranker in the background (once per server process)"""
     if not os.path.exists(STORAGE_DIR):
         st.error(f"⚠️ Storage directory '{STORAGE_DIR}' not found. Please run `ingest.py` first.")
         return None
-    
-    try:
-        # Load index
-        storage_context = StorageContext.from_defaults(persist_dir=STORAGE_DIR)
-        index = load_index_from_storage(storage_context)
-        
-        # Get all documents for BM25
-        nodes = index.docstore.docs.values()
-        
-        # V2.0: CREATE HYBRID RETRIEVAL
-        # 1. Vector Retriever
-        vector_retriever = VectorIndexRetriever(
-            index=index,
-            similarity_top_k=10  # Increased for fusion
-        )
-        
-        # 2. BM25 Retriever (Keyword Search)
-        bm25_retriever = BM25Retriever.from_defaults(
-            nodes=list(nodes),
-            similarity_top_k=10
-        )
-        
-        # 3. Reciprocal Rank Fusion (RRF)
-        from llama_index.core.retrievers import QueryFusionRetriever
-        fusion_retriever = QueryFusionRetriever(
-            retrievers=[vector_retriever, bm25_retriever],
-            similarity_top_k=5,
-            num_queries=1,  # No query generation, just fusion
-            mode="reciprocal_rerank",
-            use_async=False
-        )
-        
-        # 4. Reranker (Cross-Encoder)
-        reranker = SentenceTransformerRerank(
-            model="cross-encoder/ms-marco-MiniLM-L-6-v2",
-            top_n=5
-        )
-        
-        # 5. Create Query Engine with Hybrid Search + Reranking
-        query_engine = RetrieverQueryEngine.from_args(
-            retriever=fusion_retriever,
-            node_postprocessors=[reranker],
-            response_mode="compact"
-        )
-        
-        return query_engine, index
-        
-    except Exception as e:
-        st.error(f"❌ Error loading index: {e}")
-        return None, None
+    return EngineWarmup(STORAGE_DIR, configure_models).start()
+
+WARMUP_LABELS = {"models": "Gemini clients", "index": "Index", "bm25": "BM25", "reranker": "Reranker"}
+WARMUP_ICONS = {"pending": "⏳", "loading": "🔄", "ready": "✅", "failed": "❌"}
+
+def render_warmup_progress(slot, warmup):
+    """Live warm-up progress in `slot` until every component has loaded"""
+    while not warmup.settled:
+        status = warmup.status()
+        text = " · ".join(f"{WARMUP_ICONS[s['state']]} {WARMUP_LABELS[name]}" for name, s in status.items())
+        slot.progress(warmup.progress(), text=f"Warming up: {text}")
+        time.sleep(0.25)
+    failed = [f"{WARMUP_LABELS[name]} ({s['error']})" for name, s in warmup.status().items() if s["state"] == "failed"]
+    if failed:
+        slot.warning("⚠️ Failed to load: " + ", ".join(failed))
+    else:
+        slot.empty()
+
+@st.cache_resource
+def get_answer_cache():
+    # One cache per server process, shared by all sessions
+    return AnswerCache()
+
+@st.cache_resource
+def get_query_client():
+    """Thin client of the shared query service (query_service.py), if QUERY_SERVICE_URL is set"""
+    return QueryServiceClient(QUERY_SERVICE_URL, source="app") if QUERY_SERVICE_URL else None
+
+query_client = get_query_client()
 
 # Sidebar
 with st.sidebar:
@@ -253,6 +243,30 @@ with st.sidebar:
     
     st.markdown("---")
     
+    # Search filters: retrieval only scores chunks from these documents, pages and years
+    st.markdown("### 🔎 Search Filters")
+    choices = filter_choices(STORAGE_DIR) if os.path.exists(STORAGE_DIR) else {"files": [], "years": []}
+    filter_files = st.multiselect("Documents", choices["files"], key="filter_files")
+    filter_years = st.multiselect("Year", choices["years"], key="filter_years")
+    page_col1, page_col2 = st.columns(2)
+    with page_col1:
+        page_from = st.number_input("From page", min_value=0, step=1, key="filter_page_from", help="0 = first page")
+    with page_col2:
+        page_to = st.number_input("To page", min_value=0, step=1, key="filter_page_to", help="0 = last page")
+    try:
+        active_filters = normalize_filters({
+            "files": filter_files,
+            "years": filter_years,
+            "pages": [int(page_from) or None, int(page_to) or None],
+        })
+    except ValueError as e:
+        st.warning(f"⚠️ {e}; searching all pages.")
+        active_filters = normalize_filters({"files": filter_files, "years": filter_years})
+    if active_filters:
+        st.caption(f"Searching: {describe_filters(active_filters)}")
+    
+    st.markdown("---")
+    
     # V2.0: EXECUTIVE BRIEFING BUTTON
     if st.button("📝 Generate Executive Briefing", use_container_width=True, type="primary"):
         st.session_state.show_briefing = True
@@ -263,6 +277,16 @@ with st.sidebar:
         st.session_state.show_briefing = False
         st.rerun()
     
+    # Answer cache counters (shared across sessions, or across every client of the query service)
+    try:
+        cache_stats = query_client.health()["answer_cache"] if query_client else get_answer_cache().stats
+        st.caption(
+            f"⚡ Answer cache: {cache_stats['exact_hits']} exact / {cache_stats['semantic_hits']} semantic hits, "
+            f"{cache_stats['misses']} misses"
+        )
+    except QueryServiceError as e:
+        st.caption(f"⚠️ {e}")
+    
     st.markdown("---")
     
     st.markdown("""
@@ -277,48 +301,11 @@ st.markdown("<h1 class='main-header'>📊 Multi-Modal RAG: Qatar Economic Analys
 st.markdown("<p class='sub-header'>Excellence Track: Hybrid Search + Reranking + Executive Briefing</p>", unsafe_allow_html=True)
 st.markdown("<div class='divider'></div>", unsafe_allow_html=True)
 
-# Load query engine and index
-result = load_query_engine()
-if result is not None:
-    query_engine, index = result
-else:
-    query_engine, index = None, None
-
-# V2.0: EXECUTIVE BRIEFING GENERATION
-def generate_executive_briefing(index):
-    """Generate structured executive briefing from document"""
-    if index is None:
-        return None
-    
-    try:
-        # Get first few document chunks
-        all_nodes = list(index.docstore.docs.values())
-        
-        # Create a summary query
-        briefing_prompt = """Based on the Qatar economic document, generate a comprehensive Executive Briefing with the following structure:
-
-**1. KEY ECONOMIC INDICATORS**
-Create a table with:
-- Indicator Name | Value | Change (%)
-
-**2. STRATEGIC RISKS**
-List top 3-5 risks with brief descriptions
-
-**3. POLICY RECOMMENDATIONS**
-Provide 3-5 actionable recommendations
-
-**4. OUTLOOK SUMMARY**
-One paragraph on future economic trajectory
-
-Be specific and cite page numbers when possible."""
-        
-        # Use the index to query
-        simple_engine = index.as_query_engine(similarity_top_k=10)
-        response = simple_engine.query(briefing_prompt)
-        
-        return response.response
-    except Exception as e:
-        return f"Error generating briefing: {e}"
+# Components load in the background; queries before they finish are served in degraded mode.
+# With a query service, it owns the engine and this process loads nothing.
+warmup = get_warmup() if query_client is None else None
+warmup_slot = st.empty()
+engine_available = query_client is not None or warmup is not None
 
 # Initialize session states early
 if "messages" not in st.session_state:
@@ -328,28 +315,40 @@ if "show_briefing" not in st.session_state:
 
 # Show Executive Briefing if requested
 if st.session_state.show_briefing:
-    if index is not None:
+    if engine_available:
         with st.expander("📋 **Executive Briefing - Qatar Economic Analysis**", expanded=True):
-            with st.spinner("🔄 Generating comprehensive briefing..."):
-                try:
-                    briefing = generate_executive_briefing(index)
-                    if briefing and "Error" not in briefing:
-                        st.markdown(briefing)
+            regenerate = st.button("🔄 Regenerate Briefing")
+            try:
+                if query_client is not None:
+                    with st.spinner("🔄 Loading briefing..."):
+                        artifact = query_client.briefing(regenerate=regenerate)
+                    index_version = artifact["index_version"]
+                else:
+                    from index_loader import read_index_version
+                    from briefing import load_briefing, get_briefing
+
+                    index_version = read_index_version(STORAGE_DIR)
+                    # Served from storage/briefing.json unless the index changed or a rebuild was asked for
+                    artifact = None if regenerate else load_briefing(STORAGE_DIR, index_version)
+                    if artifact is None:
+                        with st.spinner("🔄 Generating comprehensive briefing..."):
+                            index = warmup.wait_for("index")
+                            artifact = get_briefing(index, STORAGE_DIR, index_version, regenerate=regenerate)
                         st.success("✅ Briefing generated successfully!")
-                        
-                        # Download button
-                        st.download_button(
-                            label="⬇️ Download Briefing",
-                            data=briefing,
-                            file_name="qatar_economic_briefing.md",
-                            mime="text/markdown"
-                        )
-                    else:
-                        st.error(f"❌ Failed to generate briefing: {briefing}")
-                        st.info("💡 **Troubleshooting:**\n- Check if documents are loaded\n- Try running `python ingest.py` again\n- Check console for errors")
-                except Exception as e:
-                    st.error(f"❌ Error: {e}")
-                    st.info("Please check that the index is properly loaded.")
+                briefing = artifact["briefing"]
+                st.markdown(briefing)
+                st.caption(f"Generated {time.strftime('%Y-%m-%d %H:%M', time.localtime(artifact['generated_at']))} for index version {index_version}")
+
+                # Download button
+                st.download_button(
+                    label="⬇️ Download Briefing",
+                    data=briefing,
+                    file_name="qatar_economic_briefing.md",
+                    mime="text/markdown"
+                )
+            except Exception as e:
+                st.error(f"❌ Failed to generate briefing: {e}")
+                st.info("💡 **Troubleshooting:**\n- Check if documents are loaded\n- Try running `python ingest.py` again\n- Check console for errors")
     else:
         st.warning("⚠️ Index not loaded. Please run `python ingest.py` first.")
         st.session_state.show_briefing = False
@@ -359,7 +358,7 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 
 # Display welcome message if no chat history
-if len(st.session_state.messages) == 0 and query_engine:
+if len(st.session_state.messages) == 0 and engine_available:
     with st.chat_message("assistant"):
         st.markdown("""
         ### 👋 Welcome to Qatar Economic Analyst!
@@ -388,6 +387,66 @@ for message in st.session_state.messages:
         if "pages" in message:
             st.info(f"📄 Sources: Pages {message['pages']}")
 
+def render_sources(source_nodes, timings=None):
+    """Show page citations and source details; returns the pages string stored with the message"""
+    # Citation Logic
+    unique_pages = set()
+    for node in source_nodes:
+        page = node.node.metadata.get("page_label", "Unknown")
+        unique_pages.add(page)
+
+    sorted_pages = sorted(list(unique_pages), key=lambda x: int(x) if x.isdigit() else float('inf'))
+    pages_str = ", ".join(sorted_pages)
+
+    st.info(f"� **Sources:** Pages {pages_str}")
+
+    # Optional: Expandable source details
+    with st.expander("� View Source Details"):
+        if timings:
+            # Errored branches carry the error instead of a time (pipeline.ParallelFusionRetriever)
+            branches = [
+                f"{name}: error ({t['error']})" if t["status"] == "error" else f"{name}: {t['ms']} ms ({t['status']})"
+                for name, t in timings.items() if isinstance(t, dict) and "status" in t
+            ]
+            st.caption("⏱️ Retrieval: " + " | ".join(branches))
+        for i, node in enumerate(source_nodes):
+            page = node.node.metadata.get("page_label", "Unknown")
+            score = f"{node.score:.4f}" if node.score else "N/A"
+
+            st.markdown(f"**Source {i+1}**")
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Page", page)
+            with col2:
+                st.metric("Relevance", score)
+
+            st.markdown("**Content Preview:**")
+            st.code(node.node.get_content()[:400] + "...", language="text")
+
+            if i < len(source_nodes) - 1:
+                st.markdown("---")
+
+    return pages_str
+
+def answer_from_service(prompt):
+    """Chat answer from the query service (cache, table lookup or RAG); returns (answer, pages)"""
+    events = query_client.answer_stream(prompt, filters=active_filters)
+    with st.spinner("Analyzing Qatar economic data..."):
+        sources = next(events)
+
+    pages_str = render_sources(sources["source_nodes"], sources.get("timings"))
+    if sources["mode"] == "degraded" and "timings" in sources:
+        st.caption("⏳ Still warming up: answered with vector search only, without keyword search or reranking.")
+
+    # Display Answer, token by token
+    answer = st.write_stream(event["text"] for event in events if event["event"] == "token")
+    if "cached" in sources:
+        cached = sources["cached"]
+        st.caption(f"⚡ Served from answer cache ({cached['layer']} match, similarity {cached['similarity']:.3f})")
+    elif "table_lookup" in sources:
+        st.caption(f"⚡ Answered from the table store in {sources['table_lookup']['ms']} ms")
+    return answer, pages_str
+
 # Chat Input
 if prompt := st.chat_input("Ask about Qatar's economic data..."):
     # Add user message to history
@@ -396,54 +455,91 @@ if prompt := st.chat_input("Ask about Qatar's economic data..."):
         st.markdown(prompt)
 
     # Generate Response
-    if query_engine:
+    if query_client is not None:
         with st.chat_message("assistant"):
-            with st.spinner("Analyzing Qatar economic data..."):
-                try:
-                    response = query_engine.query(prompt)
-                    
-                    # Display Answer
-                    st.markdown(response.response)
-                    
-                    # Citation Logic
-                    unique_pages = set()
-                    for node in response.source_nodes:
-                        page = node.node.metadata.get("page_label", "Unknown")
-                        unique_pages.add(page)
-                    
-                    sorted_pages = sorted(list(unique_pages), key=lambda x: int(x) if x.isdigit() else float('inf'))
-                    pages_str = ", ".join(sorted_pages)
-                    
-                    st.info(f"� **Sources:** Pages {pages_str}")
-                    
-                    # Optional: Expandable source details
-                    with st.expander("� View Source Details"):
-                        for i, node in enumerate(response.source_nodes):
-                            page = node.node.metadata.get("page_label", "Unknown")
-                            score = f"{node.score:.4f}" if node.score else "N/A"
-                            
-                            st.markdown(f"**Source {i+1}**")
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                st.metric("Page", page)
-                            with col2:
-                                st.metric("Relevance", score)
-                            
-                            st.markdown("**Content Preview:**")
-                            st.code(node.node.get_content()[:400] + "...", language="text")
-                            
-                            if i < len(response.source_nodes) - 1:
-                                st.markdown("---")
-
-                    # Append assistant response to history
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": response.response,
-                        "pages": pages_str
-                    })
-                    
-                except Exception as e:
-                    st.error(f"❌ An error occurred: {e}")
-                    st.info("💡 Try rephrasing your question or check if the document contains the information.")
+            try:
+                answer, pages_str = answer_from_service(prompt)
+                st.session_state.messages.append({"role": "assistant", "content": answer, "pages": pages_str})
+            except QueryServiceError as e:
+                st.error(f"❌ Query service error: {e}")
+    elif warmup is not None:
+        with st.chat_message("assistant"):
+            try:
+                start_time = time.perf_counter()
+                if warmup.status()["index"]["state"] != "ready":
+                    with st.spinner("Loading index..."):
+                        warmup.wait_for("index")
+                from llama_index.core import QueryBundle
+                from llama_index.core.settings import Settings
+                from index_loader import read_index_version
+                from pipeline import timed_token_stream
+                from tracing import QueryTrace
+
+                # Full hybrid + rerank engine, or vector-only while BM25 / the reranker are still loading
+                query_engine = warmup.engine()
+                answer_cache = get_answer_cache()
+                # Answers given under filters are cached apart from unfiltered ones
+                index_version = scoped_version(read_index_version(STORAGE_DIR), active_filters)
+
+                with QueryTrace(prompt, source="app") as trace, query_filters(active_filters):
+                    trace.set("mode", query_engine.mode)
+                    # Exact repeat first (free), then a direct table lookup (no embedding call),
+                    # and only then embed once for the semantic layer and retrieval
+                    cached = answer_cache.get_exact(prompt, index_version)
+                    query_embedding = None
+                    table_response = None
+                    if cached is None:
+                        table_response = query_engine.lookup_table(prompt)
+                        if table_response is None:
+                            query_embedding = Settings.embed_model.get_query_embedding(prompt)
+                            cached = answer_cache.get_semantic(query_embedding, index_version)
+                    trace.set_cache("answer", cached["layer"] if cached is not None else "miss")
+
+                    if cached is not None:
+                        pages_str = render_sources(cached["source_nodes"])
+                        st.markdown(cached["answer"])
+                        st.caption(f"⚡ Served from answer cache ({cached['layer']} match, similarity {cached['similarity']:.3f})")
+                        answer = cached["answer"]
+                    elif table_response is not None:
+                        # Direct numeric lookup: read the cell from the table store, no retrieval or LLM call
+                        pages_str = render_sources(table_response.source_nodes)
+                        answer = table_response.response
+                        st.markdown(answer)
+                        st.caption(f"⚡ Answered from the table store in {table_response.metadata['table_lookup']['ms']} ms")
+                        # Not embedded: only exact repeats are served from the cache
+                        answer_cache.put(prompt, index_version, answer, pages_str, table_response.source_nodes)
+                    else:
+                        # Retrieval + reranking first, so sources render before generation starts.
+                        # The query embedding is reused by the vector branch.
+                        query_bundle = QueryBundle(prompt, embedding=query_embedding)
+                        with st.spinner("Analyzing Qatar economic data..."):
+                            source_nodes = query_engine.retrieve(query_bundle)
+                            timings = query_engine.retriever.last_timings
+
+                        pages_str = render_sources(source_nodes, timings)
+                        if query_engine.mode == "degraded":
+                            st.caption("⏳ Still warming up: answered with vector search only, without keyword search or reranking.")
+
+                        # Display Answer, token by token
+                        with trace.stage("synthesize"):
+                            streaming_response = query_engine.synthesize_stream(query_bundle, source_nodes)
+                            answer = st.write_stream(timed_token_stream(streaming_response.response_gen, prompt, start_time))
+
+                        answer_cache.put(prompt, index_version, answer, pages_str, source_nodes, query_embedding=query_embedding)
+
+                # Append assistant response to history
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": answer,
+                    "pages": pages_str
+                })
+
+            except Exception as e:
+                st.error(f"❌ An error occurred: {e}")
+                st.info("💡 Try rephrasing your question or check if the document contains the information.")
     else:
         st.warning("⚠️ Please run `python ingest.py` first to index your documents.")
+
+# Keep the warm-up progress live until every component has loaded
+if warmup is not None:
+    render_warmup_progress(warmup_slot, warmup)
@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import IVFIndex
+from mmap_vector_store import MmapVectorStore
+
+# Recall@k of the IVF index against exact search, across nprobe settings.
+#   python benchmarks/ann_recall.py --persist-dir ./storage
+#   python benchmarks/ann_recall.py --synthetic 200000 --dim 768
+
+
+def synthetic_vectors(n, dim, n_topics=500, seed=0):
+    """Clustered unit vectors, closer to real embedding distributions than uniform noise"""
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(n_topics, dim)).astype(np.float32)
+    vectors = topics[rng.integers(0, n_topics, size=n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(vectors, query, k):
+    scores = np.asarray(vectors, dtype=np.float32) @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def run_benchmark(vectors, k=10, n_queries=200, nprobes=(1, 2, 4, 8, 16, 32, 64), nlist=None, seed=1):
+    rng = np.random.default_rng(seed)
+    # Perturbed corpus rows stand in for queries
+    queries = np.asarray(vectors[rng.choice(len(vectors), size=n_queries, replace=False)], dtype=np.float32)
+    queries += 0.3 * rng.normal(size=queries.shape).astype(np.float32) / np.sqrt(queries.shape[1])
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start_time = time.time()
+    ivf = IVFIndex.build(vectors, nlist=nlist)
+    print(f"Built IVF index: {len(vectors)} vectors, {ivf.nlist} lists, {time.time() - start_time:.2f}s")
+
+    start_time = time.time()
+    truth = [set(exact_top_k(vectors, q, k).tolist()) for q in queries]
+    exact_ms = (time.time() - start_time) * 1000 / n_queries
+    print(f"\nExact search: {exact_ms:.2f} ms/query")
+
+    print(f"\n{'nprobe':>7} {'recall@' + str(k):>10} {'ms/query':>10} {'speedup':>8}")
+    for nprobe in nprobes:
+        if nprobe > ivf.nlist:
+            break
+        start_time = time.time()
+        found = [ivf.search(vectors, q, k, nprobe=nprobe)[0] for q in queries]
+        ann_ms = (time.time() - start_time) * 1000 / n_queries
+        recall = np.mean([len(truth[i] & set(rows.tolist())) / k for i, rows in enumerate(found)])
+        print(f"{nprobe:>7} {recall:>10.3f} {ann_ms:>10.2f} {exact_ms / ann_ms:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="IVF recall@k vs exact search")
+    parser.add_argument("--persist-dir", help="Benchmark the vectors in a memory-mapped storage dir")
+    parser.add_argument("--synthetic", type=int, default=100000, help="Number of synthetic vectors otherwise")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--nlist", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.persist_dir:
+        vectors = MmapVectorStore.from_persist_dir(args.persist_dir, use_ann=False)._vectors
+    else:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+    run_benchmark(vectors, k=args.k, n_queries=args.queries, nlist=args.nlist)
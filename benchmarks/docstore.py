@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Open time, resident memory and fetch latency of the JSON vs SQLite docstore.
+#   python benchmarks/docstore.py --nodes 50000              # synthetic corpus of report-like chunks
+#   python benchmarks/docstore.py --persist-dir ./storage    # a real store (either format)
+# Each store is measured in a fresh child process, so RSS is that of the docstore alone.
+
+WORDS = ("gdp growth inflation fiscal deficit surplus lng hydrocarbon revenue expenditure debt reform "
+         "outlook risk banking credit liquidity tourism construction investment percent year qatar").split()
+
+
+def rss_mb():
+    with open("/proc/self/status", "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def build_synthetic(target_dir, n_nodes, chars, seed=0):
+    from llama_index.core.schema import TextNode, NodeRelationship, RelatedNodeInfo
+    from llama_index.core.storage.docstore import SimpleDocumentStore
+    from sqlite_docstore import SqliteDocumentStore
+
+    rng = np.random.default_rng(seed)
+    nodes = []
+    for i in range(n_nodes):
+        page = i // 4 + 1
+        node = TextNode(
+            text=" ".join(rng.choice(WORDS, size=chars // 7)),
+            id_=f"node-{i}",
+            metadata={"file_name": f"report_{page // 200}.pdf", "page_label": str(page)}
+        )
+        node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=f"doc-{page}")
+        nodes.append(node)
+    json_dir = os.path.join(target_dir, "json")
+    sqlite_dir = os.path.join(target_dir, "sqlite")
+    legacy = SimpleDocumentStore()
+    legacy.add_documents(nodes)
+    legacy.persist(os.path.join(json_dir, "docstore.json"))
+    store = SqliteDocumentStore.from_persist_dir(sqlite_dir)
+    store.add_documents(nodes)
+    store.persist()
+    store.close()
+    return json_dir, sqlite_dir
+
+
+def child(persist_dir, fetches, k):
+    from llama_index.core.storage.docstore import SimpleDocumentStore
+    from sqlite_docstore import SqliteDocumentStore
+
+    base_rss = rss_mb()
+    start_time = time.perf_counter()
+    if SqliteDocumentStore.exists(persist_dir):
+        docstore, kind = SqliteDocumentStore.from_persist_dir(persist_dir), "sqlite"
+    else:
+        docstore, kind = SimpleDocumentStore.from_persist_dir(persist_dir), "json"
+    node_ids = list(docstore.docs)
+    open_s = time.perf_counter() - start_time
+
+    rng = np.random.default_rng(0)
+    latencies = []
+    for _ in range(fetches):
+        ids = [node_ids[i] for i in rng.choice(len(node_ids), size=k, replace=False)]
+        start_time = time.perf_counter()
+        docstore.get_nodes(ids)
+        latencies.append((time.perf_counter() - start_time) * 1000)
+    print(f"{kind:>7} {len(node_ids):>8} {open_s:>8.2f} {rss_mb() - base_rss:>9.0f} "
+          f"{np.percentile(latencies, 50):>10.2f} {np.percentile(latencies, 95):>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON vs SQLite docstore: open time, memory, fetch latency")
+    parser.add_argument("--persist-dir", default=None, help="Measure these stores instead of a synthetic corpus")
+    parser.add_argument("--nodes", type=int, default=20000)
+    parser.add_argument("--chars", type=int, default=1500, help="Characters per synthetic chunk")
+    parser.add_argument("--fetches", type=int, default=200, help="Retrieval-sized fetches to time")
+    parser.add_argument("--k", type=int, default=10, help="Nodes per fetch")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.fetches, args.k)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.persist_dir:
+            dirs = [args.persist_dir]
+        else:
+            print(f"Building {args.nodes} synthetic nodes of ~{args.chars} chars...")
+            dirs = build_synthetic(tmp, args.nodes, args.chars)
+            for d in dirs:
+                size = sum(os.path.getsize(os.path.join(d, f)) for f in os.listdir(d)) / 1e6
+                print(f"  {os.path.basename(d)}: {size:.1f} MB on disk")
+        print(f"\n{'store':>7} {'nodes':>8} {'open s':>8} {'RSS +MB':>9} {'fetch p50':>10} {'fetch p95':>10}  (ms, k={args.k})")
+        for d in dirs:
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--child", d,
+                            "--fetches", str(args.fetches), "--k", str(args.k)], check=True)
+
+
+if __name__ == "__main__":
+    main()
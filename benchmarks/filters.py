@@ -0,0 +1,106 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ann_index import build_ann_index
+from bm25_index import BM25Index
+from filter_index import FilterIndex, normalize_filters
+from mmap_vector_store import MmapVectorStore
+from benchmarks.ann_recall import synthetic_vectors
+
+# Pre-filtered retrieval (filter bitmaps) vs retrieving unfiltered and dropping
+# the non-matching hits afterwards, across filter selectivities.
+#   python benchmarks/filters.py --nodes 100000
+# "kept" is how many of the k hits survive post-filtering; pre-filtering
+# always returns k when that many chunks match.
+
+WORDS = ("gdp growth inflation fiscal deficit surplus lng hydrocarbon revenue expenditure debt reform "
+         "outlook risk banking credit liquidity tourism construction investment percent year qatar").split()
+
+
+def build_corpus(target_dir, n_nodes, dim, n_files, seed=0):
+    from llama_index.core.schema import TextNode
+
+    rng = np.random.default_rng(seed)
+    vectors = synthetic_vectors(n_nodes, dim, seed=seed)
+    rows_per_file = -(-n_nodes // n_files)
+    nodes, locations = [], {}
+    for i in range(n_nodes):
+        file_name = f"report_{2015 + i // rows_per_file}.pdf"
+        page_label = str((i % rows_per_file) // 4 + 1)
+        node = TextNode(text=" ".join(rng.choice(WORDS, size=60)), id_=f"node-{i}", embedding=vectors[i].tolist(),
+                        metadata={"file_name": file_name, "page_label": page_label})
+        nodes.append(node)
+        locations[node.node_id] = (file_name, page_label)
+
+    store = MmapVectorStore()
+    store.add(nodes)
+    store.persist(os.path.join(target_dir, "default__vector_store.json"))
+    build_ann_index(target_dir)
+    store = MmapVectorStore.from_persist_dir(target_dir)
+    bm25 = BM25Index.from_nodes(nodes)
+
+    filter_index = FilterIndex(target_dir)
+    filter_index.build_space("vector", store.persisted_node_ids, locations)
+    filter_index.build_space("bm25", bm25.node_ids, locations)
+    store.attach_filter_index(filter_index)
+    return store, bm25, filter_index, vectors
+
+
+def timed(fn, queries):
+    results = []
+    start_time = time.perf_counter()
+    for query in queries:
+        results.append(fn(query))
+    return results, (time.perf_counter() - start_time) * 1000 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filter bitmaps vs post-filtering, by selectivity")
+    parser.add_argument("--nodes", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--files", type=int, default=10, help="Synthetic documents (one per year)")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Building {args.nodes} synthetic chunks in {args.files} documents...")
+        store, bm25, filter_index, vectors = build_corpus(tmp, args.nodes, args.dim, args.files)
+        rng = np.random.default_rng(1)
+        vector_queries = np.asarray(vectors[rng.choice(args.nodes, size=args.queries, replace=False)])
+        vector_queries += 0.3 * rng.normal(size=vector_queries.shape).astype(np.float32) / np.sqrt(args.dim)
+        vector_queries /= np.linalg.norm(vector_queries, axis=1, keepdims=True)
+        text_queries = [" ".join(rng.choice(WORDS, size=4)) for _ in range(args.queries)]
+
+        pages_per_file = -(-args.nodes // args.files) // 4
+        cases = [
+            ("one year", {"years": [2015]}),
+            ("one doc, half its pages", {"files": ["report_2015.pdf"], "pages": [1, pages_per_file // 2]}),
+            ("one doc, 10 pages", {"files": ["report_2015.pdf"], "pages": [1, 10]}),
+        ]
+        print(f"\n{'filter':<26} {'rows':>7} {'branch':>7} {'pre ms':>8} {'post ms':>8} {'kept':>6}")
+        for name, filters in cases:
+            filters = normalize_filters(filters)
+            vector_mask = filter_index.mask("vector", store.persisted_node_ids, filters)
+            bm25_mask = filter_index.mask("bm25", bm25.node_ids, filters)
+            selected_ids = {i.decode("utf-8") for i in np.asarray(bm25.node_ids)[bm25_mask]}
+
+            _, pre_ms = timed(lambda q: store._search_persisted(q, args.k, None, vector_mask), vector_queries)
+            post, post_ms = timed(lambda q: store._search_persisted(q, args.k, None), vector_queries)
+            kept = np.mean([vector_mask[rows].sum() for rows, _ in post])
+            print(f"{name:<26} {int(vector_mask.sum()):>7} {'vector':>7} {pre_ms:>8.2f} {post_ms:>8.2f} {kept:>6.1f}")
+
+            _, pre_ms = timed(lambda q: bm25.search(q, args.k, doc_mask=bm25_mask), text_queries)
+            post, post_ms = timed(lambda q: bm25.search(q, args.k), text_queries)
+            kept = np.mean([sum(node_id in selected_ids for node_id, _ in hits) for hits in post])
+            print(f"{'':<26} {int(bm25_mask.sum()):>7} {'bm25':>7} {pre_ms:>8.2f} {post_ms:>8.2f} {kept:>6.1f}")
+
+
+if __name__ == "__main__":
+    main()
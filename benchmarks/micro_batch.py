@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from micro_batch import MicroBatcher
+
+# Latency vs throughput of request coalescing, to pick MICRO_BATCH windows.
+#   python benchmarks/micro_batch.py --callers 8 --windows 0,2,5,10,20
+#   python benchmarks/micro_batch.py --call-ms 150 --item-ms 2 --max-concurrency 4   # embedding-API-like
+# Each caller sends one request after another (think time --think-ms in between).
+# The simulated backend costs call-ms per call plus item-ms per item, and runs at
+# most --max-concurrency calls at once: a cross-encoder on one core is 1, a
+# rate-limited embedding API a few. "direct" is the same backend without a batcher.
+
+
+class SimulatedBackend:
+    def __init__(self, call_ms, item_ms, max_concurrency):
+        self.call_ms = call_ms
+        self.item_ms = item_ms
+        self._slots = threading.Semaphore(max_concurrency)
+        self.calls = 0
+
+    def __call__(self, items):
+        with self._slots:
+            self.calls += 1
+            time.sleep((self.call_ms + self.item_ms * len(items)) / 1000)
+        return [len(str(item)) for item in items]
+
+
+def run(call, callers, requests_per_caller, items_per_request, think_ms, seed=0):
+    latencies = []
+    lock = threading.Lock()
+
+    def caller(i):
+        rng = np.random.default_rng(seed + i)
+        for r in range(requests_per_caller):
+            time.sleep(rng.uniform(0, 2 * think_ms) / 1000)  # desynchronize callers
+            start_time = time.perf_counter()
+            call([f"{i}-{r}-{k}" for k in range(items_per_request)])
+            with lock:
+                latencies.append((time.perf_counter() - start_time) * 1000)
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(callers)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start_time
+    return np.array(latencies), len(latencies) / wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching window sweep on a simulated backend")
+    parser.add_argument("--callers", type=int, default=8, help="Concurrent users")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per caller")
+    parser.add_argument("--items", type=int, default=10, help="Items per request (1 for a query embedding)")
+    parser.add_argument("--call-ms", type=float, default=20.0, help="Fixed cost per backend call")
+    parser.add_argument("--item-ms", type=float, default=1.0, help="Cost per item")
+    parser.add_argument("--max-concurrency", type=int, default=1, help="Backend calls that can run at once")
+    parser.add_argument("--think-ms", type=float, default=20.0, help="Mean pause between a caller's requests")
+    parser.add_argument("--windows", default="0,2,5,10,20", help="Window sizes (ms) to try")
+    parser.add_argument("--max-batch", type=int, default=64)
+    args = parser.parse_args()
+
+    print(f"{args.callers} callers x {args.requests} requests x {args.items} items; "
+          f"backend {args.call_ms} ms/call + {args.item_ms} ms/item, {args.max_concurrency} at once\n")
+    print(f"{'window':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'calls':>6} {'mean batch':>11} {'queue p95':>10}")
+
+    backend = SimulatedBackend(args.call_ms, args.item_ms, args.max_concurrency)
+    latencies, throughput = run(backend, args.callers, args.requests, args.items, args.think_ms)
+    print(f"{'direct':>8} {throughput:>8.1f} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 95):>8.1f} "
+          f"{backend.calls:>6} {args.items:>11.1f} {'-':>10}")
+
+    for window in [float(w) for w in args.windows.split(",")]:
+        backend = SimulatedBackend(args.call_ms, args.item_ms, args.max_concurrency)
+        batcher = MicroBatcher(f"bench-{window}", backend, window_ms=window, max_batch_size=args.max_batch,
+                               max_concurrency=args.max_concurrency)
+        latencies, throughput = run(batcher.map, args.callers, args.requests, args.items, args.think_ms)
+        stats = batcher.stats()
+        print(f"{window:>6.0f}ms {throughput:>8.1f} {np.percentile(latencies, 50):>8.1f} "
+              f"{np.percentile(latencies, 95):>8.1f} {backend.calls:>6} {stats['mean_batch_size']:>11.1f} "
+              f"{stats.get('queue_ms_p95', 0):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from local_parser import LocalPDFParser
+
+# Local parser throughput vs worker count, on a PDF repeated N times.
+#   python benchmarks/parse.py --repeat 8
+#   python benchmarks/parse.py --pdf data/qatar_test_doc.pdf --repeat 4 --workers 1,2,4,8 --no-tables
+
+
+def repeated_pdf(pdf_path, repeat, out_path):
+    from pypdf import PdfWriter
+
+    writer = PdfWriter()
+    for _ in range(repeat):
+        writer.append(pdf_path)
+    with open(out_path, "wb") as f:
+        writer.write(f)
+    return len(writer.pages)
+
+
+def run_benchmark(pdf_path, worker_counts, tables=True):
+    print(f"{'workers':>8} {'seconds':>9} {'pages/s':>9} {'speedup':>8}")
+    baseline = None
+    reference = None
+    for workers in worker_counts:
+        parser = LocalPDFParser(max_workers=workers, tables=tables)
+        try:
+            if workers > 1:
+                parser._executor()  # Start the pool outside the timed region
+            start_time = time.perf_counter()
+            pages = parser.parse_pages(pdf_path)
+            elapsed = time.perf_counter() - start_time
+        finally:
+            parser.close()
+
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>9.2f} {len(pages) / elapsed:>9.1f} {baseline / elapsed:>7.2f}x")
+
+        # Every worker count must produce the same pages in the same order
+        if reference is None:
+            reference = pages
+        elif pages != reference:
+            print(f"  WARNING: output with {workers} workers differs from {worker_counts[0]} worker(s)")
+
+
+if __name__ == "__main__":
+    cores = os.cpu_count() or 1
+    default_workers = sorted({1, 2, 4, cores} | {w for w in (8, 16) if w <= cores})
+
+    parser = argparse.ArgumentParser(description="Page-parallel local PDF parsing benchmark")
+    parser.add_argument("--pdf", default="data/qatar_test_doc.pdf")
+    parser.add_argument("--repeat", type=int, default=4, help="Times to concatenate the PDF")
+    parser.add_argument("--workers", default=",".join(map(str, default_workers)))
+    parser.add_argument("--no-tables", action="store_true", help="Text only (skip pdfplumber tables)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, "repeated.pdf")
+        n_pages = repeated_pdf(args.pdf, args.repeat, pdf_path)
+        print(f"{args.pdf} x {args.repeat} = {n_pages} pages, {cores} core(s)\n")
+        run_benchmark(pdf_path, [int(w) for w in args.workers.split(",")], tables=not args.no_tables)
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mmap_vector_store import MmapVectorStore
+from quantization import QUANTIZERS, QUANT_RESCORE_FACTOR
+from benchmarks.ann_recall import synthetic_vectors, exact_top_k
+
+# Memory and recall@k of int8 / PQ codes against exact float32 search,
+# scoring the codes alone and with exact rescoring of the shortlist.
+#   python benchmarks/quantization.py --persist-dir ./storage
+#   python benchmarks/quantization.py --synthetic 200000 --dim 768
+
+
+def run_benchmark(vectors, k=10, n_queries=200, rescore_factors=(0, QUANT_RESCORE_FACTOR), seed=1):
+    rng = np.random.default_rng(seed)
+    # Perturbed corpus rows stand in for queries
+    queries = np.asarray(vectors[rng.choice(len(vectors), size=n_queries, replace=False)], dtype=np.float32)
+    queries += 0.3 * rng.normal(size=queries.shape).astype(np.float32) / np.sqrt(queries.shape[1])
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start_time = time.perf_counter()
+    truth = [set(exact_top_k(vectors, q, k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start_time) * 1000 / n_queries
+    full_mb = len(vectors) * vectors.shape[1] * 4 / 1e6
+
+    print(f"\n{'codes':<6} {'build s':>8} {'MB':>9} {'smaller':>8} {'rescore':>8} {'recall@' + str(k):>10} {'ms/query':>9}")
+    print(f"{'exact':<6} {'':>8} {full_mb:>9.1f} {1.0:>7.1f}x {'':>8} {1.0:>10.3f} {exact_ms:>9.2f}")
+    for kind, quantizer_cls in QUANTIZERS.items():
+        start_time = time.perf_counter()
+        quantizer = quantizer_cls.build(vectors)
+        build_s = time.perf_counter() - start_time
+        mb = quantizer.nbytes / 1e6
+        for factor in rescore_factors:
+            start_time = time.perf_counter()
+            results = [quantizer.search(vectors, q, k, rescore_factor=factor)[0] for q in queries]
+            ms = (time.perf_counter() - start_time) * 1000 / n_queries
+            recall = np.mean([len(truth_rows & set(rows.tolist())) / k for truth_rows, rows in zip(truth, results)])
+            label = f"{factor}x k" if factor else "none"
+            print(f"{kind:<6} {build_s:>8.2f} {mb:>9.1f} {full_mb / mb:>7.1f}x {label:>8} {recall:>10.3f} {ms:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantized vectors: memory and recall vs exact search")
+    parser.add_argument("--persist-dir", help="Benchmark the vectors of an ingested store")
+    parser.add_argument("--synthetic", type=int, default=50000, help="Number of synthetic vectors otherwise")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--rescore", default=f"0,2,{QUANT_RESCORE_FACTOR}",
+                        help="Comma-separated shortlist sizes, as multiples of k (0 = codes only)")
+    args = parser.parse_args()
+
+    if args.persist_dir:
+        store = MmapVectorStore.from_persist_dir(args.persist_dir, use_ann=False, use_quantized=False)
+        vectors = store._vectors
+        print(f"Loaded {len(vectors)} vectors (dim {vectors.shape[1]}, {vectors.dtype}) from '{args.persist_dir}'")
+    else:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+        print(f"Generated {len(vectors)} synthetic vectors (dim {args.dim})")
+    factors = tuple(int(f) for f in args.rescore.split(","))
+    run_benchmark(vectors, k=args.k, n_queries=min(args.queries, len(vectors)), rescore_factors=factors)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.schema import TextNode, NodeWithScore
+from rerank import make_reranker, RERANK_BATCH_SIZE, RERANK_THREADS, RERANK_MAX_LENGTH, RERANK_ONNX_FILE
+
+# Rerank latency per query and score parity against the stock SentenceTransformerRerank.
+#   python benchmarks/rerank.py --persist-dir ./storage
+#   python benchmarks/rerank.py --backends sentence-transformers,onnx,torch-int8 --threads 4
+# The first backend is the reference for score differences and top-n agreement.
+
+QUERIES = [
+    "What was Qatar's real GDP growth rate?",
+    "What are the main risks to the fiscal outlook?",
+    "How did hydrocarbon revenues change compared to the previous year?",
+    "What is the inflation forecast?",
+    "Which structural reforms are recommended?",
+    "What is the current account balance as a share of GDP?",
+    "How large is the LNG expansion programme?",
+    "What happened to public debt?",
+]
+
+
+def load_passages(persist_dir=None, n=500, seed=0):
+    if persist_dir:
+        from index_loader import load_storage_context
+        docstore = load_storage_context(persist_dir).docstore
+        node_ids = list(docstore.docs)
+        rng = np.random.default_rng(seed)
+        return docstore.get_nodes([node_ids[i] for i in rng.choice(len(node_ids), size=min(n, len(node_ids)), replace=False)])
+    # Synthetic report-like passages of realistic chunk length
+    rng = np.random.default_rng(seed)
+    words = ("gdp growth inflation fiscal deficit surplus lng hydrocarbon revenue expenditure debt reform "
+             "outlook risk banking credit liquidity tourism construction investment percent year qatar").split()
+    return [TextNode(text=" ".join(rng.choice(words, size=180)), id_=f"synthetic-{i}") for i in range(n)]
+
+
+def run_benchmark(backends, passages, queries, candidates=10, top_n=5, repeats=3, seed=1, tolerance=0.02, **kwargs):
+    rng = np.random.default_rng(seed)
+    workload = [(q, [passages[i] for i in rng.choice(len(passages), size=candidates, replace=False)])
+                for _ in range(repeats) for q in queries]
+
+    from llama_index.core import QueryBundle
+    results = {}
+    print(f"{len(workload)} queries x {candidates} candidates\n")
+    print(f"{'backend':>22} {'p50 ms':>8} {'p95 ms':>8} {'warm p50':>9}")
+    for backend in list(backends):
+        # Cold: cache disabled so every pair hits the model; top_n = all so every score is compared
+        try:
+            reranker = make_reranker(top_n=candidates, backend=backend, fallback=False, cache_size=0, **kwargs)
+        except (ImportError, OSError, RuntimeError) as e:
+            # Not installed, or the model failed to download or load
+            print(f"{backend:>22} skipped: {e}")
+            backends.remove(backend)
+            continue
+        reranker.postprocess_nodes([NodeWithScore(node=passages[0])], query_bundle=QueryBundle(queries[0]))  # warm-up
+
+        latencies, scores, orders = [], [], []
+        for query, nodes in workload:
+            start_time = time.perf_counter()
+            ranked = reranker.postprocess_nodes([NodeWithScore(node=n) for n in nodes], query_bundle=QueryBundle(query))
+            latencies.append((time.perf_counter() - start_time) * 1000)
+            by_id = {r.node.node_id: r.score for r in ranked}
+            scores.append([by_id[n.node_id] for n in nodes])
+            orders.append([r.node.node_id for r in ranked[:top_n]])
+
+        # Warm: the same questions again with the score cache on
+        warm = ""
+        if backend != "sentence-transformers":
+            cached = make_reranker(top_n=top_n, backend=backend, fallback=False, **kwargs)
+            for query, nodes in workload:
+                cached.postprocess_nodes([NodeWithScore(node=n) for n in nodes], query_bundle=QueryBundle(query))
+            warm_latencies = []
+            for query, nodes in workload:
+                start_time = time.perf_counter()
+                cached.postprocess_nodes([NodeWithScore(node=n) for n in nodes], query_bundle=QueryBundle(query))
+                warm_latencies.append((time.perf_counter() - start_time) * 1000)
+            warm = f"{np.percentile(warm_latencies, 50):.2f}"
+
+        results[backend] = {"scores": np.array(scores, dtype=np.float64), "orders": orders}
+        print(f"{backend:>22} {np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f} {warm:>9}")
+
+    if len(backends) < 2:
+        return
+    reference = backends[0]
+    print(f"\nScore parity vs '{reference}' (tolerance {tolerance}):")
+    for backend in backends[1:]:
+        diff = np.abs(results[backend]["scores"] - results[reference]["scores"])
+        agree = np.mean([a == b for a, b in zip(results[backend]["orders"], results[reference]["orders"])])
+        verdict = "PASS" if diff.max() <= tolerance else "FAIL"
+        print(f"  {backend}: max |diff| {diff.max():.4f}, mean |diff| {diff.mean():.4f}, "
+              f"identical top-{top_n} order {agree * 100:.0f}% of queries -> {verdict}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-encoder rerank latency and parity across backends")
+    parser.add_argument("--persist-dir", help="Use passages from a persisted docstore")
+    parser.add_argument("--backends", default="sentence-transformers,onnx,torch-int8")
+    parser.add_argument("--model", default=None, help="Model repo id or local dir (default: RERANK_MODEL)")
+    parser.add_argument("--candidates", type=int, default=10, help="Passages reranked per query")
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=RERANK_BATCH_SIZE)
+    parser.add_argument("--threads", type=int, default=RERANK_THREADS)
+    parser.add_argument("--max-length", type=int, default=RERANK_MAX_LENGTH)
+    parser.add_argument("--onnx-file", default=RERANK_ONNX_FILE)
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Max allowed |score diff|, in the reference's score units")
+    args = parser.parse_args()
+
+    options = {"batch_size": args.batch_size, "num_threads": args.threads, "max_length": args.max_length,
+               "onnx_file": args.onnx_file}
+    if args.model:
+        options["model"] = args.model
+    run_benchmark(
+        [b.strip() for b in args.backends.split(",") if b.strip()],
+        load_passages(args.persist_dir),
+        QUERIES,
+        candidates=args.candidates,
+        top_n=args.top_n,
+        repeats=args.repeats,
+        tolerance=args.tolerance,
+        **options
+    )
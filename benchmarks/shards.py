@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, TextNode, QueryBundle
+from ann_index import build_ann_index
+from bm25_index import BM25Index
+from mmap_vector_store import MmapVectorStore
+from pipeline import ShardedRetriever
+from shards import SHARD_SEARCH_THREADS
+from benchmarks.ann_recall import synthetic_vectors
+from benchmarks.filters import WORDS
+
+# Retrieval latency of one store vs the same corpus split over N shards
+# searched concurrently (pipeline.ShardedRetriever), per corpus size.
+#   python benchmarks/shards.py --nodes 20000,100000 --shards 1,2,4,8
+# "overlap" is the share of the single store's top-k the sharded search also
+# returns: 1.0 for vectors (same scores), below it for BM25 (per-shard IDF;
+# the small uniform synthetic vocabulary makes near-ties, so real corpora
+# overlap more). Shards only cut latency with spare cores to search them on.
+
+
+class VectorSearch(BaseRetriever):
+    def __init__(self, store, k):
+        self._store, self._k = store, k
+        super().__init__()
+
+    def _retrieve(self, query_bundle):
+        rows, scores = self._store._search_persisted(np.asarray(query_bundle.embedding, dtype=np.float32), self._k, None)
+        ids = [self._store.persisted_node_ids[r].decode("utf-8") for r in rows]
+        # The id doubles as the text: RRF tells nodes apart by their hash
+        return [NodeWithScore(node=TextNode(id_=node_id, text=node_id), score=float(s)) for node_id, s in zip(ids, scores)]
+
+
+class KeywordSearch(BaseRetriever):
+    def __init__(self, bm25, k):
+        self._bm25, self._k = bm25, k
+        super().__init__()
+
+    def _retrieve(self, query_bundle):
+        return [NodeWithScore(node=TextNode(id_=node_id, text=node_id), score=score)
+                for node_id, score in self._bm25.search(query_bundle.query_str, self._k)]
+
+
+def build_shard(target_dir, nodes):
+    os.makedirs(target_dir)
+    store = MmapVectorStore()
+    store.add(nodes)
+    store.persist(os.path.join(target_dir, "default__vector_store.json"))
+    build_ann_index(target_dir)
+    return MmapVectorStore.from_persist_dir(target_dir), BM25Index.from_nodes(nodes)
+
+
+def timed(retriever, bundles):
+    results, times = [], []
+    for bundle in bundles:
+        start_time = time.perf_counter()
+        results.append([n.node.node_id for n in retriever.retrieve(bundle)])
+        times.append((time.perf_counter() - start_time) * 1000)
+    return results, np.percentile(times, 50), np.percentile(times, 95)
+
+
+def overlap(results, baseline):
+    return np.mean([len(set(a) & set(b)) / max(len(b), 1) for a, b in zip(results, baseline)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Single store vs scatter-gather over shards")
+    parser.add_argument("--nodes", default="20000,50000", help="Comma-separated corpus sizes")
+    parser.add_argument("--shards", default="1,2,4,8", help="Comma-separated shard counts")
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+    shard_counts = [int(s) for s in args.shards.split(",")]
+    print(f"Shard search threads: {SHARD_SEARCH_THREADS}")
+
+    for n_nodes in (int(n) for n in args.nodes.split(",")):
+        rng = np.random.default_rng(0)
+        vectors = synthetic_vectors(n_nodes, args.dim)
+        nodes = [TextNode(text=" ".join(rng.choice(WORDS, size=60)), id_=f"node-{i}", embedding=vectors[i].tolist())
+                 for i in range(n_nodes)]
+        queries = np.asarray(vectors[rng.choice(n_nodes, size=args.queries, replace=False)])
+        queries += 0.3 * rng.normal(size=queries.shape).astype(np.float32) / np.sqrt(args.dim)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+        bundles = [QueryBundle(" ".join(rng.choice(WORDS, size=4)), embedding=q.tolist()) for q in queries]
+
+        print(f"\n{n_nodes} chunks")
+        print(f"{'shards':>6} {'branch':>7} {'p50 ms':>8} {'p95 ms':>8} {'overlap':>8}")
+        baseline = {}
+        for count in shard_counts:
+            with tempfile.TemporaryDirectory() as tmp:
+                shards = [build_shard(os.path.join(tmp, f"hash-{i:02d}"), nodes[i::count]) for i in range(count)]
+                branches = {
+                    "vector": {i: VectorSearch(store, args.k) for i, (store, _) in enumerate(shards)},
+                    "bm25": {i: KeywordSearch(bm25, args.k) for i, (_, bm25) in enumerate(shards)},
+                }
+                for branch, retrievers in branches.items():
+                    merge = "rank" if branch == "bm25" else "score"  # as pipeline.build_query_engine() merges them
+                    retriever = retrievers[0] if count == 1 else ShardedRetriever(retrievers, similarity_top_k=args.k,
+                                                                                 merge=merge)
+                    results, p50, p95 = timed(retriever, bundles)
+                    baseline.setdefault(branch, results)
+                    print(f"{count:>6} {branch:>7} {p50:>8.2f} {p95:>8.2f} {overlap(results, baseline[branch]):>8.2f}")
+                del shards, branches
+
+
+if __name__ == "__main__":
+    main()
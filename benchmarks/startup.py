@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import statistics
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Cold-start cost of app.py: import time and time to the first answered query.
+#   python benchmarks/startup.py --persist-dir ./storage --runs 3
+#   python benchmarks/startup.py --real-models        # Gemini clients instead of offline fakes (needs network)
+#   python benchmarks/startup.py --no-rerank          # when the cross-encoder isn't downloaded
+# Every run is a fresh interpreter, so module and model loading are measured cold.
+#   eager: the previous app.py, which imported llama_index and the Gemini clients and
+#          loaded index, BM25 and reranker one after another before the first query.
+#   lazy:  the current app.py (warmup.py). The page can render after the light imports,
+#          the first query is served vector-only as soon as the index is loaded, and the
+#          full engine is used once every component has loaded.
+# Streamlit itself is not imported; its import cost is the same in both modes.
+# By default Gemini is replaced with the offline fakes from fakes.py (embedding
+# dimension read from the store), so only local loading is measured.
+
+QUERY = "What are the main risks to the fiscal outlook?"
+
+
+def configure_models(real_models, embed_dim):
+    """The same imports as app.py; offline fakes unless real_models"""
+    from llama_index.core.settings import Settings
+    from llama_index.llms.google_genai import GoogleGenAI
+    from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+    from tracing import install_tracing
+
+    if real_models:
+        Settings.llm = GoogleGenAI(model="gemini-3-flash-preview")
+        Settings.embed_model = GoogleGenAIEmbedding(model_name="models/text-embedding-004")
+    else:
+        from fakes import FakeLLM, FakeEmbedding
+        Settings.llm = FakeLLM()
+        Settings.embed_model = FakeEmbedding(embed_dim=embed_dim or 256)
+    install_tracing()
+
+
+def run_eager(persist_dir, real_models, embed_dim, rerank=True):
+    start_time = time.perf_counter()
+    from llama_index.core.settings import Settings  # noqa: F401
+    from llama_index.llms.google_genai import GoogleGenAI  # noqa: F401
+    from llama_index.embeddings.google_genai import GoogleGenAIEmbedding  # noqa: F401
+    from llama_index.core import QueryBundle  # noqa: F401
+    from index_loader import load_index
+    from pipeline import build_query_engine
+    from answer_cache import AnswerCache  # noqa: F401
+    from briefing import load_briefing  # noqa: F401
+    from tracing import QueryTrace  # noqa: F401
+    import_seconds = time.perf_counter() - start_time
+
+    configure_models(real_models, embed_dim)
+    engine = build_query_engine(load_index(persist_dir), persist_dir, rerank=rerank)
+    engine.query(QUERY)
+    first_query_seconds = time.perf_counter() - start_time
+    return {"import_s": import_seconds, "first_query_s": first_query_seconds, "first_query_mode": engine.mode,
+            "full_warm_s": first_query_seconds}
+
+
+def run_lazy(persist_dir, real_models, embed_dim, rerank=True):
+    start_time = time.perf_counter()
+    from answer_cache import AnswerCache  # noqa: F401
+    from warmup import EngineWarmup
+    import_seconds = time.perf_counter() - start_time
+
+    if not rerank:
+        EngineWarmup._load_reranker = lambda self: None
+
+    warmup = EngineWarmup(persist_dir, lambda: configure_models(real_models, embed_dim)).start()
+    # A question asked the moment the page is up
+    engine = warmup.engine()
+    engine.query(QUERY)
+    first_query_seconds = time.perf_counter() - start_time
+    first_query_mode = engine.mode
+
+    while not warmup.settled:
+        time.sleep(0.01)
+    full_engine = warmup.engine()
+    full_engine.query(QUERY)
+    return {"import_s": import_seconds, "first_query_s": first_query_seconds, "first_query_mode": first_query_mode,
+            "full_warm_s": time.perf_counter() - start_time, "stages": warmup.status()}
+
+
+def run_child(mode, persist_dir, real_models, embed_dim, rerank=True, python=sys.executable):
+    command = [python, os.path.abspath(__file__), "--child", mode, "--persist-dir", persist_dir]
+    if real_models:
+        command.append("--real-models")
+    if not rerank:
+        command.append("--no-rerank")
+    if embed_dim:
+        command += ["--embed-dim", str(embed_dim)]
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{mode} run failed:\n{completed.stderr[-2000:]}")
+    # The result is the last stdout line; everything before it is the app's own logging
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark: eager vs lazy app start-up")
+    parser.add_argument("--persist-dir", default="./storage")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--modes", default="eager,lazy")
+    parser.add_argument("--real-models", action="store_true", help="Gemini clients instead of offline fakes")
+    parser.add_argument("--no-rerank", action="store_true", help="Skip the cross-encoder in both modes")
+    parser.add_argument("--embed-dim", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--child", choices=["eager", "lazy"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    persist_dir = os.path.abspath(args.persist_dir)
+
+    if args.child:
+        run = run_eager if args.child == "eager" else run_lazy
+        print(json.dumps(run(persist_dir, args.real_models, args.embed_dim, rerank=not args.no_rerank)))
+        return
+
+    from evaluate import stored_embed_dim
+    embed_dim = stored_embed_dim(persist_dir)
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    results = {mode: [] for mode in modes}
+    for i in range(args.runs):
+        # Interleaved so disk cache warm-up affects both modes alike
+        for mode in modes:
+            results[mode].append(run_child(mode, persist_dir, args.real_models, embed_dim, rerank=not args.no_rerank))
+            print(f"run {i + 1}/{args.runs} {mode}: first query {results[mode][-1]['first_query_s']:.2f}s")
+
+    print(f"\n{args.runs} cold starts per mode, median seconds ({'real' if args.real_models else 'fake'} models)\n")
+    print(f"{'mode':>6} {'import':>8} {'first query':>12} {'served as':>10} {'full warm':>10}")
+    for mode, runs in results.items():
+        print(f"{mode:>6} {statistics.median(r['import_s'] for r in runs):>8.2f} "
+              f"{statistics.median(r['first_query_s'] for r in runs):>12.2f} "
+              f"{runs[-1]['first_query_mode']:>10} "
+              f"{statistics.median(r['full_warm_s'] for r in runs):>10.2f}")
+    if "lazy" in results:
+        stages = results["lazy"][-1]["stages"]
+        print("\nlazy stage load times (last run): " +
+              ", ".join(f"{name} {s['seconds']}s" if s["state"] == "ready" else f"{name} {s['state']}"
+                        for name, s in stages.items()))
+
+
+if __name__ == "__main__":
+    main()
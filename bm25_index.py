@@ -0,0 +1,350 @@
+import os
+import re
+import json
+import shutil
+import threading
+from collections import Counter
+import numpy as np
+import Stemmer
+from bm25s.stopwords import STOPWORDS_EN
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from sqlite_docstore import iter_docstore_nodes
+from filter_index import current_filters
+
+BM25_META_FILE = "bm25_meta.json"
+# Per-commit deltas staged during ingestion, merged into the main index once per run
+BM25_SEGMENTS_DIR = "bm25_segments"
+SEGMENT_REMOVED_FILE = "removed_node_ids.json"
+BM25_ARRAYS = ("terms", "term_offsets", "idf", "post_docs", "post_tfs", "doc_lengths", "node_ids")
+# Per selected document, a binary search costs about this many postings scanned
+SEARCHSORTED_COST = 16
+
+# Same tokenization as llama_index's BM25Retriever (bm25s defaults + English stemmer)
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+STOPWORDS = frozenset(STOPWORDS_EN)
+_stemmer = Stemmer.Stemmer("english")
+
+
+def tokenize(text):
+    tokens = [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+    return _stemmer.stemWords(tokens)
+
+
+def _encode(strings):
+    encoded = [s.encode("utf-8") for s in strings]
+    width = max((len(e) for e in encoded), default=1) or 1
+    return np.array(encoded, dtype=f"S{width}")
+
+
+class BM25Index:
+    """BM25 inverted index stored as flat NumPy arrays (memory-mapped on load).
+
+    - terms:        sorted vocabulary (fixed-width bytes), looked up with searchsorted
+    - term_offsets: CSR offsets; postings of term i are [term_offsets[i], term_offsets[i + 1])
+    - post_docs / post_tfs: document row and term frequency of each posting
+    - idf / doc_lengths / node_ids: per-term and per-document tables
+
+    Adding or removing documents only tokenizes the new ones; the existing
+    postings are re-merged with vectorized array operations.
+    """
+
+    def __init__(self, arrays=None, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        if arrays is None:
+            arrays = {
+                "terms": _encode([]),
+                "term_offsets": np.zeros(1, dtype=np.int64),
+                "idf": np.zeros(0, dtype=np.float32),
+                "post_docs": np.zeros(0, dtype=np.int32),
+                "post_tfs": np.zeros(0, dtype=np.uint16),
+                "doc_lengths": np.zeros(0, dtype=np.int32),
+                "node_ids": _encode([]),
+            }
+        for name in BM25_ARRAYS:
+            setattr(self, name, arrays[name])
+        self.avgdl = float(np.mean(self.doc_lengths)) if len(self.doc_lengths) else 0.0
+
+    @property
+    def n_docs(self):
+        return len(self.node_ids)
+
+    @staticmethod
+    def exists(persist_dir):
+        return os.path.exists(os.path.join(persist_dir, BM25_META_FILE))
+
+    @classmethod
+    def load(cls, persist_dir):
+        with open(os.path.join(persist_dir, BM25_META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(persist_dir, f"bm25_{name}.npy"), mmap_mode="r") for name in BM25_ARRAYS}
+        return cls(arrays, k1=meta["k1"], b=meta["b"])
+
+    @classmethod
+    def from_nodes(cls, nodes, **kwargs):
+        index = cls(**kwargs)
+        index.add_nodes(nodes)
+        return index
+
+    def save(self, persist_dir):
+        os.makedirs(persist_dir, exist_ok=True)
+        for name in BM25_ARRAYS:
+            path = os.path.join(persist_dir, f"bm25_{name}.npy")
+            np.save(path + ".tmp.npy", np.asarray(getattr(self, name)))
+            os.replace(path + ".tmp.npy", path)
+        meta_path = os.path.join(persist_dir, BM25_META_FILE)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"k1": self.k1, "b": self.b, "n_docs": self.n_docs, "n_terms": len(self.terms)}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def _set_postings(self, term_ids, docs, tfs, terms, doc_lengths, node_ids):
+        """Rebuild the CSR arrays and IDF table from (term_id, doc, tf) triples"""
+        order = np.lexsort((docs, term_ids))
+        counts = np.bincount(term_ids, minlength=len(terms))
+
+        # Drop terms that no longer have postings
+        live = counts > 0
+        if not live.all():
+            remap = np.cumsum(live) - 1
+            term_ids = remap[term_ids]
+            terms = terms[live]
+            counts = counts[live]
+
+        self.terms = terms
+        self.term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.term_offsets[1:])
+        self.post_docs = docs[order].astype(np.int32)
+        self.post_tfs = np.minimum(tfs[order], np.iinfo(np.uint16).max).astype(np.uint16)
+        self.doc_lengths = doc_lengths.astype(np.int32)
+        self.node_ids = node_ids
+
+        n = len(self.doc_lengths)
+        df = counts.astype(np.float64)
+        self.idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        self.avgdl = float(np.mean(self.doc_lengths)) if n else 0.0
+
+    def _triples(self):
+        term_ids = np.repeat(np.arange(len(self.terms)), np.diff(np.asarray(self.term_offsets)))
+        return term_ids, np.asarray(self.post_docs, dtype=np.int64), np.asarray(self.post_tfs, dtype=np.int64)
+
+    def add_nodes(self, nodes):
+        """Tokenize and index only the given nodes (any iterable; each node is read once)"""
+        start_doc = self.n_docs
+        new_terms, new_docs, new_tfs, new_lengths, new_node_ids = [], [], [], [], []
+        for i, node in enumerate(nodes):
+            tokens = tokenize(node.get_content(metadata_mode=MetadataMode.EMBED))
+            new_lengths.append(len(tokens))
+            new_node_ids.append(node.node_id)
+            for term, tf in Counter(tokens).items():
+                new_terms.append(term)
+                new_docs.append(start_doc + i)
+                new_tfs.append(tf)
+        if not new_node_ids:
+            return
+
+        new_terms = _encode(new_terms)
+        terms = np.unique(np.concatenate([np.asarray(self.terms), new_terms]).astype(
+            f"S{max(self.terms.dtype.itemsize, new_terms.dtype.itemsize)}"))
+
+        old_term_ids, old_docs, old_tfs = self._triples()
+        old_term_ids = np.searchsorted(terms, np.asarray(self.terms))[old_term_ids]
+        new_term_ids = np.searchsorted(terms, new_terms)
+
+        node_ids = np.concatenate([np.asarray(self.node_ids), _encode(new_node_ids)])
+        self._set_postings(
+            np.concatenate([old_term_ids, new_term_ids]),
+            np.concatenate([old_docs, np.asarray(new_docs, dtype=np.int64)]),
+            np.concatenate([old_tfs, np.asarray(new_tfs, dtype=np.int64)]),
+            terms,
+            np.concatenate([np.asarray(self.doc_lengths), np.asarray(new_lengths, dtype=np.int32)]),
+            node_ids.astype(f"S{node_ids.dtype.itemsize}")
+        )
+
+    @classmethod
+    def merged(cls, indexes, removed_node_ids=()):
+        """One index holding the documents of all `indexes`, minus `removed_node_ids`, without re-tokenizing"""
+        indexes = [index for index in indexes if index.n_docs] or indexes[:1]
+        term_width = max(index.terms.dtype.itemsize for index in indexes)
+        id_width = max(index.node_ids.dtype.itemsize for index in indexes)
+        terms = np.unique(np.concatenate([np.asarray(index.terms).astype(f"S{term_width}") for index in indexes]))
+
+        term_ids, docs, tfs = [], [], []
+        start_doc = 0
+        for index in indexes:
+            index_term_ids, index_docs, index_tfs = index._triples()
+            term_ids.append(np.searchsorted(terms, np.asarray(index.terms).astype(f"S{term_width}"))[index_term_ids])
+            docs.append(index_docs + start_doc)
+            tfs.append(index_tfs)
+            start_doc += index.n_docs
+
+        result = cls(k1=indexes[0].k1, b=indexes[0].b)
+        result._set_postings(
+            np.concatenate(term_ids),
+            np.concatenate(docs),
+            np.concatenate(tfs),
+            terms,
+            np.concatenate([np.asarray(index.doc_lengths) for index in indexes]),
+            np.concatenate([np.asarray(index.node_ids).astype(f"S{id_width}") for index in indexes])
+        )
+        result.remove_node_ids(list(removed_node_ids))
+        return result
+
+    def remove_node_ids(self, node_ids):
+        """Drop documents by node id without re-tokenizing the rest of the corpus"""
+        if not node_ids or not self.n_docs:
+            return
+        keep_docs = ~np.isin(np.asarray(self.node_ids), _encode(node_ids))
+        if keep_docs.all():
+            return
+        new_doc_index = np.cumsum(keep_docs) - 1
+
+        term_ids, docs, tfs = self._triples()
+        keep_postings = keep_docs[docs]
+        self._set_postings(
+            term_ids[keep_postings],
+            new_doc_index[docs[keep_postings]],
+            tfs[keep_postings],
+            np.asarray(self.terms),
+            np.asarray(self.doc_lengths)[keep_docs],
+            np.asarray(self.node_ids)[keep_docs]
+        )
+
+    def search(self, query, top_k=10, doc_mask=None):
+        """Return [(node_id, score)] for the top_k documents by BM25 score.
+
+        With a boolean `doc_mask` only those documents are scored. Postings are
+        sorted by document, so when few documents are selected they are
+        binary-searched in each term's postings instead of scanning them.
+        """
+        if not self.n_docs or not len(self.terms):
+            return []
+        query_terms = _encode(sorted(set(tokenize(query))))
+        if not len(query_terms):
+            return []
+        selected = None
+        if doc_mask is not None:
+            selected = np.flatnonzero(doc_mask)
+            if not len(selected):
+                return []
+
+        positions = np.searchsorted(self.terms, query_terms)
+        positions = np.minimum(positions, len(self.terms) - 1)
+        found = positions[self.terms[positions] == query_terms]
+
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term_id in found:
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.post_docs[start:end]
+            tf = self.post_tfs[start:end]
+            if selected is not None:
+                if len(selected) * SEARCHSORTED_COST < end - start:
+                    positions = np.minimum(np.searchsorted(docs, selected), len(docs) - 1)
+                    hit = docs[positions] == selected
+                    docs, tf = selected[hit], tf[positions[hit]]
+                else:
+                    keep = doc_mask[docs]
+                    docs, tf = docs[keep], tf[keep]
+            tf = tf.astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avgdl)
+            # Lucene BM25 (bm25s' default); each document appears once per term, so += is safe
+            scores[docs] += self.idf[term_id] * tf / (tf + norm)
+
+        candidates = np.flatnonzero(scores > 0)
+        if not len(candidates):
+            return []
+        k = min(top_k, len(candidates))
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.node_ids[i].decode("utf-8"), float(scores[i])) for i in top]
+
+
+class PersistedBM25Retriever(BaseRetriever):
+    """Keyword retriever over a BM25Index persisted at ingestion time.
+
+    Nothing is read until the first query (unless an already loaded `index`
+    is passed); the arrays are memory-mapped and only the returned nodes are
+    fetched from the docstore. Inside filter_index.query_filters(), only the
+    documents the `filter_index` selects are scored.
+    """
+
+    def __init__(self, persist_dir, docstore, similarity_top_k=10, index=None, filter_index=None, **kwargs):
+        self._persist_dir = persist_dir
+        self._docstore = docstore
+        self._similarity_top_k = similarity_top_k
+        self._index = index
+        self._filter_index = filter_index
+        self._load_lock = threading.Lock()
+        super().__init__(**kwargs)
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._load_lock:
+                if self._index is None:
+                    self._index = BM25Index.load(self._persist_dir)
+        return self._index
+
+    def _retrieve(self, query_bundle):
+        doc_mask = None
+        filters = current_filters()
+        if filters is not None:
+            if self._filter_index is None:
+                raise ValueError("Metadata filters need a filter index")
+            doc_mask = self._filter_index.mask("bm25", self.index.node_ids, filters)
+        hits = self.index.search(query_bundle.query_str, self._similarity_top_k, doc_mask=doc_mask)
+        if not hits:
+            return []
+        nodes = self._docstore.get_nodes([node_id for node_id, _ in hits], raise_error=False)
+        by_id = {node.node_id: node for node in nodes if node is not None}
+        return [NodeWithScore(node=by_id[node_id], score=score) for node_id, score in hits if node_id in by_id]
+
+
+def _segment_dirs(persist_dir):
+    segments_dir = os.path.join(persist_dir, BM25_SEGMENTS_DIR)
+    if not os.path.isdir(segments_dir):
+        return []
+    # Only completed segments; a ".tmp" one was cut short by a crash
+    return [os.path.join(segments_dir, name) for name in sorted(os.listdir(segments_dir)) if name.isdigit()]
+
+
+def update_bm25_index(persist_dir, docstore, added_nodes=(), removed_node_ids=()):
+    """Stage an ingestion delta as a BM25 segment, building the index once if missing.
+
+    Only the added nodes are tokenized, into a small index of their own
+    under bm25_segments/; merge_bm25_segments() folds every segment into the
+    main index once per run, so commits cost the same however large the
+    corpus already is.
+    """
+    if not BM25Index.exists(persist_dir):
+        # First run, or a store from before BM25 was persisted: index everything once, streaming the docstore
+        bm25 = BM25Index.from_nodes(iter_docstore_nodes(docstore))
+        bm25.save(persist_dir)
+        print(f"BM25 index: {bm25.n_docs} documents, {len(bm25.terms)} terms")
+        return bm25
+
+    segment = BM25Index.from_nodes(added_nodes)
+    path = os.path.join(persist_dir, BM25_SEGMENTS_DIR, f"{len(_segment_dirs(persist_dir)):06d}")
+    shutil.rmtree(path + ".tmp", ignore_errors=True)
+    segment.save(path + ".tmp")
+    with open(os.path.join(path + ".tmp", SEGMENT_REMOVED_FILE), "w", encoding="utf-8") as f:
+        json.dump(list(removed_node_ids), f)
+    os.replace(path + ".tmp", path)
+    print(f"BM25 segment: {segment.n_docs} new document(s), {len(removed_node_ids)} removed")
+    return segment
+
+
+def merge_bm25_segments(persist_dir):
+    """Fold the staged segments into the main BM25 index (once per ingestion run)"""
+    segments = _segment_dirs(persist_dir)
+    if segments and BM25Index.exists(persist_dir):
+        removed = []
+        for path in segments:
+            with open(os.path.join(path, SEGMENT_REMOVED_FILE), "r", encoding="utf-8") as f:
+                removed.extend(json.load(f))
+        indexes = [BM25Index.load(persist_dir)] + [BM25Index.load(path) for path in segments]
+        bm25 = BM25Index.merged(indexes, removed_node_ids=removed)
+        del indexes
+        bm25.save(persist_dir)
+        print(f"BM25 index: merged {len(segments)} segment(s); {bm25.n_docs} documents, {len(bm25.terms)} terms")
+    shutil.rmtree(os.path.join(persist_dir, BM25_SEGMENTS_DIR), ignore_errors=True)
@@ -0,0 +1,290 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import Future
+from llama_index.core.settings import Settings
+from embedding_cache import text_hash, is_rate_limit_error
+from sqlite_docstore import iter_docstore_nodes
+
+BRIEFING_FNAME = "briefing.json"
+BRIEFING_CACHE_FILE = "./cache/briefing_summaries.sqlite"
+# "map_reduce" summarizes the whole corpus; "query" is the single top-10 retrieval query
+BRIEFING_MODE = os.getenv("BRIEFING_MODE", "map_reduce")
+BRIEFING_CONCURRENCY = int(os.getenv("BRIEFING_CONCURRENCY", "8"))
+BRIEFING_PAGES_PER_GROUP = int(os.getenv("BRIEFING_PAGES_PER_GROUP", "10"))
+BRIEFING_GROUP_MAX_CHARS = int(os.getenv("BRIEFING_GROUP_MAX_CHARS", "60000"))
+# Partial summaries per reduce call; more than this are reduced in several rounds
+BRIEFING_REDUCE_FANIN = int(os.getenv("BRIEFING_REDUCE_FANIN", "16"))
+BRIEFING_MAX_RETRIES = int(os.getenv("BRIEFING_MAX_RETRIES", "6"))
+
+BRIEFING_SECTIONS = """**1. KEY ECONOMIC INDICATORS**
+Create a table with:
+- Indicator Name | Value | Change (%)
+
+**2. STRATEGIC RISKS**
+List top 3-5 risks with brief descriptions
+
+**3. POLICY RECOMMENDATIONS**
+Provide 3-5 actionable recommendations
+
+**4. OUTLOOK SUMMARY**
+One paragraph on future economic trajectory"""
+
+BRIEFING_PROMPT = f"""Based on the Qatar economic document, generate a comprehensive Executive Briefing with the following structure:
+
+{BRIEFING_SECTIONS}
+
+Be specific and cite page numbers when possible."""
+
+# Bump when the map prompt changes so cached group summaries are not reused
+MAP_PROMPT_VERSION = "1"
+MAP_PROMPT = """You are preparing notes for an Executive Briefing on Qatar's economy.
+Summarize the excerpt below from {file_name}, pages {pages}. Keep:
+- every economic indicator with its value, change (%) and page
+- strategic risks
+- policy recommendations or measures
+- statements about the outlook
+Cite page numbers as (p. N). Use concise bullet points and do not add information that is not in the excerpt.
+
+---
+{text}
+---"""
+
+COMBINE_PROMPT = """Merge the following notes from consecutive parts of a Qatar economic corpus into one set of notes.
+Keep every indicator value, risk, recommendation and outlook statement with its page citation; drop only duplicates.
+
+{summaries}"""
+
+REDUCE_PROMPT = f"""The notes below summarize every section of the Qatar economic corpus, with page citations.
+Using only these notes, generate a comprehensive Executive Briefing with the following structure:
+
+{BRIEFING_SECTIONS}
+
+Be specific and keep the page citations from the notes.
+
+{{summaries}}"""
+
+# Generations in flight, shared by every session in this process: version -> Future
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def generate_query_briefing(index):
+    """Generate the briefing from a single top-10 retrieval query"""
+    simple_engine = index.as_query_engine(similarity_top_k=10)
+    response = simple_engine.query(BRIEFING_PROMPT)
+    return response.response
+
+
+class SummaryCache:
+    """SQLite cache of group summaries keyed by (model_name, group hash)"""
+
+    def __init__(self, path=BRIEFING_CACHE_FILE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS group_summaries ("
+            " model_name TEXT NOT NULL,"
+            " group_hash TEXT NOT NULL,"
+            " summary TEXT NOT NULL,"
+            " PRIMARY KEY (model_name, group_hash))"
+        )
+
+    def get(self, model_name, group_hash):
+        row = self.conn.execute(
+            "SELECT summary FROM group_summaries WHERE model_name = ? AND group_hash = ?",
+            (model_name, group_hash)
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, model_name, group_hash, summary):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO group_summaries (model_name, group_hash, summary) VALUES (?, ?, ?)",
+            (model_name, group_hash, summary)
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def _page_number(node, default):
+    match = re.match(r"\d+", str(node.metadata.get("page_label", "")))
+    return int(match.group()) if match else default
+
+
+def group_nodes(nodes, pages_per_group=BRIEFING_PAGES_PER_GROUP, max_chars=BRIEFING_GROUP_MAX_CHARS):
+    """Split nodes into per-file page windows, in reading order.
+
+    Returns [{"file_name", "pages", "text", "hash"}]. Groups never span files,
+    so re-ingesting one file only changes the hashes of that file's groups.
+    """
+    by_file = {}
+    for position, node in enumerate(nodes):
+        file_name = node.metadata.get("file_name", "unknown")
+        # Keep only the text, so `nodes` can be a stream that is never held in full
+        by_file.setdefault(file_name, []).append((_page_number(node, position + 1), position, node.get_content()))
+
+    groups = []
+    for file_name in sorted(by_file):
+        current, chars, first_page = [], 0, None
+        for page, _, text in sorted(by_file[file_name], key=lambda x: (x[0], x[1])):
+            if current and (page - first_page >= pages_per_group or chars + len(text) > max_chars):
+                groups.append((file_name, current))
+                current, chars = [], 0
+            if not current:
+                first_page = page
+            current.append((page, text))
+            chars += len(text)
+        if current:
+            groups.append((file_name, current))
+
+    result = []
+    for file_name, items in groups:
+        first, last = items[0][0], items[-1][0]
+        pages = str(first) if first == last else f"{first}-{last}"
+        text = "\n\n".join(f"[Page {page}]\n{text}" for page, text in items)
+        result.append({
+            "file_name": file_name,
+            "pages": pages,
+            "text": text,
+            "hash": text_hash(f"{MAP_PROMPT_VERSION}\0{file_name}\0{pages}\0{text}")
+        })
+    return result
+
+
+async def _complete_with_retry(llm, prompt, semaphore, max_retries):
+    """One LLM call under the concurrency limit, backing off on rate-limit errors"""
+    delay = 1.0
+    for attempt in range(max_retries + 1):
+        async with semaphore:
+            try:
+                return (await llm.acomplete(prompt)).text
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == max_retries:
+                    raise
+        wait = delay * (1 + random.random())
+        print(f"Rate limited; retrying briefing call in {wait:.1f}s (attempt {attempt + 1}/{max_retries})")
+        await asyncio.sleep(wait)
+        delay = min(delay * 2, 60.0)
+
+
+async def agenerate_map_reduce_briefing(nodes, llm, cache=None, concurrency=BRIEFING_CONCURRENCY,
+                                        fanin=BRIEFING_REDUCE_FANIN, max_retries=BRIEFING_MAX_RETRIES):
+    """Summarize every page group in parallel, then reduce the notes into the briefing sections"""
+    start_time = time.time()
+    model_name = getattr(llm, "model", None) or type(llm).__name__
+    semaphore = asyncio.Semaphore(concurrency)
+    groups = group_nodes(nodes)
+    if not groups:
+        raise ValueError("The index has no documents to summarize")
+
+    # Map: one call per group not already summarized
+    summaries = [cache.get(model_name, g["hash"]) if cache is not None else None for g in groups]
+    cached = sum(1 for s in summaries if s is not None)
+
+    async def summarize(i):
+        group = groups[i]
+        prompt = MAP_PROMPT.format(file_name=group["file_name"], pages=group["pages"], text=group["text"])
+        summaries[i] = await _complete_with_retry(llm, prompt, semaphore, max_retries)
+        if cache is not None:
+            cache.put(model_name, group["hash"], summaries[i])
+
+    await asyncio.gather(*(summarize(i) for i, s in enumerate(summaries) if s is None))
+    print(f"Briefing map: {len(groups)} group(s), {cached} from cache, "
+          f"{len(groups) - cached} summarized in {time.time() - start_time:.2f}s")
+
+    # Reduce: merge notes in rounds of `fanin` until one call can see them all
+    notes = [f"### {g['file_name']}, pages {g['pages']}\n{s}" for g, s in zip(groups, summaries)]
+    while len(notes) > fanin:
+        chunks = ["\n\n".join(notes[i:i + fanin]) for i in range(0, len(notes), fanin)]
+        notes = await asyncio.gather(*(
+            _complete_with_retry(llm, COMBINE_PROMPT.format(summaries=chunk), semaphore, max_retries)
+            for chunk in chunks
+        ))
+    briefing = await _complete_with_retry(
+        llm, REDUCE_PROMPT.format(summaries="\n\n".join(notes)), semaphore, max_retries
+    )
+    print(f"Briefing generated in {time.time() - start_time:.2f}s")
+    return briefing
+
+
+def generate_map_reduce_briefing(index, llm=None, **kwargs):
+    """Briefing over every node in the docstore, with group summaries cached on disk"""
+    # Streamed: grouping keeps each node's text, not the node objects
+    nodes = iter_docstore_nodes(index.docstore)
+    cache = SummaryCache()
+    try:
+        return asyncio.run(agenerate_map_reduce_briefing(nodes, llm or Settings.llm, cache=cache, **kwargs))
+    finally:
+        cache.close()
+
+
+def generate_executive_briefing(index, mode=BRIEFING_MODE):
+    """Generate structured executive briefing from document"""
+    if mode == "query":
+        return generate_query_briefing(index)
+    return generate_map_reduce_briefing(index)
+
+
+def load_briefing(persist_dir, index_version, mode=BRIEFING_MODE):
+    """Return the persisted briefing if it was generated for this index version and mode"""
+    path = os.path.join(persist_dir, BRIEFING_FNAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            artifact = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if artifact.get("version") != index_version or artifact.get("mode", "query") != mode:
+        return None
+    return artifact
+
+
+def save_briefing(persist_dir, index_version, briefing, mode=BRIEFING_MODE):
+    artifact = {"version": index_version, "mode": mode, "briefing": briefing, "generated_at": time.time()}
+    path = os.path.join(persist_dir, BRIEFING_FNAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(artifact, f)
+    os.replace(path + ".tmp", path)
+    return artifact
+
+
+def get_briefing(index, persist_dir, index_version, regenerate=False, generate_fn=generate_executive_briefing):
+    """Serve the briefing for this index version, generating it at most once.
+
+    The artifact is persisted next to the index, so later reruns and new
+    processes read it from disk. Concurrent callers for the same version share
+    one in-flight generation instead of starting their own. Failures are
+    raised and never persisted.
+    """
+    if not regenerate:
+        artifact = load_briefing(persist_dir, index_version)
+        if artifact is not None:
+            return artifact
+
+    with _inflight_lock:
+        future = _inflight.get(index_version)
+        owner = future is None
+        if owner:
+            future = Future()
+            _inflight[index_version] = future
+
+    if not owner:
+        return future.result()
+
+    try:
+        artifact = save_briefing(persist_dir, index_version, generate_fn(index))
+        future.set_result(artifact)
+        return artifact
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(index_version, None)
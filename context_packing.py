@@ -0,0 +1,246 @@
+import os
+import re
+import math
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from llama_index.core.utils import get_tokenizer
+from bm25_index import tokenize
+from tracing import current_trace
+
+CONTEXT_PACKING_ENABLED = os.getenv("CONTEXT_PACKING", "1") != "0"
+# Tokens of chunk text (metadata included) handed to the synthesizer; 0 disables packing
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Chunks whose word-trigram Jaccard similarity with a better-ranked chunk reaches this are dropped
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9\"'(])")
+TABLE_SEPARATOR_RE = re.compile(r"^\|?[\s:|-]+\|?$")
+BLOCK_START_RE = re.compile(r"^([-*•]\s|\d+[.)]\s)")
+GAP = "\n[...]\n"
+SHORT_LINE_WORDS = 6
+
+
+def _count_tokens(text):
+    return len(get_tokenizer()(text)) if text else 0
+
+
+def _unit_key(text, kind="sentence"):
+    """Text with case, punctuation and spacing normalized, to spot repeated headers and footers.
+
+    Short lines of prose also ignore digits, so running headers that differ
+    only by page number ("INTERNATIONAL MONETARY FUND 7") match.
+    """
+    key = re.sub(r"\W+", " ", text.lower()).strip()
+    if kind == "sentence" and len(key.split()) <= SHORT_LINE_WORDS:
+        key = re.sub(r"\s*\d+\s*", " ", key).strip()
+    return key
+
+
+def _shingles(text, n=3):
+    words = _unit_key(text).split()
+    return {tuple(words[i:i + n]) for i in range(max(len(words) - n + 1, 1))} if words else set()
+
+
+def _jaccard(a, b):
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+def split_units(text):
+    """Split chunk text into sentences and markdown table rows.
+
+    Hard-wrapped lines of prose are rejoined into paragraphs first. Returns a
+    list of dicts with the unit `text`, its `line` (paragraph or row
+    number), `kind` ("sentence", "header" or "row") and, for rows, the index
+    of the header unit of their table. The header unit carries the |---|
+    separator line.
+    """
+    units = []
+    header = None
+    paragraph = []
+    line_no = 0
+
+    def flush():
+        nonlocal line_no
+        if paragraph:
+            for sentence in SENTENCE_RE.split(" ".join(paragraph)):
+                if sentence.strip():
+                    units.append({"text": sentence.strip(), "line": line_no, "kind": "sentence", "header": None})
+            paragraph.clear()
+            line_no += 1
+
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line:
+            flush()
+            header = None
+            continue
+        if line.startswith("|"):
+            flush()
+            if TABLE_SEPARATOR_RE.match(line):
+                if header is not None and units[header]["text"].count("\n") == 0:
+                    units[header]["text"] += "\n" + line
+                continue
+            if header is None:
+                header = len(units)
+                units.append({"text": line, "line": line_no, "kind": "header", "header": None})
+            else:
+                units.append({"text": line, "line": line_no, "kind": "row", "header": header})
+            line_no += 1
+            continue
+        header = None
+        # Headings and running headers ("QATAR", "INTERNATIONAL MONETARY FUND 7") stand alone
+        if line.startswith("#") or not any(c.islower() for c in line):
+            flush()
+            paragraph.append(line)
+            flush()
+            continue
+        # List items and lines after a full stop start a new paragraph
+        if BLOCK_START_RE.match(line) or (paragraph and paragraph[-1].endswith((".", "!", "?", ":"))):
+            flush()
+        paragraph.append(line)
+    flush()
+    return units
+
+
+def _join(units, kept):
+    """Kept units in their original order, with [...] where text was left out"""
+    parts = []
+    previous = None
+    for i, unit in enumerate(units):
+        if i not in kept:
+            continue
+        if previous is not None:
+            if i != previous + 1:
+                parts.append(GAP)
+            elif unit["line"] != units[previous]["line"]:
+                parts.append("\n")
+            else:
+                parts.append(" ")
+        parts.append(unit["text"])
+        previous = i
+    return "".join(parts)
+
+
+def pack_nodes(nodes, query, budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD):
+    """Fit `nodes` (best first) into `budget` tokens, metadata included; returns (packed nodes, stats).
+
+    Chunks that nearly duplicate a better-ranked one are dropped, and so are
+    sentences or rows already seen in a better-ranked chunk (repeated page
+    headers and footers). The remaining sentences and table rows are chosen
+    by the query terms they contain, weighted by how rare those terms are
+    among the candidates, and the rest of the budget is filled in rank
+    order. Each packed node keeps its id, score and metadata (file and
+    page), so citations still point at the page every kept piece came from.
+    """
+    stats = {"budget": budget, "nodes_in": len(nodes), "tokens_in": 0, "duplicates": 0, "repeated_units": 0}
+    overhead = []
+    for n in nodes:
+        text_tokens = _count_tokens(n.node.get_content(metadata_mode=MetadataMode.NONE))
+        stats["tokens_in"] += text_tokens
+        # Metadata header the synthesizer prints above each chunk
+        overhead.append(max(_count_tokens(n.node.get_content(metadata_mode=MetadataMode.LLM)) - text_tokens, 0))
+
+    # 1. Near-duplicate chunks
+    candidates = []
+    kept_shingles = []
+    for rank, n in enumerate(nodes):
+        shingles = _shingles(n.node.get_content(metadata_mode=MetadataMode.NONE))
+        if any(_jaccard(shingles, other) >= dedup_threshold for other in kept_shingles):
+            stats["duplicates"] += 1
+            continue
+        kept_shingles.append(shingles)
+        candidates.append(rank)
+
+    # 2. Units, dropping those repeated from a better-ranked chunk
+    units = {}
+    seen = set()
+    for rank in candidates:
+        node_units = split_units(nodes[rank].node.get_content(metadata_mode=MetadataMode.NONE))
+        for unit in node_units:
+            key = _unit_key(unit["text"], unit["kind"])
+            unit["repeated"] = len(key) < 3 or key in seen
+            stats["repeated_units"] += unit["repeated"] and len(key) >= 3
+            seen.add(key)
+            unit["terms"] = set(tokenize(unit["text"]))
+            unit["tokens"] = _count_tokens(unit["text"]) + 1
+        units[rank] = node_units
+
+    # 3. Score by rare query terms
+    query_terms = set(tokenize(query))
+    all_units = [u for rank in candidates for u in units[rank] if not u["repeated"]]
+    df = {t: sum(1 for u in all_units if t in u["terms"]) for t in query_terms}
+    idf = {t: math.log(1 + len(all_units) / df[t]) for t in query_terms if df[t]}
+    order = []
+    for rank in candidates:
+        for i, unit in enumerate(units[rank]):
+            if unit["repeated"]:
+                continue
+            score = sum(idf.get(t, 0.0) for t in unit["terms"] & query_terms)
+            if score > 0 and any(c.isdigit() for c in unit["text"]):
+                score *= 1.1  # figures usually carry the answer
+            order.append((-score, rank, i) if score > 0 else (0.0, rank, i))
+    order.sort()
+
+    # 4. Greedy fill: matching units first, then the rest in rank order
+    kept = {rank: set() for rank in candidates}
+    gap_tokens = _count_tokens(GAP)
+    used = 0
+    for _, rank, i in order:
+        unit = units[rank][i]
+        wanted = [i]
+        if unit["kind"] == "row" and unit["header"] not in kept[rank]:
+            wanted.append(unit["header"])
+        cost = sum(units[rank][j]["tokens"] for j in wanted)
+        if not kept[rank]:
+            cost += overhead[rank]
+        elif i - 1 not in kept[rank] and i + 1 not in kept[rank]:
+            cost += gap_tokens
+        if used + cost > budget and used > 0:
+            continue  # the best unit is always kept, even over budget
+        kept[rank].update(wanted)
+        used += cost
+
+    packed = []
+    for rank in candidates:
+        if not kept[rank]:
+            continue
+        original = nodes[rank]
+        node = original.node.model_copy()
+        node.set_content(_join(units[rank], kept[rank]))
+        packed.append(NodeWithScore(node=node, score=original.score))
+    stats["nodes_out"] = len(packed)
+    stats["tokens_out"] = sum(_count_tokens(n.node.get_content(metadata_mode=MetadataMode.NONE)) for n in packed)
+    return packed, stats
+
+
+class ContextPacker(BaseNodePostprocessor):
+    """Packs the reranked chunks into a token budget before synthesis (see pack_nodes()).
+
+    Chunk-text tokens before and after packing are recorded in the active
+    trace under "context".
+    """
+
+    budget: int = CONTEXT_TOKEN_BUDGET
+    dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD
+
+    @classmethod
+    def class_name(cls):
+        return "ContextPacker"
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if not nodes:
+            return []
+        packed, stats = pack_nodes(nodes, query_bundle.query_str, self.budget, self.dedup_threshold)
+        trace = current_trace()
+        if trace is not None:
+            trace.set("context", stats)
+        return packed
+
+
+def make_context_packer(budget=CONTEXT_TOKEN_BUDGET):
+    """ContextPacker, or None when packing is disabled (CONTEXT_PACKING=0 or a budget of 0)"""
+    if not CONTEXT_PACKING_ENABLED or budget is None or budget <= 0:
+        return None
+    return ContextPacker(budget=budget)
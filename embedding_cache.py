@@ -0,0 +1,141 @@
+import os
+import time
+import random
+import asyncio
+import sqlite3
+import hashlib
+import numpy as np
+from llama_index.core.schema import MetadataMode
+
+EMBEDDING_CACHE_FILE = "./cache/embeddings.sqlite"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "8"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def is_rate_limit_error(error):
+    """Best-effort detection of quota/rate-limit errors across client libraries"""
+    code = getattr(error, "code", None) or getattr(error, "status_code", None)
+    if code == 429:
+        return True
+    message = str(error).lower()
+    return "429" in message or "resource_exhausted" in message or "rate limit" in message
+
+
+class EmbeddingCache:
+    """SQLite cache of embeddings keyed by (model_name, sha256 of the embedded text)"""
+
+    def __init__(self, path=EMBEDDING_CACHE_FILE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model_name TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " PRIMARY KEY (model_name, text_hash))"
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, model_name, hashes):
+        """Return {text_hash: vector} for the hashes already in the cache"""
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model_name = ? AND text_hash IN ({placeholders})",
+                [model_name, *chunk]
+            )
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+        self.hits += sum(1 for h in hashes if h in found)
+        self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model_name, items):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model_name, text_hash, vector) VALUES (?, ?, ?)",
+            [(model_name, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items]
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+async def _embed_batch_with_retry(embed_model, texts, semaphore, max_retries):
+    """Embed one batch under the concurrency limit, backing off on rate-limit errors"""
+    delay = 1.0
+    for attempt in range(max_retries + 1):
+        async with semaphore:
+            try:
+                return await embed_model.aget_text_embedding_batch(texts)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == max_retries:
+                    raise
+        # Exponential backoff with jitter, outside the semaphore so other batches keep going
+        wait = delay * (1 + random.random())
+        print(f"Rate limited; retrying batch of {len(texts)} in {wait:.1f}s (attempt {attempt + 1}/{max_retries})")
+        await asyncio.sleep(wait)
+        delay = min(delay * 2, 60.0)
+
+
+async def aembed_nodes(nodes, embed_model, cache=None, batch_size=EMBED_BATCH_SIZE,
+                       concurrency=EMBED_CONCURRENCY, max_retries=EMBED_MAX_RETRIES):
+    """Set `node.embedding` on every node, serving repeats from the cache.
+
+    Cache misses are de-duplicated, split into `batch_size` batches and sent
+    with at most `concurrency` requests in flight. VectorStoreIndex skips
+    nodes that already carry an embedding, so the index never re-embeds them.
+    """
+    model_name = embed_model.model_name
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    hashes = [text_hash(text) for text in texts]
+
+    vectors = cache.get_many(model_name, hashes) if cache is not None else {}
+
+    # Embed each distinct missing text once
+    missing = {}
+    for key, text in zip(hashes, texts):
+        if key not in vectors:
+            missing.setdefault(key, text)
+    missing_keys = list(missing)
+
+    if missing_keys:
+        start_time = time.time()
+        semaphore = asyncio.Semaphore(concurrency)
+        batches = [missing_keys[i:i + batch_size] for i in range(0, len(missing_keys), batch_size)]
+
+        async def run(batch):
+            embeddings = await _embed_batch_with_retry(
+                embed_model, [missing[key] for key in batch], semaphore, max_retries
+            )
+            items = list(zip(batch, embeddings))
+            vectors.update(items)
+            if cache is not None:
+                # Commit per batch so an interrupted run keeps what it paid for
+                cache.put_many(model_name, items)
+
+        await asyncio.gather(*(run(batch) for batch in batches))
+        print(f"Embedded {len(missing_keys)} new chunk(s) in {len(batches)} batch(es) "
+              f"in {time.time() - start_time:.2f}s")
+
+    for node, key in zip(nodes, hashes):
+        node.embedding = vectors[key]
+
+    print(f"Embeddings: {len(nodes) - len(missing_keys)}/{len(nodes)} served from cache")
+    return nodes
+
+
+def embed_nodes(nodes, embed_model, cache=None, **kwargs):
+    """Synchronous wrapper around aembed_nodes"""
+    return asyncio.run(aembed_nodes(nodes, embed_model, cache=cache, **kwargs))
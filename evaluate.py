@@ -1,12 +1,19 @@
 import os
+import re
+import json
 import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 import nest_asyncio
-from llama_index.core import StorageContext, load_index_from_storage
-from llama_index.core.settings import Settings
-from llama_index.llms.google_genai import GoogleGenAI
-from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+# Engine-side modules (llama_index, pipeline, bm25s, models) are imported only when
+# the engine runs in this process, so service mode stays a thin client
+from query_service import QueryServiceClient, QUERY_SERVICE_URL
+from filter_index import normalize_filters, query_filters, describe_filters
+from shards import shard_dirs
 
 # Apply nest_asyncio
 nest_asyncio.apply()
@@ -14,17 +21,11 @@ nest_asyncio.apply()
 # Load environment variables
 load_dotenv()
 
-# Global Settings (ensure they match ingest.py)
-Settings.llm = GoogleGenAI(
-    model="gemini-3-flash-preview",
-    system_prompt="You are an expert Financial Analyst. Provide accurate answers based ONLY on the provided context."
-)
-Settings.embed_model = GoogleGenAIEmbedding(model_name="models/text-embedding-004")
-
 STORAGE_DIR = "./storage"
 RESULTS_FILE = "benchmark_results.csv"
+SUMMARY_FILE = "benchmark_summary.json"
 
-# Complex Queries to Benchmark
+# Complex Queries to Benchmark (used when no --queries file is given)
 QUERIES = [
     "Summarize the key financial highlights from the document.",
     "What are the risk factors mentioned? details please.",
@@ -33,57 +34,310 @@ QUERIES = [
     "Compare the operating expenses between the current and previous periods."
 ]
 
-def run_evaluation():
-    if not os.path.exists(STORAGE_DIR):
-        print(f"Storage directory '{STORAGE_DIR}' not found. Please run ingest.py first.")
-        return
-
-    print("Loading Index...")
-    storage_context = StorageContext.from_defaults(persist_dir=STORAGE_DIR)
-    index = load_index_from_storage(storage_context)
-    query_engine = index.as_query_engine()
-
-    results = []
-
-    print("Starting Benchmark...")
-    for query in QUERIES:
-        print(f"Running query: {query}")
-        start_time = time.time()
-        
-        try:
-            response = query_engine.query(query)
-            end_time = time.time()
-            latency = end_time - start_time
-            answer = response.response
-            
-            # Extract page citations if possible
-            pages = set()
-            for node in response.source_nodes:
-                pages.add(node.node.metadata.get("page_label", "Unknown"))
-            pages_str = ", ".join(pages)
-
-            results.append({
-                "Query": query,
-                "Latency (s)": round(latency, 2),
-                "Pages Cited": pages_str,
-                "Answer Preview": answer[:100] + "..." if len(answer) > 100 else answer
-            })
-            print(f"Completed in {latency:.2f}s")
-            
-        except Exception as e:
-            print(f"Error querying '{query}': {e}")
-            results.append({
-                "Query": query,
-                "Latency (s)": -1,
-                "Pages Cited": "Error",
-                "Answer Preview": str(e)
-            })
+def configure_models(fake_llm=False, fake_embed=False, llm_delay=0.0, embed_delay=0.0, embed_dim=None):
+    """Global Settings (ensure they match ingest.py), or offline fakes for overhead-only runs"""
+    from llama_index.core.settings import Settings
+    from micro_batch import batched_query_embedding
+
+    if fake_llm:
+        from fakes import FakeLLM
+        Settings.llm = FakeLLM(delay=llm_delay)
+    else:
+        from llama_index.llms.google_genai import GoogleGenAI
+        Settings.llm = GoogleGenAI(
+            model="gemini-3-flash-preview",
+            system_prompt="You are an expert Financial Analyst. Provide accurate answers based ONLY on the provided context."
+        )
+    if fake_embed:
+        from fakes import FakeEmbedding
+        # The query vector must match the dimension of the stored chunk vectors
+        Settings.embed_model = FakeEmbedding(embed_dim=embed_dim or 256, delay=embed_delay)
+    else:
+        from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+        Settings.embed_model = GoogleGenAIEmbedding(model_name="models/text-embedding-004")
+    # With MICRO_BATCH=1, concurrent queries' embeddings share one call, as in the app
+    Settings.embed_model = batched_query_embedding(Settings.embed_model)
+
+def load_queries(path=None):
+    """Queries from a .txt (one per line), .json (list) or .jsonl ({"query": ...} per line) file.
+
+    .json/.jsonl entries may also list the facts a good answer contains, as
+    {"query": ..., "expected": ["4.5%", "LNG"]}; see load_expected().
+    """
+    if path is None:
+        return list(QUERIES)
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            queries = [json.loads(line)["query"] for line in f if line.strip()]
+        elif path.endswith(".json"):
+            queries = [q["query"] if isinstance(q, dict) else q for q in json.load(f)]
+        else:
+            queries = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not queries:
+        raise ValueError(f"No queries found in '{path}'")
+    return queries
+
+def load_expected(path=None):
+    """query -> expected facts, from the "expected" field of .json/.jsonl query files"""
+    if path is None or not path.endswith((".json", ".jsonl")):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            entries = [json.loads(line) for line in f if line.strip()]
+        else:
+            entries = json.load(f)
+    expected = {}
+    for entry in entries:
+        if isinstance(entry, dict) and entry.get("expected"):
+            facts = entry["expected"]
+            expected[entry["query"]] = [facts] if isinstance(facts, str) else list(facts)
+    return expected
+
+def count_tokens(text):
+    from llama_index.core.utils import get_tokenizer
+    return len(get_tokenizer()(text)) if text else 0
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text.lower())
+
+def fact_recall(facts, text):
+    """Share of expected facts found in `text` (case- and spacing-insensitive substring match)"""
+    if not facts:
+        return None
+    text = _normalize(text)
+    return round(sum(1 for fact in facts if _normalize(fact) in text) / len(facts), 3)
+
+def stored_embed_dim(persist_dir):
+    """Dimension of the persisted chunk vectors (memory-mapped store only)"""
+    from mmap_vector_store import META_FILE as VECTOR_META_FILE
+
+    # Every shard of a sharded store is embedded with the same model
+    persist_dir = next(iter(shard_dirs(persist_dir).values()), persist_dir)
+    meta_path = os.path.join(persist_dir, VECTOR_META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        return json.load(f).get("dim")
+
+def run_query(query_engine, query, source="evaluate", filters=None, expected=None):
+    """One timed, traced query, restricted to `filters`; never raises, errors are recorded in the result row.
+
+    With `expected` facts, the row also records how many of them the answer
+    and the context sent to the LLM contain.
+    """
+    start_time = time.perf_counter()
+    try:
+        if isinstance(query_engine, QueryServiceClient):
+            # Traced by the service, under this source
+            response = query_engine.query(query, source=source, filters=filters)
+        else:
+            from tracing import QueryTrace
+            with QueryTrace(query, source=source), query_filters(filters):
+                response = query_engine.query(query)
+        latency = time.perf_counter() - start_time
+        answer = response.response or ""
+
+        # Extract page citations if possible
+        pages = []
+        for node in response.source_nodes:
+            page = node.node.metadata.get("page_label", "Unknown")
+            if page not in pages:
+                pages.append(page)
+        timings = (response.metadata or {}).get("retrieval_timings", {})
+        # Tokens of chunk text sent to the LLM, and before context packing when it ran
+        context = (response.metadata or {}).get("context", {})
+        context_text = "\n".join(node.node.get_content() for node in response.source_nodes)
+        context_tokens = sum(count_tokens(node.node.get_content()) for node in response.source_nodes)
+
+        return {
+            "Query": query,
+            "Latency (s)": round(latency, 3),
+            "Retrieval (ms)": timings.get("total_ms"),
+            # "table": answered by the table-store fast path; "rag": retrieval + LLM
+            "Path": "table" if "table_lookup" in (response.metadata or {}) else "rag",
+            "Pages Cited": ", ".join(pages),
+            "Context Tokens": context_tokens if response.source_nodes else None,
+            "Unpacked Tokens": context.get("tokens_in", context_tokens) if response.source_nodes else None,
+            "Answer Facts": fact_recall(expected, answer),
+            "Context Facts": fact_recall(expected, context_text),
+            "Answer Preview": answer[:100] + "..." if len(answer) > 100 else answer,
+            "Error": ""
+        }
+    except Exception as e:
+        print(f"Error querying '{query}': {e}")
+        return {
+            "Query": query,
+            "Latency (s)": -1,
+            "Retrieval (ms)": None,
+            "Path": "",
+            "Pages Cited": "Error",
+            "Context Tokens": None,
+            "Unpacked Tokens": None,
+            "Answer Facts": None,
+            "Context Facts": None,
+            "Answer Preview": str(e),
+            "Error": type(e).__name__
+        }
+
+def run_load(query_engine, queries, concurrency=1, repeat=1, filters=None, expected=None):
+    """Run every query `repeat` times with `concurrency` in flight; returns (rows, wall-clock seconds)"""
+    expected = expected or {}
+    workload = [query for _ in range(repeat) for query in queries]
+    done = 0
+    lock = threading.Lock()
+
+    def task(query):
+        nonlocal done
+        row = run_query(query_engine, query, filters=filters, expected=expected.get(query))
+        with lock:
+            done += 1
+            print(f"[{done}/{len(workload)}] {row['Latency (s)']}s  {query[:60]}")
+        return row
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        rows = list(pool.map(task, workload))
+    return rows, time.perf_counter() - start_time
+
+def summarize(rows, wall_time, concurrency):
+    latencies = np.array([r["Latency (s)"] for r in rows if r["Latency (s)"] >= 0])
+    errors = sum(1 for r in rows if r["Latency (s)"] < 0)
+    summary = {
+        "requests": len(rows),
+        "concurrency": concurrency,
+        "errors": errors,
+        "error_rate": round(errors / len(rows), 4) if rows else 0.0,
+        "wall_time_s": round(wall_time, 3),
+        "qps": round(len(latencies) / wall_time, 3) if wall_time > 0 else 0.0,
+    }
+    if len(latencies):
+        for name, q in (("p50", 50), ("p95", 95), ("p99", 99)):
+            summary[f"{name}_s"] = round(float(np.percentile(latencies, q)), 3)
+        summary["mean_s"] = round(float(latencies.mean()), 3)
+        summary["max_s"] = round(float(latencies.max()), 3)
+    retrieval_ms = np.array([r["Retrieval (ms)"] for r in rows if r["Retrieval (ms)"] is not None], dtype=np.float64)
+    if len(retrieval_ms):
+        summary["retrieval_p50_ms"] = round(float(np.percentile(retrieval_ms, 50)), 2)
+        summary["retrieval_p95_ms"] = round(float(np.percentile(retrieval_ms, 95)), 2)
+    # Context packing: prompt context size, and answer quality where expected facts were given
+    for key, column in (("context_tokens", "Context Tokens"), ("unpacked_tokens", "Unpacked Tokens"),
+                        ("answer_fact_recall", "Answer Facts"), ("context_fact_recall", "Context Facts")):
+        values = [r[column] for r in rows if r[column] is not None]
+        if values:
+            summary[f"{key}_mean"] = round(float(np.mean(values)), 3)
+    if summary.get("unpacked_tokens_mean"):
+        summary["context_reduction"] = round(1 - summary["context_tokens_mean"] / summary["unpacked_tokens_mean"], 3)
+    return summary
+
+def run_evaluation(queries_file=None, engine="app", concurrency=1, repeat=1, warmup=1,
+                   fake_llm=False, fake_embed=False, llm_delay=0.0, embed_delay=0.0,
+                   results_file=RESULTS_FILE, summary_file=SUMMARY_FILE, service_url=QUERY_SERVICE_URL, filters=None,
+                   context_budget=None):
+    queries = load_queries(queries_file)
+    expected = load_expected(queries_file)
+    filters = normalize_filters(filters)
+    if filters is not None:
+        print(f"Filters: {describe_filters(filters)}")
+        if engine == "simple":
+            print("Note: the 'simple' engine ignores filters; use --engine app.")
+
+    if service_url:
+        # Thin client: the query service owns the engine and its models (--fake-* apply there)
+        print(f"Using query service at {service_url}")
+        query_engine = QueryServiceClient(service_url, source="evaluate", engine=engine)
+        print(f"Service status: {query_engine.health()['status']}")
+    else:
+        if not os.path.exists(STORAGE_DIR):
+            print(f"Storage directory '{STORAGE_DIR}' not found. Please run ingest.py first.")
+            return
+        from index_loader import load_index
+        from pipeline import build_query_engine
+        from tracing import install_tracing
+        from context_packing import CONTEXT_TOKEN_BUDGET
+        from micro_batch import batching_stats, reset_batching_stats
+        install_tracing()
+        if context_budget is None:
+            context_budget = CONTEXT_TOKEN_BUDGET
+
+        # Before loading: the index binds Settings.embed_model when it is constructed
+        configure_models(fake_llm, fake_embed, llm_delay, embed_delay, embed_dim=stored_embed_dim(STORAGE_DIR))
+
+        print("Loading Index...")
+        index = load_index(STORAGE_DIR)
+
+        # "app" is the hybrid + rerank engine the Streamlit app serves; "simple" is plain vector top-k
+        if engine == "app":
+            query_engine = build_query_engine(index, STORAGE_DIR, context_budget=context_budget)
+        else:
+            query_engine = index.as_query_engine()
+
+    # Warm-up: load models, memory-map indexes and fill caches outside the measured window
+    if warmup:
+        print(f"Warming up with {warmup} quer{'y' if warmup == 1 else 'ies'}...")
+        for i in range(warmup):
+            run_query(query_engine, queries[i % len(queries)], source="evaluate-warmup", filters=filters)
+
+    # Batch-size / queueing-delay metrics cover the measured run only
+    if not service_url:
+        reset_batching_stats()
+    print(f"Starting Benchmark: {len(queries)} queries x {repeat} repeat(s), concurrency {concurrency}, engine '{engine}'")
+    rows, wall_time = run_load(query_engine, queries, concurrency=concurrency, repeat=repeat, filters=filters,
+                               expected=expected)
+    summary = summarize(rows, wall_time, concurrency)
+    summary.update({"engine": engine, "fake_llm": fake_llm, "fake_embed": fake_embed, "service": service_url or None,
+                    "filters": filters, "context_budget": None if service_url else context_budget,
+                    "timestamp": time.time()})
+    # Micro-batching of query embeddings and rerank calls (in the service's process when using one)
+    summary["micro_batch"] = query_engine.health()["micro_batch"] if service_url else batching_stats()
 
     # Save Results
-    df = pd.DataFrame(results)
-    df.to_csv(RESULTS_FILE, index=False)
-    print(f"\nBenchmark complete. Results saved to {RESULTS_FILE}")
-    print(df)
+    df = pd.DataFrame(rows)
+    df.to_csv(results_file, index=False)
+    with open(summary_file, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"\nBenchmark complete. Results saved to {results_file}, summary to {summary_file}")
+    print(df.drop(columns=["Answer Preview"]))
+    print(json.dumps(summary, indent=2))
+    return summary
 
 if __name__ == "__main__":
-    run_evaluation()
+    parser = argparse.ArgumentParser(description="Benchmark the query engine")
+    parser.add_argument("--queries", help="Query file: .txt (one per line), .json or .jsonl")
+    parser.add_argument("--engine", choices=["app", "simple"], default="app",
+                        help="app: hybrid + rerank engine served by app.py (default); simple: vector-only")
+    parser.add_argument("--concurrency", type=int, default=1, help="Queries in flight at once")
+    parser.add_argument("--repeat", type=int, default=1, help="Times to run the whole query set")
+    parser.add_argument("--warmup", type=int, default=1, help="Unmeasured queries to run first")
+    parser.add_argument("--fake-llm", action="store_true", help="Offline FakeLLM instead of Gemini")
+    parser.add_argument("--fake-embed", action="store_true", help="Offline FakeEmbedding for query vectors")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="Simulated FakeLLM latency (s)")
+    parser.add_argument("--embed-delay", type=float, default=0.0, help="Simulated FakeEmbedding latency (s)")
+    parser.add_argument("--service-url", default=QUERY_SERVICE_URL,
+                        help="Query the shared query service instead of loading the engine (default: $QUERY_SERVICE_URL)")
+    parser.add_argument("--file", action="append", default=[], help="Only search this document (repeatable)")
+    parser.add_argument("--pages", default="", help="Only search this page range, e.g. 10-40, 10- or -40")
+    parser.add_argument("--year", action="append", type=int, default=[], help="Only search documents of this year (repeatable)")
+    parser.add_argument("--context-budget", type=int, default=None,
+                        help="Context packing token budget, 0 to send whole chunks (local engine only; "
+                             "default: $CONTEXT_TOKEN_BUDGET)")
+    parser.add_argument("--output", default=RESULTS_FILE, help="Per-query results CSV")
+    parser.add_argument("--summary", default=SUMMARY_FILE, help="Summary JSON")
+    args = parser.parse_args()
+
+    run_evaluation(
+        queries_file=args.queries,
+        engine=args.engine,
+        concurrency=args.concurrency,
+        repeat=args.repeat,
+        warmup=args.warmup,
+        fake_llm=args.fake_llm,
+        fake_embed=args.fake_embed,
+        llm_delay=args.llm_delay,
+        embed_delay=args.embed_delay,
+        results_file=args.output,
+        summary_file=args.summary,
+        service_url=args.service_url,
+        filters={"files": args.file, "pages": args.pages, "years": args.year},
+        context_budget=args.context_budget
+    )
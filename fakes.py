@@ -0,0 +1,113 @@
+# Deterministic offline stand-ins for the Google GenAI models, for tests and benchmarks
+import re
+import time
+import asyncio
+import hashlib
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.llms import CustomLLM, CompletionResponse, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from pydantic import Field
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+class FakeEmbedding(BaseEmbedding):
+    """Hashed bag-of-words embedding: same text, same vector, and shared words score higher.
+
+    `delay` simulates per-request network latency so concurrency can be measured.
+    """
+
+    embed_dim: int = Field(default=256)
+    delay: float = Field(default=0.0)
+    calls: int = Field(default=0)
+
+    def __init__(self, model_name="fake-embedding", **kwargs):
+        super().__init__(model_name=model_name, **kwargs)
+
+    @classmethod
+    def class_name(cls):
+        return "FakeEmbedding"
+
+    def _vector(self, text):
+        vector = np.zeros(self.embed_dim, dtype=np.float32)
+        for token in TOKEN_PATTERN.findall(text.lower()):
+            bucket = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:4], "little")
+            vector[bucket % self.embed_dim] += 1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def _get_query_embedding(self, query):
+        return self._get_text_embedding(query)
+
+    async def _aget_query_embedding(self, query):
+        return await self._aget_text_embedding(query)
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text):
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return [self._vector(text) for text in texts]
+
+    def _embed_texts(self, texts, task_type=None):
+        """Same batch entry point as GoogleGenAIEmbedding: one simulated request for all texts"""
+        return self._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts):
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return [self._vector(text) for text in texts]
+
+
+class FakeLLM(CustomLLM):
+    """Answers with a fixed-length summary of the prompt, streamed word by word.
+
+    `delay` simulates time-to-first-token, so latency measured with this LLM is
+    retrieval + rerank + prompt-building overhead plus a known constant.
+    """
+
+    delay: float = Field(default=0.0)
+    answer_words: int = Field(default=40)
+    calls: int = Field(default=0)
+
+    @classmethod
+    def class_name(cls):
+        return "FakeLLM"
+
+    @property
+    def metadata(self):
+        return LLMMetadata(model_name="fake-llm", context_window=1_000_000, num_output=1024)
+
+    def _words(self, prompt):
+        self.calls += 1
+        digest = hashlib.md5(prompt.encode("utf-8")).hexdigest()[:8]
+        words = [f"[fake:{digest}]"] + TOKEN_PATTERN.findall(prompt.lower())[-self.answer_words:]
+        if self.delay:
+            time.sleep(self.delay)
+        return words
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs):
+        return CompletionResponse(text=" ".join(self._words(prompt)))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        words = self._words(prompt)
+
+        def gen():
+            text = ""
+            for word in words:
+                delta = word if not text else " " + word
+                text += delta
+                yield CompletionResponse(text=text, delta=delta)
+
+        return gen()
@@ -0,0 +1,372 @@
+import os
+import re
+import json
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+from shards import shard_dirs
+
+FILTER_INDEX_FILE = "filter_index.npz"
+FILTER_META_FILE = "filter_index.json"
+MANIFEST_FNAME = "manifest.json"
+FILTER_MASK_CACHE_SIZE = int(os.getenv("FILTER_MASK_CACHE_SIZE", "32"))
+NO_PAGE = -1  # page labels without a number ("iv", "A-3") never match a page range
+YEAR_RE = re.compile(r"(?<!\d)(19\d\d|20\d\d)(?!\d)")
+
+# Filters of the current query: {"files": [...], "pages": [first, last], "years": [...]} or None.
+# Set by query_filters(); read by the retrievers, including on their branch threads.
+_current = contextvars.ContextVar("query_filters", default=None)
+
+
+def normalize_filters(filters):
+    """Canonical form of a filters dict (sorted, de-duplicated), or None when nothing is filtered.
+
+    `pages` is [first, last] with either end None for an open range; a
+    "first-last" string is accepted too.
+    """
+    if not filters:
+        return None
+    normalized = {}
+    files = sorted(set(filters.get("files") or []))
+    if files:
+        normalized["files"] = files
+    pages = filters.get("pages")
+    if isinstance(pages, str):
+        pages = parse_page_range(pages)
+    if pages and any(p is not None for p in pages):
+        first, last = (int(p) if p is not None else None for p in pages)
+        if first is not None and last is not None and first > last:
+            raise ValueError(f"Page range {first}-{last} is empty")
+        normalized["pages"] = [first, last]
+    years = sorted({int(y) for y in filters.get("years") or []})
+    if years:
+        normalized["years"] = years
+    return normalized or None
+
+
+def parse_page_range(text):
+    """'10-40' -> [10, 40]; '10-' -> [10, None]; '-40' -> [None, 40]; '12' -> [12, 12]"""
+    text = text.strip()
+    if not text:
+        return None
+    first, sep, last = text.partition("-")
+    first = int(first) if first.strip() else None
+    last = (int(last) if last.strip() else None) if sep else first
+    return [first, last]
+
+
+def filters_key(filters):
+    """Stable string for a normalized filters dict, "" when unfiltered"""
+    return json.dumps(filters, sort_keys=True, separators=(",", ":")) if filters else ""
+
+
+def scoped_version(index_version, filters):
+    """Answer-cache version for answers given under `filters`, so cached answers never cross filters"""
+    return f"{index_version}|{filters_key(filters)}" if filters else index_version
+
+
+def describe_filters(filters):
+    if not filters:
+        return "all documents"
+    parts = []
+    if "files" in filters:
+        parts.append(", ".join(filters["files"]))
+    if "pages" in filters:
+        first, last = filters["pages"]
+        parts.append(f"pages {first or 1}-{last if last is not None else 'end'}")
+    if "years" in filters:
+        parts.append("year " + "/".join(str(y) for y in filters["years"]))
+    return "; ".join(parts)
+
+
+@contextmanager
+def query_filters(filters):
+    """Restrict retrieval inside the block to nodes matching `filters` (normalized first)"""
+    token = _current.set(normalize_filters(filters))
+    try:
+        yield _current.get()
+    finally:
+        _current.reset(token)
+
+
+def current_filters():
+    return _current.get()
+
+
+def to_metadata_filters(filters):
+    """llama_index MetadataFilters for normalized `filters`, as carried by VectorStoreQuery.filters"""
+    from llama_index.core.vector_stores.types import MetadataFilters, MetadataFilter, FilterOperator
+    if not filters:
+        return None
+    conditions = []
+    if "files" in filters:
+        conditions.append(MetadataFilter(key="file_name", value=filters["files"], operator=FilterOperator.IN))
+    if "pages" in filters:
+        first, last = filters["pages"]
+        if first is not None:
+            conditions.append(MetadataFilter(key="page", value=first, operator=FilterOperator.GTE))
+        if last is not None:
+            conditions.append(MetadataFilter(key="page", value=last, operator=FilterOperator.LTE))
+    if "years" in filters:
+        conditions.append(MetadataFilter(key="year", value=filters["years"], operator=FilterOperator.IN))
+    return MetadataFilters(filters=conditions)
+
+
+def from_metadata_filters(metadata_filters):
+    """Inverse of to_metadata_filters(); raises ValueError for conditions the filter index can't answer"""
+    from llama_index.core.vector_stores.types import FilterOperator, FilterCondition
+    if metadata_filters is None or not metadata_filters.filters:
+        return None
+    if metadata_filters.condition not in (None, FilterCondition.AND):
+        raise ValueError("Only AND-combined filters are supported")
+    filters = {"pages": [None, None]}
+    for f in metadata_filters.filters:
+        if f.key == "file_name" and f.operator in (FilterOperator.IN, FilterOperator.EQ):
+            filters["files"] = f.value if f.operator == FilterOperator.IN else [f.value]
+        elif f.key == "year" and f.operator in (FilterOperator.IN, FilterOperator.EQ):
+            filters["years"] = f.value if f.operator == FilterOperator.IN else [f.value]
+        elif f.key == "page" and f.operator == FilterOperator.GTE:
+            filters["pages"][0] = f.value
+        elif f.key == "page" and f.operator == FilterOperator.LTE:
+            filters["pages"][1] = f.value
+        else:
+            raise ValueError(f"Unsupported filter: {f.key} {f.operator.value} {f.value!r}")
+    return normalize_filters(filters)
+
+
+def page_number(page_label):
+    match = re.match(r"\d+", str(page_label or ""))
+    return int(match.group()) if match else NO_PAGE
+
+
+def year_from_file_name(file_name):
+    """Latest year in a file name ('Qatar_2023_Article_IV.pdf' -> 2023), or None"""
+    years = [int(y) for y in YEAR_RE.findall(file_name or "")]
+    return max(years) if years else None
+
+
+def document_year(path):
+    """Year a PDF is about: the year in its file name, else its creation date; None if neither"""
+    year = year_from_file_name(os.path.basename(path))
+    if year is not None:
+        return year
+    try:
+        from pypdf import PdfReader
+        created = PdfReader(path).metadata.creation_date
+        return created.year if created else None
+    except Exception:
+        return None
+
+
+def _ids_hash(node_ids):
+    return hashlib.blake2b(np.ascontiguousarray(node_ids).tobytes(), digest_size=16).hexdigest()
+
+
+def _node_locations(docstore):
+    """node_id -> (file_name, page_label), without decoding text where the docstore allows"""
+    if hasattr(docstore, "node_refs"):
+        return {node_id: (file_name, page_label) for node_id, _, file_name, page_label in docstore.node_refs()}
+    return {node.node_id: (node.metadata.get("file_name"), node.metadata.get("page_label"))
+            for node in docstore.docs.values()}
+
+
+def _manifest_years(persist_dir):
+    try:
+        with open(os.path.join(persist_dir, MANIFEST_FNAME), "r", encoding="utf-8") as f:
+            files = json.load(f)["files"]
+    except (FileNotFoundError, KeyError, ValueError):
+        return {}
+    return {name: entry.get("year") for name, entry in files.items()}
+
+
+class FilterIndex:
+    """Per-node filter columns, aligned row for row with each searchable array.
+
+    For every "space" (the vector store's rows, the BM25 index's documents)
+    it holds an int32 file code and an int32 page number per row; years are
+    per file. A filter becomes a boolean row mask by looking up a per-file
+    bitmap (file and year conditions) and comparing the page column, so the
+    vector and BM25 branches score only the rows that match instead of
+    filtering what they retrieved. Masks are cached per filter.
+
+    Columns are built at ingestion. A space whose row order has changed since
+    (checked by hashing its node ids) is rebuilt in memory from the docstore
+    on first use.
+    """
+
+    def __init__(self, persist_dir, docstore=None, files=None, file_years=None, columns=None, id_hashes=None):
+        self.persist_dir = persist_dir
+        self.docstore = docstore
+        self.files = list(files or [])
+        self.file_years = dict(file_years or {})
+        self._columns = dict(columns or {})  # space -> (file_codes, pages)
+        self._id_hashes = dict(id_hashes or {})
+        self._checked = {}  # space -> the node-id array already validated
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def exists(persist_dir):
+        return os.path.exists(os.path.join(persist_dir, FILTER_META_FILE))
+
+    @classmethod
+    def load(cls, persist_dir, docstore=None):
+        """The persisted index, or an empty one that builds its columns on first use"""
+        if not cls.exists(persist_dir):
+            return cls(persist_dir, docstore, file_years=_manifest_years(persist_dir))
+        with open(os.path.join(persist_dir, FILTER_META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = np.load(os.path.join(persist_dir, FILTER_INDEX_FILE))
+        columns = {space: (arrays[f"{space}_file"], arrays[f"{space}_page"]) for space in meta["id_hashes"]}
+        return cls(persist_dir, docstore, meta["files"], meta["file_years"], columns, meta["id_hashes"])
+
+    @classmethod
+    def merged(cls, persist_dir, filter_indexes):
+        """Files and years of several shards' indexes, for accepts() (no row columns)"""
+        file_years = {}
+        for filter_index in filter_indexes:
+            file_years.update(filter_index.file_years)
+        return cls(persist_dir, files=sorted(file_years), file_years=file_years)
+
+    def save(self):
+        arrays = {}
+        for space, (file_codes, pages) in self._columns.items():
+            arrays[f"{space}_file"] = file_codes
+            arrays[f"{space}_page"] = pages
+        path = os.path.join(self.persist_dir, FILTER_INDEX_FILE)
+        np.savez(path + ".tmp.npz", **arrays)
+        os.replace(path + ".tmp.npz", path)
+        meta = {"files": self.files, "file_years": self.file_years, "id_hashes": self._id_hashes}
+        with open(os.path.join(self.persist_dir, FILTER_META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+    def build_space(self, space, node_ids, locations=None):
+        """(Re)compute the columns of `space` for `node_ids` (in row order; bytes or str)"""
+        if locations is None:
+            locations = _node_locations(self.docstore)
+        codes = {name: i for i, name in enumerate(self.files)}
+        file_codes = np.empty(len(node_ids), dtype=np.int32)
+        pages = np.empty(len(node_ids), dtype=np.int32)
+        for row, node_id in enumerate(np.asarray(node_ids)):
+            if isinstance(node_id, bytes):
+                node_id = node_id.decode("utf-8")
+            file_name, page_label = locations.get(str(node_id), (None, None))
+            file_name = file_name or "unknown"
+            if file_name not in codes:
+                codes[file_name] = len(self.files)
+                self.files.append(file_name)
+            file_codes[row] = codes[file_name]
+            pages[row] = page_number(page_label)
+        for file_name in self.files:
+            if self.file_years.get(file_name) is None:
+                self.file_years[file_name] = year_from_file_name(file_name)
+        self._columns[space] = (file_codes, pages)
+        self._id_hashes[space] = _ids_hash(node_ids)
+        self._checked[space] = node_ids
+        self._masks.clear()
+
+    def _space_columns(self, space, node_ids):
+        if self._checked.get(space) is not node_ids:
+            if space not in self._columns or self._id_hashes.get(space) != _ids_hash(node_ids):
+                print(f"Filter index for '{space}' is out of date; rebuilding it from the docstore.")
+                self.file_years.update({k: v for k, v in _manifest_years(self.persist_dir).items() if v})
+                self.build_space(space, node_ids)
+            self._checked[space] = node_ids
+        return self._columns[space]
+
+    def _file_bitmap(self, filters):
+        """bool per file code: the file passes the file and year conditions"""
+        allowed = np.ones(len(self.files), dtype=bool)
+        if "files" in filters:
+            allowed &= np.array([name in filters["files"] for name in self.files], dtype=bool)
+        if "years" in filters:
+            allowed &= np.array([self.file_years.get(name) in filters["years"] for name in self.files], dtype=bool)
+        return allowed
+
+    def mask(self, space, node_ids, filters):
+        """Boolean row mask of `space` for normalized `filters` (None when unfiltered)"""
+        if not filters:
+            return None
+        key = (space, filters_key(filters))
+        with self._lock:
+            file_codes, pages = self._space_columns(space, node_ids)
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+            if len(file_codes) == 0:
+                mask = np.zeros(0, dtype=bool)
+            else:
+                mask = self._file_bitmap(filters)[file_codes]
+            if "pages" in filters:
+                first, last = filters["pages"]
+                mask &= pages != NO_PAGE
+                if first is not None:
+                    mask &= pages >= first
+                if last is not None:
+                    mask &= pages <= last
+            self._masks[key] = mask
+            while len(self._masks) > FILTER_MASK_CACHE_SIZE:
+                self._masks.popitem(last=False)
+        return mask
+
+    def accepts(self, file_name, page_label, filters):
+        """Whether one (file, page) passes `filters`; used for table-store answers"""
+        if not filters:
+            return True
+        if "files" in filters and file_name not in filters["files"]:
+            return False
+        if "years" in filters:
+            year = self.file_years.get(file_name)
+            if year is None:
+                year = year_from_file_name(file_name)
+            if year not in filters["years"]:
+                return False
+        if "pages" in filters:
+            page = page_number(page_label)
+            first, last = filters["pages"]
+            if page == NO_PAGE or (first is not None and page < first) or (last is not None and page > last):
+                return False
+        return True
+
+    def choices(self):
+        """Files and years to offer in a filter UI"""
+        years = sorted({y for y in self.file_years.values() if y is not None})
+        return {"files": sorted(self.files), "years": years}
+
+
+def build_filter_index(persist_dir, docstore, file_years=None):
+    """Build and persist the filter columns for the vector rows and BM25 documents in `persist_dir`"""
+    from mmap_vector_store import MmapVectorStore
+    from bm25_index import BM25Index
+
+    filter_index = FilterIndex(persist_dir, docstore, file_years=file_years or _manifest_years(persist_dir))
+    locations = _node_locations(docstore)
+    if MmapVectorStore.exists(persist_dir):
+        store = MmapVectorStore.from_persist_dir(persist_dir, use_ann=False)
+        filter_index.build_space("vector", store.persisted_node_ids, locations)
+    if BM25Index.exists(persist_dir):
+        filter_index.build_space("bm25", BM25Index.load(persist_dir).node_ids, locations)
+    filter_index.save()
+    print(f"Filter index: {len(filter_index.files)} file(s), "
+          f"{sum(1 for y in filter_index.file_years.values() if y)} with a year")
+    return filter_index
+
+
+def filter_choices(persist_dir):
+    """Files and years in a store (all its shards), read from filter index metadata or manifests (no arrays loaded)"""
+    dirs = shard_dirs(persist_dir)
+    if dirs:
+        choices = [filter_choices(path) for path in dirs.values()]
+        return {"files": sorted({f for c in choices for f in c["files"]}),
+                "years": sorted({y for c in choices for y in c["years"]})}
+    try:
+        with open(os.path.join(persist_dir, FILTER_META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        file_years = meta["file_years"]
+    except (FileNotFoundError, KeyError, ValueError):
+        file_years = {name: year or year_from_file_name(name) for name, year in _manifest_years(persist_dir).items()}
+    return {"files": sorted(file_years), "years": sorted({y for y in file_years.values() if y})}
@@ -0,0 +1,61 @@
+import os
+import json
+from llama_index.core import StorageContext, load_index_from_storage
+from mmap_vector_store import MmapVectorStore
+from sqlite_docstore import SqliteDocumentStore, DOCSTORE_FNAME
+from shards import is_sharded, load_sharded_index, combined_version
+
+STORAGE_DIR = "./storage"
+MANIFEST_FNAME = "manifest.json"
+
+
+def new_storage_context(persist_dir=STORAGE_DIR):
+    """Storage context for a fresh index in `persist_dir`: SQLite docstore, memory-mapped vector store"""
+    return StorageContext.from_defaults(
+        docstore=SqliteDocumentStore.from_persist_dir(persist_dir),
+        vector_store=MmapVectorStore()
+    )
+
+
+def load_storage_context(persist_dir=STORAGE_DIR):
+    """Load a persisted storage context, preferring the SQLite docstore and memory-mapped vector store.
+
+    Stores persisted before those formats still load through the default JSON
+    SimpleDocumentStore / SimpleVectorStore; convert them with
+    `python sqlite_docstore.py migrate` and `python mmap_vector_store.py migrate`.
+    """
+    docstore = None
+    if SqliteDocumentStore.exists(persist_dir):
+        docstore = SqliteDocumentStore.from_persist_dir(persist_dir)
+    else:
+        print(f"'{persist_dir}' uses the JSON docstore. Run `python sqlite_docstore.py migrate` to stop loading every node.")
+    vector_store = None
+    if MmapVectorStore.exists(persist_dir):
+        vector_store = MmapVectorStore.from_persist_dir(persist_dir)
+    else:
+        print(f"'{persist_dir}' uses the JSON vector store. Run `python mmap_vector_store.py migrate` for faster loads.")
+    return StorageContext.from_defaults(persist_dir=persist_dir, docstore=docstore, vector_store=vector_store)
+
+
+def load_index(persist_dir=STORAGE_DIR):
+    """The VectorStoreIndex of `persist_dir`, or a shards.ShardedIndex if it holds shards"""
+    if is_sharded(persist_dir):
+        return load_sharded_index(persist_dir)
+    return load_index_from_storage(load_storage_context(persist_dir))
+
+
+def read_index_version(persist_dir=STORAGE_DIR):
+    """Version string that changes on every ingestion that modifies the corpus"""
+    if is_sharded(persist_dir):
+        return combined_version(persist_dir)
+    manifest_path = os.path.join(persist_dir, MANIFEST_FNAME)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)["version"]
+    except (FileNotFoundError, KeyError, ValueError):
+        # Stores from before manifests: fall back to the docstore's modification time
+        for docstore_fname in (DOCSTORE_FNAME, "docstore.json"):
+            docstore_path = os.path.join(persist_dir, docstore_fname)
+            if os.path.exists(docstore_path):
+                return f"mtime-{os.path.getmtime(docstore_path)}"
+        return None
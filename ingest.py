@@ -1,11 +1,32 @@
 import os
+import sys
+import json
+import time
+import queue
+import shutil
+import argparse
+import hashlib
+import threading
 from dotenv import load_dotenv
 import nest_asyncio
 from llama_parse import LlamaParse
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, StorageContext, load_index_from_storage
+from llama_index.core import VectorStoreIndex, SimpleDirectoryReader
 from llama_index.core.settings import Settings
+from llama_index.core.ingestion import run_transformations
 from llama_index.llms.google_genai import GoogleGenAI
 from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+from parse_cache import CachedParser, file_sha256
+from local_parser import LocalPDFParser
+from embedding_cache import EmbeddingCache, embed_nodes
+from index_loader import load_index, new_storage_context, read_index_version, MANIFEST_FNAME
+from ann_index import build_ann_index
+from quantization import build_quantized_vectors
+from bm25_index import BM25Index, update_bm25_index, merge_bm25_segments
+from briefing import get_briefing, BRIEFING_FNAME
+from table_store import TableStore, tables_from_documents, tables_from_nodes
+from sqlite_docstore import iter_docstore_nodes
+from filter_index import FilterIndex, build_filter_index, document_year
+from shards import load_layout, save_layout, plan_shards, parse_scheme, shard_dir, is_sharded
 
 # Apply nest_asyncio
 nest_asyncio.apply()
@@ -13,9 +34,7 @@ nest_asyncio.apply()
 # Load environment variables
 load_dotenv()
 
-# Check for API keys
-if not os.getenv("LLAMA_CLOUD_API_KEY"):
-    raise ValueError("LLAMA_CLOUD_API_KEY not found in .env")
+# Check for API keys (LlamaParse's is checked when that backend is used)
 if not os.getenv("GOOGLE_API_KEY"):
     raise ValueError("GOOGLE_API_KEY not found in .env")
 
@@ -25,45 +44,72 @@ Settings.embed_model = GoogleGenAIEmbedding(model_name="models/text-embedding-00
 
 DATA_DIR = "./data"
 STORAGE_DIR = "./storage"
+# "llamaparse" (remote, premium table/chart extraction) or "local" (offline, page-parallel pypdf + pdfplumber)
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "llamaparse")
+# Present only while an ingestion run is in progress (or was interrupted)
+CHECKPOINT_FNAME = "ingest_checkpoint.json"
+# Items buffered between pipeline stages (parsed files, embedded batches)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "2"))
+# Chunks embedded together, and chunks inserted between two commits to ./storage
+INGEST_BATCH_NODES = int(os.getenv("INGEST_BATCH_NODES", "500"))
+INGEST_COMMIT_NODES = int(os.getenv("INGEST_COMMIT_NODES", "2000"))
 
-def ingest_documents():
-    # Check if storage already exists
-    if os.path.exists(STORAGE_DIR):
-        print(f"Storage directory '{STORAGE_DIR}' already exists. Skipping ingestion.")
-        return
+def load_manifest(storage_dir=STORAGE_DIR):
+    """Load the per-file content hash manifest stored next to the index"""
+    manifest_file = os.path.join(storage_dir, MANIFEST_FNAME)
+    if not os.path.exists(manifest_file):
+        return None
+    with open(manifest_file, "r", encoding="utf-8") as f:
+        return json.load(f)
 
-    print("Storage directory not found. Starting ingestion...")
+def save_manifest(files, storage_dir=STORAGE_DIR):
+    """Persist the manifest; the version changes whenever the indexed corpus does"""
+    version = hashlib.sha256(
+        json.dumps({name: entry["sha256"] for name, entry in sorted(files.items())}).encode("utf-8")
+    ).hexdigest()[:16]
+    manifest = {"version": version, "files": files}
+    manifest_file = os.path.join(storage_dir, MANIFEST_FNAME)
+    tmp_path = manifest_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_file)
+    return manifest
 
-    # Check for PDFs in data directory
-    if not os.path.exists(DATA_DIR):
-        os.makedirs(DATA_DIR)
-        print(f"Created '{DATA_DIR}'. Please put your PDF files there.")
-        return
+def adopt_existing_store(index, hashes):
+    """Build a manifest for a store persisted before manifests existed.
 
-    files = [f for f in os.listdir(DATA_DIR) if f.endswith('.pdf')]
-    if not files:
-        print(f"No PDF files found in '{DATA_DIR}'. Please add a PDF file.")
-        return
+    Files still present in ./data are assumed to match what was indexed.
+    """
+    files = {}
+    for ref_doc_id, info in index.ref_doc_info.items():
+        file_name = info.metadata.get("file_name")
+        if file_name in hashes:
+            entry = files.setdefault(file_name, {"sha256": hashes[file_name], "doc_ids": []})
+            entry["doc_ids"].append(ref_doc_id)
+    return files
 
-    print(f"Found {len(files)} PDF(s): {files}")
+def make_parser(backend=PARSER_BACKEND):
+    """Cached PDF parser for the backend, plus the local parser to close when done (or None)"""
+    if backend == "local":
+        # Offline: pages fanned out across processes, exact page labels from the PDF
+        local_parser = LocalPDFParser()
+        return CachedParser(local_parser, options=local_parser.options), local_parser
 
-    # Initialize LlamaParse
-    parser = LlamaParse(
-        result_type="markdown",
-        premium_mode=True,  # Set to True for better table/image extraction
-        verbose=True,
-        language="en"
-    )
+    if not os.getenv("LLAMA_CLOUD_API_KEY"):
+        raise ValueError("LLAMA_CLOUD_API_KEY not found in .env (or use PARSER_BACKEND=local)")
 
-    # Use SimpleDirectoryReader with LlamaParse
-    file_extractor = {".pdf": parser}
-    reader = SimpleDirectoryReader(DATA_DIR, file_extractor=file_extractor)
-    documents = reader.load_data()
+    # Every option that changes the parsed output is part of the cache key
+    parse_options = {
+        "result_type": "markdown",
+        "premium_mode": True,  # Set to True for better table/image extraction
+        "language": "en"
+    }
 
-    print(f"Loaded {len(documents)} document chunks/pages.")
+    # Initialize LlamaParse behind the local parse cache
+    return CachedParser(LlamaParse(verbose=True, **parse_options), options=parse_options), None
 
-    # Inspect and fix metadata to ensure page_label is present
-    print("Checking metadata for page labels...")
+def fix_page_labels(documents):
+    """Ensure every page document of one file carries a page_label"""
     for i, doc in enumerate(documents):
         # LlamaParse puts page number in metadata, try different field names
         if 'page_label' not in doc.metadata:
@@ -73,21 +119,384 @@ def ingest_documents():
             elif 'page_number' in doc.metadata:
                 doc.metadata['page_label'] = str(doc.metadata['page_number'])
             else:
-                # Fallback: use document index as page number (starts at 1)
+                # Fallback: use position within the file as page number (starts at 1)
                 doc.metadata['page_label'] = str(i + 1)
-        
-        # Debug: print first few metadata samples
-        if i < 3:
-            print(f"Document {i} metadata: {doc.metadata}")
-    
-    # Create Index
-    print("Creating VectorStoreIndex...")
-    index = VectorStoreIndex.from_documents(documents)
-
-    # Persist Storage
-    print(f"Persisting index to '{STORAGE_DIR}'...")
-    index.storage_context.persist(persist_dir=STORAGE_DIR)
-    print("Ingestion complete.")
+
+def iter_parsed_files(file_names, backend=PARSER_BACKEND, data_dir=DATA_DIR):
+    """Pipeline stage 1: parse one PDF at a time, yielding (file_name, page documents)"""
+    parser, local_parser = make_parser(backend)
+    try:
+        for name in file_names:
+            reader = SimpleDirectoryReader(
+                input_files=[os.path.join(data_dir, name)],
+                file_extractor={".pdf": parser},
+                filename_as_id=True
+            )
+            documents = reader.load_data()
+            fix_page_labels(documents)
+            print(f"Parsed '{name}': {len(documents)} page(s)")
+            yield name, documents
+    finally:
+        if local_parser is not None:
+            local_parser.close()
+        print(f"Parse cache: {parser.cache.hits} hit(s), {parser.cache.misses} miss(es)")
+
+def iter_embedded_batches(parsed_files, embed_model, batch_nodes=INGEST_BATCH_NODES):
+    """Pipeline stage 2: chunk each file and embed its chunks in batches of `batch_nodes`.
+
+    Yields (file_name, nodes, None, None) per batch, then
+    (file_name, [], doc_ids, tables) once the file is complete and safe to commit.
+    """
+    # Opened here: the SQLite connection must live in the thread that runs this stage
+    cache = EmbeddingCache()
+    try:
+        for name, documents in parsed_files:
+            nodes = run_transformations(documents, Settings.transformations)
+            for start in range(0, len(nodes), batch_nodes):
+                batch = nodes[start:start + batch_nodes]
+                # Cached chunks are free, misses go out in concurrent batches
+                embed_nodes(batch, embed_model, cache=cache)
+                yield name, batch, None, None
+            yield name, [], [doc.id_ for doc in documents], tables_from_documents(documents, nodes)
+    finally:
+        cache.close()
+
+def background(iterable, maxsize=INGEST_QUEUE_SIZE):
+    """Run a pipeline stage in a thread and hand its items over through a bounded queue.
+
+    The stage blocks once `maxsize` items are waiting, so it can never run
+    ahead of the consumer by more than that; its exceptions are re-raised in
+    the consumer.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((done, e))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # Lets the stage exit if the consumer stops early
+        stopped.set()
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where `resource` is unavailable"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
+
+def load_checkpoint(storage_dir=STORAGE_DIR):
+    checkpoint_file = os.path.join(storage_dir, CHECKPOINT_FNAME)
+    if not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_checkpoint(checkpoint, storage_dir=STORAGE_DIR):
+    os.makedirs(storage_dir, exist_ok=True)
+    checkpoint_file = os.path.join(storage_dir, CHECKPOINT_FNAME)
+    tmp_path = checkpoint_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_file)
+
+def delete_files_from_index(index, names, indexed):
+    """Drop every node of the given files from the docstore and vector store; returns their node ids"""
+    removed_node_ids = []
+    for name in names:
+        for doc_id in indexed[name]["doc_ids"]:
+            ref_doc_info = index.docstore.get_ref_doc_info(doc_id)
+            if ref_doc_info is not None:
+                removed_node_ids.extend(ref_doc_info.node_ids)
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        del indexed[name]
+    return removed_node_ids
+
+def open_table_store(index, storage_dir=STORAGE_DIR):
+    """Open the table store, backfilling it from the docstore's chunks if this store predates it"""
+    backfill = not TableStore.exists(storage_dir)
+    table_store = TableStore.open(storage_dir)
+    if backfill and index.docstore.docs:
+        table_store.update(tables_from_nodes(iter_docstore_nodes(index.docstore)))
+        print(f"Table store: extracted {table_store.table_count} table(s) from the existing index")
+    return table_store
+
+def commit(index, table_store, indexed, checkpoint, completed, added_node_ids, removed_node_ids, tables,
+           storage_dir=STORAGE_DIR):
+    """Persist one batch of completed files to `storage_dir`.
+
+    The checkpoint lists the batch under "committing" until the manifest is
+    saved, so a run killed mid-commit knows which files may be half-written.
+    """
+    checkpoint["committing"] = completed
+    save_checkpoint(checkpoint, storage_dir)
+
+    index.storage_context.persist(persist_dir=storage_dir)
+    # Keyword index: tokenize only the new nodes into a segment, merged by finish_ingestion()
+    added_nodes = index.docstore.get_nodes(added_node_ids)
+    update_bm25_index(storage_dir, index.docstore, added_nodes=added_nodes, removed_node_ids=removed_node_ids)
+    # Tables are linked to node ids, so removed nodes take their tables with them
+    table_store.update(tables, removed_node_ids=removed_node_ids)
+
+    indexed.update(completed)
+    manifest = save_manifest(indexed, storage_dir)
+
+    checkpoint["committed"].extend(completed)
+    checkpoint["committing"] = {}
+    save_checkpoint(checkpoint, storage_dir)
+    return manifest
+
+def finish_ingestion(index, indexed, storage_dir=STORAGE_DIR):
+    """Work done once per run, after the last commit"""
+    merge_bm25_segments(storage_dir)
+    # Rows were added (and renumbered by any rewrite), so the ANN index and filter columns are rebuilt from scratch
+    print("Building approximate nearest-neighbour index...")
+    build_ann_index(storage_dir)
+    build_quantized_vectors(storage_dir)
+    build_filter_index(storage_dir, index.docstore, {name: entry.get("year") for name, entry in indexed.items()})
+    checkpoint_file = os.path.join(storage_dir, CHECKPOINT_FNAME)
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+def pregenerate_briefing(index, index_version):
+    """Build the Executive Briefing for this index version so the app serves it from disk"""
+    print("Generating Executive Briefing...")
+    try:
+        get_briefing(index, STORAGE_DIR, index_version)
+        print(f"Briefing saved to '{os.path.join(STORAGE_DIR, BRIEFING_FNAME)}'")
+    except Exception as e:
+        print(f"Warning: briefing generation failed ({e}); the app will generate it on first request.")
+
+def ingest_documents(generate_briefing=False, parser_backend=PARSER_BACKEND, storage_dir=STORAGE_DIR,
+                     data_dir=DATA_DIR, files=None):
+    """Bring the store in `storage_dir` in line with the PDFs in `data_dir` (or just `files` of it)"""
+    if is_sharded(storage_dir):
+        raise ValueError(f"'{storage_dir}' is a sharded store; ingest it with ingest_sharded().")
+    if files is None:
+        # Check for PDFs in data directory
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+            print(f"Created '{data_dir}'. Please put your PDF files there.")
+            return
+        files = sorted(f for f in os.listdir(data_dir) if f.endswith('.pdf'))
+    else:
+        files = sorted(files)
+    if not files and not os.path.exists(storage_dir):
+        print(f"No PDF files found in '{data_dir}'. Please add a PDF file.")
+        return
+
+    print(f"Found {len(files)} PDF(s): {files}")
+    hashes = {name: file_sha256(os.path.join(data_dir, name)) for name in files}
+
+    checkpoint = load_checkpoint(storage_dir)
+    if checkpoint is not None and checkpoint["fresh"] and load_manifest(storage_dir) is None:
+        # The first ingestion died before its first commit completed: nothing in ./storage is usable
+        print("Discarding the partial store left by an interrupted first ingestion.")
+        shutil.rmtree(storage_dir)
+        checkpoint = None
+
+    # Load the existing index, or start an empty one
+    fresh = not os.path.exists(storage_dir)
+    if not fresh:
+        index = load_index(storage_dir)
+        manifest = load_manifest(storage_dir)
+        if manifest is None:
+            print("No manifest found for the existing index. Adopting the files it already contains.")
+            indexed = adopt_existing_store(index, hashes)
+        else:
+            indexed = manifest["files"]
+    else:
+        print("Storage directory not found. Starting ingestion...")
+        index = VectorStoreIndex([], storage_context=new_storage_context(storage_dir))
+        indexed = {}
+
+    removed_node_ids = []
+    if checkpoint is not None:
+        print(f"Resuming ingestion interrupted after {len(checkpoint['committed'])} committed file(s) "
+              f"(started {checkpoint['started_at']}).")
+        # A batch cut short mid-commit may be partly persisted: drop it and parse those files again
+        for name, entry in checkpoint["committing"].items():
+            if indexed.get(name, {}).get("sha256") != entry["sha256"]:
+                print(f"Rolling back partially committed '{name}'")
+                # Ids of the interrupted version plus any previously indexed one
+                doc_ids = set(entry["doc_ids"]) | set(indexed.get(name, {}).get("doc_ids", []))
+                indexed[name] = {"sha256": entry["sha256"], "doc_ids": sorted(doc_ids)}
+                removed_node_ids.extend(delete_files_from_index(index, [name], indexed))
+        checkpoint["committing"] = {}
+
+    # Diff the corpus against the manifest
+    added = [name for name in files if name not in indexed]
+    changed = [name for name in files if name in indexed and indexed[name]["sha256"] != hashes[name]]
+    removed = [name for name in indexed if name not in hashes]
+
+    if not (added or changed or removed or removed_node_ids):
+        if load_manifest(storage_dir) is None:
+            save_manifest(indexed, storage_dir)
+        if not BM25Index.exists(storage_dir):
+            update_bm25_index(storage_dir, index.docstore)
+        if not TableStore.exists(storage_dir):
+            open_table_store(index, storage_dir).close()
+        if checkpoint is not None:
+            # Interrupted after its last commit: only the final steps are left
+            finish_ingestion(index, indexed, storage_dir)
+        elif not FilterIndex.exists(storage_dir):
+            # Stores ingested before filters existed have no years in their manifest
+            build_filter_index(storage_dir, index.docstore, {
+                name: entry.get("year") or document_year(os.path.join(data_dir, name)) for name, entry in indexed.items()
+            })
+        print("Index is up to date. Nothing to ingest.")
+        if generate_briefing:
+            pregenerate_briefing(index, read_index_version(storage_dir))
+        return
+
+    print(f"Added: {added} | Changed: {changed} | Removed: {removed}")
+
+    # Drop the nodes of changed and deleted files; persisted with the first commit
+    removed_node_ids.extend(delete_files_from_index(index, changed + removed, indexed))
+
+    # Parse -> chunk + embed -> insert, with bounded queues between the stages.
+    # Completed files are committed every INGEST_COMMIT_NODES chunks, so memory
+    # holds at most one commit's worth of new nodes and a crash loses at most that.
+    to_parse = added + changed
+    if checkpoint is None:
+        checkpoint = {"started_at": time.strftime("%Y-%m-%d %H:%M:%S"), "fresh": fresh,
+                      "committed": [], "committing": {}}
+    checkpoint["to_parse"] = to_parse
+    save_checkpoint(checkpoint, storage_dir)
+
+    completed = {}
+    added_node_ids = []
+    tables = []
+    manifest = None
+    n_done = 0
+    table_store = open_table_store(index, storage_dir)
+    try:
+        parsed = background(iter_parsed_files(to_parse, backend=parser_backend, data_dir=data_dir))
+        for name, nodes, doc_ids, file_tables in background(iter_embedded_batches(parsed, Settings.embed_model)):
+            if nodes:
+                index.insert_nodes(nodes)
+                added_node_ids.extend(node.node_id for node in nodes)
+                continue
+
+            n_done += 1
+            if doc_ids:
+                completed[name] = {"sha256": hashes[name], "doc_ids": doc_ids,
+                                   "year": document_year(os.path.join(data_dir, name))}
+                tables.extend(file_tables)
+            else:
+                print(f"Warning: no documents were parsed from '{name}'; it will be retried next run.")
+
+            if len(added_node_ids) >= INGEST_COMMIT_NODES or n_done == len(to_parse):
+                print(f"Committing {len(completed)} file(s), {len(added_node_ids)} chunk(s), "
+                      f"{len(tables)} table(s) to '{storage_dir}'...")
+                manifest = commit(index, table_store, indexed, checkpoint, completed, added_node_ids,
+                                  removed_node_ids, tables, storage_dir)
+                completed, added_node_ids, removed_node_ids, tables = {}, [], [], []
+                peak = peak_rss_mb()
+                print(f"Progress: {n_done}/{len(to_parse)} file(s)" + (f", peak RSS {peak:.0f} MB" if peak else ""))
+
+        if manifest is None:
+            # Only deletions this run
+            print(f"Persisting index to '{storage_dir}'...")
+            manifest = commit(index, table_store, indexed, checkpoint, completed, added_node_ids,
+                              removed_node_ids, tables, storage_dir)
+    finally:
+        table_store.close()
+
+    finish_ingestion(index, indexed, storage_dir)
+    print(f"Ingestion complete. Index version: {manifest['version']}")
+
+    if generate_briefing:
+        pregenerate_briefing(index, manifest["version"])
+
+def ingest_sharded(scheme_text=None, only=(), generate_briefing=False, parser_backend=PARSER_BACKEND):
+    """Ingest ./data into one independent store per shard under ./storage/shards (see shards.py).
+
+    `scheme_text` ("collection" or "hash:N") creates the layout, or must match
+    the existing one; `only` limits the run to the named shards. Each shard is
+    an ordinary store with its own manifest and checkpoint, so shards can be
+    re-ingested one at a time, or from separate processes.
+    """
+    layout = load_layout(STORAGE_DIR)
+    if scheme_text is None:
+        scheme, count = layout["scheme"], layout["count"]
+    else:
+        scheme, count = parse_scheme(scheme_text)
+        if layout is not None and (layout["scheme"], layout["count"]) != (scheme, count):
+            raise ValueError(f"'{STORAGE_DIR}' is already sharded by {layout['scheme']}"
+                             + (f":{layout['count']}" if layout["count"] else "")
+                             + ". Move it aside to re-shard (the parse and embedding caches keep that cheap).")
+        if layout is None and os.path.exists(os.path.join(STORAGE_DIR, "index_store.json")):
+            raise ValueError(f"'{STORAGE_DIR}' holds a single-directory index. Move it aside to ingest a sharded one.")
+
+    if not os.path.exists(DATA_DIR):
+        os.makedirs(DATA_DIR)
+        print(f"Created '{DATA_DIR}'. Please put your PDF files there.")
+        return
+    plan = plan_shards(DATA_DIR, scheme, count)
+    unknown = sorted(set(only) - set(plan))
+    if unknown:
+        raise ValueError(f"Unknown shard(s) {unknown}; this corpus has {sorted(plan)}.")
+
+    # Collections that no longer have any PDFs
+    for name in (layout or {}).get("shards", []):
+        if name not in plan and os.path.isdir(shard_dir(STORAGE_DIR, name)):
+            print(f"Removing shard '{name}': no PDFs left for it.")
+            shutil.rmtree(shard_dir(STORAGE_DIR, name))
+    save_layout(STORAGE_DIR, scheme, count, plan)
+
+    for name, (data_dir, files) in plan.items():
+        if only and name not in only:
+            continue
+        print(f"--- Shard '{name}' ({len(files)} PDF(s) from '{data_dir}') ---")
+        path = shard_dir(STORAGE_DIR, name)
+        if not files and not os.path.exists(path):
+            continue
+        ingest_documents(parser_backend=parser_backend, storage_dir=path, data_dir=data_dir, files=files)
+
+    if generate_briefing:
+        pregenerate_briefing(load_index(STORAGE_DIR), read_index_version(STORAGE_DIR))
 
 if __name__ == "__main__":
-    ingest_documents()
+    parser = argparse.ArgumentParser(description="Ingest PDFs from ./data into ./storage")
+    parser.add_argument("--briefing", action="store_true", help="Pre-generate the Executive Briefing after ingestion")
+    parser.add_argument("--parser", choices=["llamaparse", "local"], default=PARSER_BACKEND,
+                        help="PDF parser backend (default: PARSER_BACKEND or llamaparse)")
+    parser.add_argument("--shards", metavar="SCHEME",
+                        help="Shard the store: 'collection' (one shard per ./data subdirectory) or 'hash:N'")
+    parser.add_argument("--shard", action="append", default=[], metavar="NAME",
+                        help="Only ingest this shard of a sharded store (repeatable)")
+    args = parser.parse_args()
+    if args.shards or is_sharded(STORAGE_DIR):
+        ingest_sharded(args.shards, only=args.shard, generate_briefing=args.briefing, parser_backend=args.parser)
+    elif args.shard:
+        parser.error(f"'{STORAGE_DIR}' is not sharded; create a sharded store with --shards first.")
+    else:
+        ingest_documents(generate_briefing=args.briefing, parser_backend=args.parser)
@@ -0,0 +1,118 @@
+import os
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from llama_index.core import Document
+from llama_index.core.readers.base import BaseReader
+
+LOCAL_PARSE_WORKERS = int(os.getenv("LOCAL_PARSE_WORKERS", "0"))  # 0 = one per core
+LOCAL_PARSE_TABLES = os.getenv("LOCAL_PARSE_TABLES", "1") != "0"
+# Bump when the extraction output changes so parse-cache entries are not reused
+LOCAL_PARSER_VERSION = "1"
+
+
+def _table_to_markdown(rows):
+    """Markdown table from pdfplumber rows, or None for layout boxes that are not real tables"""
+    rows = [[(cell or "").replace("\n", " ").strip() for cell in row] for row in rows]
+    rows = [row for row in rows if any(row)]
+    if len(rows) < 2 or max(len(row) for row in rows) < 2:
+        return None
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    filled = sum(1 for row in rows for cell in row if cell)
+    if filled < 0.6 * len(rows) * width:
+        return None
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + " --- |" * width]
+    lines += ["| " + " | ".join(row) + " |" for row in rows[1:]]
+    return "\n".join(lines)
+
+
+def _parse_page_range(path, start, end, tables):
+    """Worker: extract pages [start, end) of one PDF; returns [(page_index, page_label, text)]"""
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    labels = reader.page_labels
+    plumber = None
+    if tables:
+        try:
+            import pdfplumber
+            plumber = pdfplumber.open(path)
+        except ImportError:
+            plumber = None
+
+    pages = []
+    try:
+        for i in range(start, end):
+            text = reader.pages[i].extract_text() or ""
+            if plumber is not None:
+                markdown_tables = [t for t in map(_table_to_markdown, plumber.pages[i].extract_tables()) if t]
+                if markdown_tables:
+                    text = text.rstrip() + "\n\n" + "\n\n".join(markdown_tables)
+            pages.append((i, labels[i] if i < len(labels) else str(i + 1), text))
+    finally:
+        if plumber is not None:
+            plumber.close()
+    return pages
+
+
+class LocalPDFParser(BaseReader):
+    """Offline PDF parser: pypdf text (+ pdfplumber tables) with pages fanned out across processes.
+
+    Each worker opens the PDF once and extracts a contiguous page range;
+    results are merged back in page order. `page_label` is the PDF's own page
+    label (what a viewer shows), and `page_number` the 1-based physical page.
+    """
+
+    def __init__(self, max_workers=LOCAL_PARSE_WORKERS, tables=LOCAL_PARSE_TABLES, chunks_per_worker=4):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.tables = tables
+        self.chunks_per_worker = chunks_per_worker
+        self._pool = None
+
+    @property
+    def options(self):
+        """Everything that changes the output, for the parse cache key"""
+        return {"backend": "local", "tables": self.tables, "version": LOCAL_PARSER_VERSION}
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def parse_pages(self, file_path):
+        """[(page_index, page_label, text)] for every page, in page order"""
+        from pypdf import PdfReader
+
+        path = str(file_path)
+        n_pages = len(PdfReader(path).pages)
+        if self.max_workers == 1 or n_pages < 2:
+            return _parse_page_range(path, 0, n_pages, self.tables)
+
+        chunk = max(1, math.ceil(n_pages / (self.max_workers * self.chunks_per_worker)))
+        futures = [
+            self._executor().submit(_parse_page_range, path, start, min(start + chunk, n_pages), self.tables)
+            for start in range(0, n_pages, chunk)
+        ]
+        # Futures are in page order, so concatenating their results keeps pages ordered
+        return [page for future in futures for page in future.result()]
+
+    def load_data(self, file_path, extra_info=None, **kwargs):
+        start_time = time.time()
+        pages = self.parse_pages(file_path)
+        documents = [
+            Document(
+                text=text,
+                metadata={**(extra_info or {}), "page_label": label, "page_number": index + 1}
+            )
+            for index, label, text in pages
+            if text.strip()
+        ]
+        print(f"Parsed {len(pages)} page(s) of {os.path.basename(str(file_path))} locally "
+              f"with {self.max_workers} worker(s) in {time.time() - start_time:.2f}s")
+        return documents
@@ -0,0 +1,240 @@
+import os
+import time
+import asyncio
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+from pydantic import PrivateAttr
+from tracing import current_trace
+
+# Off by default: coalescing pays off under concurrent load, and costs a lone query up to one window
+MICRO_BATCH_ENABLED = os.getenv("MICRO_BATCH", "0") == "1"
+# Query embeddings: one network round trip per batch, so several can be in flight
+EMBED_MICRO_BATCH_WINDOW_MS = float(os.getenv("EMBED_MICRO_BATCH_WINDOW_MS", "10"))
+EMBED_MICRO_BATCH_MAX = int(os.getenv("EMBED_MICRO_BATCH_MAX", "32"))
+EMBED_MICRO_BATCH_CONCURRENCY = int(os.getenv("EMBED_MICRO_BATCH_CONCURRENCY", "4"))
+METRICS_WINDOW = 2000  # recent requests/batches kept for the percentiles
+
+_batchers = {}
+_registry_lock = threading.Lock()
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-item requests into batched calls.
+
+    Callers run the batches themselves (no dispatcher thread to hand off to):
+    the first caller with pending items becomes the leader, waits up to
+    `window_ms` from the oldest pending request (or until `max_batch_size`
+    items are pending), takes the batch, runs `batch_fn(items)` once and
+    hands every item its result (or the batch's exception). Callers whose
+    items were taken wait for that batch. At most `max_concurrency` batches
+    run at a time; requests arriving meanwhile accumulate into the next one.
+
+    `stats()` reports batch sizes, per-request queueing delay and batch call
+    time, for tuning the window against latency.
+    """
+
+    def __init__(self, name, batch_fn, window_ms=10.0, max_batch_size=32, max_concurrency=1):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.window_ms = window_ms
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_concurrency = max(1, max_concurrency)
+        self._cond = threading.Condition()
+        self._pending = []  # (item, future, enqueued_at), oldest first
+        self._running = 0
+        self._collecting = False
+        self._stats_lock = threading.Lock()
+        self._sizes = Counter()
+        self._queue_ms = deque(maxlen=METRICS_WINDOW)
+        self._batch_ms = deque(maxlen=METRICS_WINDOW)
+        self._items = 0
+        self._errors = 0
+        with _registry_lock:
+            _batchers[name] = self
+
+    def __call__(self, item):
+        return self.map([item])[0]
+
+    def map(self, items):
+        """Results for `items` in order, blocking; records the wait in the active trace"""
+        if not items:
+            return []
+        enqueued_at = time.perf_counter()
+        futures = [Future() for _ in items]
+        with self._cond:
+            self._pending.extend((item, future, enqueued_at) for item, future in zip(items, futures))
+            self._cond.notify_all()
+        while True:
+            with self._cond:
+                if all(future.done() for future in futures):
+                    break
+                if self._collecting or self._running >= self.max_concurrency or not self._pending:
+                    # Another caller is collecting or running our items, or every slot is busy
+                    self._cond.wait()
+                    continue
+                self._collecting = True
+                self._running += 1
+                deadline = self._pending[0][2] + self.window_ms / 1000
+                while len(self._pending) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch_size]
+                del self._pending[:self.max_batch_size]
+                self._collecting = False
+                self._cond.notify_all()
+            try:
+                self._run_batch(batch)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._cond.notify_all()
+
+        results = [future.result() for future in futures]
+        trace = current_trace()
+        if trace is not None:
+            trace.set(f"{self.name}_batch", {
+                "items": len(items),
+                "batch_size": max(future.batch_size for future in futures),
+                "queue_ms": round(max(future.queue_ms for future in futures), 2),
+            })
+        return results
+
+    def _run_batch(self, batch):
+        dispatched_at = time.perf_counter()
+        for _, future, enqueued_at in batch:
+            future.batch_size = len(batch)
+            future.queue_ms = (dispatched_at - enqueued_at) * 1000
+        try:
+            results = self.batch_fn([item for item, _, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"{self.name}: batch of {len(batch)} returned {len(results)} results")
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            with self._stats_lock:
+                self._errors += 1
+            return
+        finally:
+            batch_ms = (time.perf_counter() - dispatched_at) * 1000
+            with self._stats_lock:
+                self._sizes[len(batch)] += 1
+                self._items += len(batch)
+                self._batch_ms.append(batch_ms)
+                self._queue_ms.extend(future.queue_ms for _, future, _ in batch)
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def stats(self):
+        with self._stats_lock:
+            batches = sum(self._sizes.values())
+            queue_ms = np.array(self._queue_ms, dtype=np.float64)
+            batch_ms = np.array(self._batch_ms, dtype=np.float64)
+            stats = {
+                "window_ms": self.window_ms,
+                "max_batch_size": self.max_batch_size,
+                "batches": batches,
+                "items": self._items,
+                "errors": self._errors,
+                "mean_batch_size": round(self._items / batches, 2) if batches else 0.0,
+                "max_seen_batch_size": max(self._sizes) if self._sizes else 0,
+                "batch_sizes": dict(sorted(self._sizes.items())),
+            }
+        for label, values in (("queue_ms", queue_ms), ("batch_ms", batch_ms)):
+            if len(values):
+                stats[f"{label}_p50"] = round(float(np.percentile(values, 50)), 2)
+                stats[f"{label}_p95"] = round(float(np.percentile(values, 95)), 2)
+                stats[f"{label}_max"] = round(float(values.max()), 2)
+        return stats
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._sizes.clear()
+            self._queue_ms.clear()
+            self._batch_ms.clear()
+            self._items = 0
+            self._errors = 0
+
+
+def batching_stats():
+    """stats() of every micro-batcher in this process, by name"""
+    with _registry_lock:
+        batchers = list(_batchers.values())
+    return {batcher.name: batcher.stats() for batcher in batchers}
+
+
+def reset_batching_stats():
+    with _registry_lock:
+        batchers = list(_batchers.values())
+    for batcher in batchers:
+        batcher.reset_stats()
+
+
+def embed_queries(embed_model, queries):
+    """Query embeddings for several questions in one call where the model supports it"""
+    if hasattr(embed_model, "_embed_texts"):
+        # GoogleGenAIEmbedding (and fakes.FakeEmbedding): one request, query task type
+        return embed_model._embed_texts(list(queries), task_type="RETRIEVAL_QUERY")
+    return [embed_model._get_query_embedding(query) for query in queries]
+
+
+class BatchedQueryEmbedding(BaseEmbedding):
+    """Embedding model whose query embeddings go through a MicroBatcher.
+
+    Concurrent questions share one embedding request; document embeddings
+    are passed straight to the wrapped model (ingestion batches them already).
+    The model name is the wrapped one, so embedding-cache keys do not change.
+    """
+
+    _inner = PrivateAttr()
+    _batcher = PrivateAttr()
+
+    def __init__(self, embed_model, window_ms=EMBED_MICRO_BATCH_WINDOW_MS, max_batch_size=EMBED_MICRO_BATCH_MAX,
+                 max_concurrency=EMBED_MICRO_BATCH_CONCURRENCY, **kwargs):
+        super().__init__(model_name=embed_model.model_name, embed_batch_size=embed_model.embed_batch_size, **kwargs)
+        self._inner = embed_model
+        self._batcher = MicroBatcher("embed", lambda queries: embed_queries(embed_model, queries),
+                                     window_ms=window_ms, max_batch_size=max_batch_size,
+                                     max_concurrency=max_concurrency)
+
+    @classmethod
+    def class_name(cls):
+        return "BatchedQueryEmbedding"
+
+    @property
+    def inner(self):
+        return self._inner
+
+    @property
+    def batcher(self):
+        return self._batcher
+
+    def _get_query_embedding(self, query):
+        return self._batcher(query)
+
+    async def _aget_query_embedding(self, query):
+        # The batch is collected and run by blocking callers, so off the event loop
+        return await asyncio.to_thread(self._batcher, query)
+
+    def _get_text_embedding(self, text):
+        return self._inner._get_text_embedding(text)
+
+    async def _aget_text_embedding(self, text):
+        return await self._inner._aget_text_embedding(text)
+
+    def _get_text_embeddings(self, texts):
+        return self._inner._get_text_embeddings(texts)
+
+    async def _aget_text_embeddings(self, texts):
+        return await self._inner._aget_text_embeddings(texts)
+
+
+def batched_query_embedding(embed_model):
+    """`embed_model` behind a query micro-batcher if MICRO_BATCH=1"""
+    if not MICRO_BATCH_ENABLED or isinstance(embed_model, BatchedQueryEmbedding):
+        return embed_model
+    return BatchedQueryEmbedding(embed_model)
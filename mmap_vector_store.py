@@ -0,0 +1,567 @@
+import os
+import io
+import json
+import uuid
+import argparse
+import numpy as np
+from pydantic import PrivateAttr
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQueryMode,
+    VectorStoreQueryResult,
+)
+from ann_index import IVFIndex, ANN_NPROBE, ANN_MIN_VECTORS
+from quantization import Quantizer
+from filter_index import from_metadata_filters
+
+VECTORS_FILE = "vectors.npy"
+NODE_IDS_FILE = "vector_node_ids.npy"
+REF_DOC_IDS_FILE = "vector_ref_doc_ids.npy"
+# Written last on every persist; names the data files and how many of their rows are committed
+META_FILE = "vector_store_meta.json"
+# File names of stores whose meta predates the "files" entry
+LEGACY_FILES = {"vectors": VECTORS_FILE, "node_ids": NODE_IDS_FILE, "ref_doc_ids": REF_DOC_IDS_FILE}
+LEGACY_VECTOR_STORE_FILE = "default__vector_store.json"
+
+# Rows scored per matrix-vector product (and copied per block on persist); bounds the float32 temporary
+SCORE_BLOCK_ROWS = 65536
+
+
+def _encode_ids(ids):
+    """Pack string ids into a fixed-width bytes array (memory-mappable, 1 byte per ASCII char)"""
+    encoded = [i.encode("utf-8") for i in ids]
+    width = max((len(e) for e in encoded), default=1) or 1
+    return np.array(encoded, dtype=f"S{width}")
+
+
+def _save_atomic(path, array):
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _write_json_atomic(path, data):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(path + ".tmp", path)
+
+
+def _append_rows(path, count, rows):
+    """Append `rows` after the first `count` rows of the .npy at `path`, in place.
+
+    Rows past `count` (left by an interrupted append) are overwritten. The
+    header is rewritten in place with the new length, which numpy leaves room
+    for. Returns False, without touching the file, when the rows cannot be
+    appended (different dtype or width, or an old header without that room).
+    """
+    with open(path, "r+b") as f:
+        if np.lib.format.read_magic(f) != (1, 0):
+            return False
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        offset = f.tell()
+        if fortran_order or dtype != rows.dtype or shape[1:] != rows.shape[1:] or shape[0] < count:
+            return False
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {
+            "descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False,
+            "shape": (count + len(rows),) + shape[1:]})
+        if len(header.getvalue()) != offset:
+            return False
+        row_bytes = dtype.itemsize * int(np.prod(shape[1:], dtype=np.int64))
+        f.truncate(offset + count * row_bytes)
+        f.seek(offset + count * row_bytes)
+        f.write(np.ascontiguousarray(rows).tobytes())
+        f.seek(0)
+        f.write(header.getvalue())
+        f.flush()
+        os.fsync(f.fileno())
+    return True
+
+
+class MmapVectorStore(BasePydanticVectorStore):
+    """Vector store backed by a contiguous, memory-mapped float32/float16 `.npy` matrix.
+
+    Embeddings are L2-normalised on write so cosine similarity is a single
+    matrix-vector product. Persisted rows stay on disk (np.load mmap_mode="r");
+    rows added since the last persist live in memory, and deletions are a
+    tombstone mask until `persist()` rewrites the files.
+
+    When an IVF index built for the current file generation is present,
+    persisted rows are searched approximately (see ann_index.py); `nprobe`
+    trades recall for speed.
+
+    When compressed codes built for the current file generation are present
+    (see quantization.py), persisted rows are scored against the int8 or PQ
+    codes in memory, and only the shortlist is re-scored from the full
+    vectors on disk.
+
+    Metadata filters (file, page range, year) are turned into a row mask by an
+    attached filter_index.FilterIndex, and only the matching rows are scored.
+    """
+
+    stores_text: bool = False
+    dtype: str = "float32"
+    nprobe: int = ANN_NPROBE
+
+    _persist_dir = PrivateAttr(default=None)
+    _files = PrivateAttr(default=None)
+    _vectors = PrivateAttr(default=None)
+    _node_ids = PrivateAttr(default=None)
+    _ref_doc_ids = PrivateAttr(default=None)
+    _deleted = PrivateAttr(default=None)
+    _pending_vectors = PrivateAttr(default_factory=list)
+    _pending_node_ids = PrivateAttr(default_factory=list)
+    _pending_ref_doc_ids = PrivateAttr(default_factory=list)
+    _dirty = PrivateAttr(default=False)
+    _generation = PrivateAttr(default=None)
+    _ann = PrivateAttr(default=None)
+    _quantized = PrivateAttr(default=None)
+    _filter_cache = PrivateAttr(default=None)
+    _filter_index = PrivateAttr(default=None)
+
+    def __init__(self, dtype="float32", nprobe=ANN_NPROBE, **kwargs):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported dtype '{dtype}'; use 'float32' or 'float16'.")
+        super().__init__(dtype=dtype, nprobe=nprobe, **kwargs)
+        self._deleted = np.zeros(0, dtype=bool)
+
+    @classmethod
+    def class_name(cls):
+        return "MmapVectorStore"
+
+    @staticmethod
+    def exists(persist_dir):
+        return os.path.exists(os.path.join(persist_dir, META_FILE))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir, nprobe=ANN_NPROBE, use_ann=True, use_quantized=True):
+        with open(os.path.join(persist_dir, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        store = cls(dtype=meta["dtype"], nprobe=nprobe)
+        store._persist_dir = persist_dir
+        store._open(persist_dir, meta)
+        if use_ann:
+            store.load_ann(persist_dir)
+        if use_quantized:
+            store.load_quantized(persist_dir)
+        return store
+
+    def _open(self, persist_dir, meta):
+        """Map the data files named by `meta`, keeping only its committed rows"""
+        files = meta.get("files", LEGACY_FILES)
+        arrays = {name: np.load(os.path.join(persist_dir, fname), mmap_mode="r") for name, fname in files.items()}
+        count = meta.get("count", len(arrays["node_ids"]))
+        if any(len(array) < count for array in arrays.values()):
+            raise ValueError(f"The vector store in '{persist_dir}' is inconsistent: {META_FILE} lists {count} rows, "
+                             f"but the data files hold {[len(a) for a in arrays.values()]}. Re-run `python ingest.py`.")
+        self._vectors = arrays["vectors"][:count]
+        self._node_ids = arrays["node_ids"][:count]
+        self._ref_doc_ids = arrays["ref_doc_ids"][:count]
+        self._files = files
+        self._deleted = np.zeros(count, dtype=bool)
+        self._generation = meta.get("generation")
+        self._ann = None
+        self._quantized = None
+
+    def load_ann(self, persist_dir):
+        """Attach the persisted IVF index if it was built for these exact files"""
+        ann = IVFIndex.load(persist_dir)
+        if ann is not None and ann.generation != self._generation:
+            print("Ignoring stale ANN index (built for an older vector file); rebuild with `python ingest.py`.")
+            ann = None
+        self._ann = ann
+        return ann
+
+    def load_quantized(self, persist_dir):
+        """Attach the persisted int8/PQ codes if they were built for these exact files"""
+        quantized = Quantizer.load(persist_dir)
+        if quantized is not None and quantized.generation != self._generation:
+            print("Ignoring stale quantized vectors (built for an older vector file); rebuild with `python ingest.py`.")
+            quantized = None
+        self._quantized = quantized
+        return quantized
+
+    def attach_filter_index(self, filter_index):
+        """Answer metadata-filtered queries (file, page, year) with this filter_index.FilterIndex"""
+        self._filter_index = filter_index
+
+    @property
+    def filter_index(self):
+        return self._filter_index
+
+    @property
+    def quantized(self):
+        return self._quantized
+
+    @property
+    def generation(self):
+        return self._generation
+
+    @property
+    def persisted_node_ids(self):
+        return self._node_ids if self._node_ids is not None else np.zeros(0, dtype="S1")
+
+    @property
+    def client(self):
+        return None
+
+    @property
+    def persisted_count(self):
+        return 0 if self._node_ids is None else len(self._node_ids)
+
+    @property
+    def node_count(self):
+        # Not __len__: StorageContext tests `if vector_store:`, and an empty store must stay truthy
+        return self.persisted_count - int(self._deleted.sum()) + len(self._pending_node_ids)
+
+    def add(self, nodes, **add_kwargs):
+        for node in nodes:
+            vector = np.asarray(node.get_embedding(), dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            self._pending_vectors.append(vector / norm if norm > 0 else vector)
+            self._pending_node_ids.append(node.node_id)
+            self._pending_ref_doc_ids.append(node.ref_doc_id or "")
+        self._dirty = True
+        return [node.node_id for node in nodes]
+
+    def _drop(self, persisted_mask, pending_keep):
+        if persisted_mask is not None and persisted_mask.any():
+            self._deleted |= persisted_mask
+            self._dirty = True
+        if len(pending_keep) != len(self._pending_node_ids):
+            self._pending_vectors = [self._pending_vectors[i] for i in pending_keep]
+            self._pending_node_ids = [self._pending_node_ids[i] for i in pending_keep]
+            self._pending_ref_doc_ids = [self._pending_ref_doc_ids[i] for i in pending_keep]
+            self._dirty = True
+
+    def delete(self, ref_doc_id, **delete_kwargs):
+        persisted_mask = None
+        if self.persisted_count:
+            persisted_mask = np.asarray(self._ref_doc_ids) == ref_doc_id.encode("utf-8")
+        pending_keep = [i for i, ref in enumerate(self._pending_ref_doc_ids) if ref != ref_doc_id]
+        self._drop(persisted_mask, pending_keep)
+
+    def delete_nodes(self, node_ids=None, filters=None, **delete_kwargs):
+        if filters is not None:
+            raise ValueError("MmapVectorStore does not support metadata filters.")
+        if node_ids is None:
+            return
+        persisted_mask = None
+        if self.persisted_count:
+            persisted_mask = np.isin(np.asarray(self._node_ids), _encode_ids(node_ids))
+        wanted = set(node_ids)
+        pending_keep = [i for i, node_id in enumerate(self._pending_node_ids) if node_id not in wanted]
+        self._drop(persisted_mask, pending_keep)
+
+    def clear(self):
+        self._drop(np.ones(self.persisted_count, dtype=bool), [])
+
+    def _encoded_filter(self, node_ids):
+        """Encoded, de-duplicated node-id filter, cached for retrievers that pass the same list every query"""
+        key = (id(node_ids), len(node_ids))
+        # The snapshot confirms a hit: the list may have been mutated in place, or its id reused
+        if self._filter_cache is None or self._filter_cache[0] != key or self._filter_cache[1] != tuple(node_ids):
+            self._filter_cache = (key, tuple(node_ids), np.unique(_encode_ids(node_ids)))
+        return self._filter_cache[2]
+
+    @staticmethod
+    def _top_k(scores, rows, k):
+        k = min(k, len(rows))
+        if k <= 0:
+            return rows[:0], scores[:0]
+        top = np.argpartition(-scores, k - 1)[:k]
+        return rows[top], scores[top]
+
+    def _search_persisted(self, query, k, wanted, row_mask=None):
+        if not self.persisted_count:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        has_deletions = self._deleted.any()
+        if row_mask is not None:
+            row_mask = row_mask & ~self._deleted if has_deletions else row_mask
+            selected = np.flatnonzero(row_mask)
+            if self._ann is None or len(selected) < ANN_MIN_VECTORS:
+                return self._search_rows(query, k, wanted, selected)
+            # Many matching rows: probe the ANN lists and keep only the matching candidates
+            def row_filter(rows):
+                keep = row_mask[rows]
+                if wanted is not None:
+                    keep &= np.isin(np.asarray(self._node_ids[rows]), wanted)
+                return keep
+            rows, scores = self._ann_search(query, k, row_filter)
+            if len(rows) < min(k, len(selected)):
+                # The probed lists held too few matching rows
+                return self._search_rows(query, k, wanted, selected)
+            return rows, scores
+
+        if self._ann is not None:
+            def row_filter(rows):
+                keep = ~self._deleted[rows] if has_deletions else np.ones(len(rows), dtype=bool)
+                if wanted is not None:
+                    keep &= np.isin(np.asarray(self._node_ids[rows]), wanted)
+                return keep
+            needs_filter = has_deletions or wanted is not None
+            return self._ann_search(query, k, row_filter if needs_filter else None)
+
+        if self._quantized is not None:
+            rows = None
+            if has_deletions or wanted is not None:
+                valid = ~self._deleted
+                if wanted is not None:
+                    valid &= np.isin(np.asarray(self._node_ids), wanted)
+                rows = np.flatnonzero(valid)
+            return self._quantized.search(self._vectors, query, k, rows)
+
+        # Exact scan: one matrix-vector product per block of rows
+        parts = []
+        for start in range(0, self.persisted_count, SCORE_BLOCK_ROWS):
+            block = self._vectors[start:start + SCORE_BLOCK_ROWS]
+            parts.append(block.astype(np.float32, copy=False) @ query)
+        scores = np.concatenate(parts)
+        rows = np.arange(self.persisted_count)
+        if has_deletions or wanted is not None:
+            valid = ~self._deleted
+            if wanted is not None:
+                valid &= np.isin(np.asarray(self._node_ids), wanted)
+            rows = rows[valid]
+            scores = scores[valid]
+        return self._top_k(scores, rows, k)
+
+    def _search_rows(self, query, k, wanted, rows):
+        """Exact scan of only the given persisted rows (sorted), gathered block by block"""
+        if wanted is not None and len(rows):
+            rows = rows[np.isin(np.asarray(self._node_ids[rows]), wanted)]
+        if self._quantized is not None:
+            return self._quantized.search(self._vectors, query, k, rows)
+        parts = []
+        for start in range(0, len(rows), SCORE_BLOCK_ROWS):
+            block = self._vectors[rows[start:start + SCORE_BLOCK_ROWS]]
+            parts.append(block.astype(np.float32, copy=False) @ query)
+        scores = np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+        return self._top_k(scores, rows, k)
+
+    def _ann_search(self, query, k, row_filter):
+        """IVF candidates, scored exactly or through the quantized codes with rescoring"""
+        if self._quantized is None:
+            return self._ann.search(self._vectors, query, k, self.nprobe, row_filter)
+        rows = np.sort(self._ann.candidates(query, self.nprobe))
+        if row_filter is not None and len(rows):
+            rows = rows[row_filter(rows)]
+        return self._quantized.search(self._vectors, query, k, rows)
+
+    def _search_pending(self, query, k, wanted):
+        """Exact search over rows added since the last persist (never in the ANN index)"""
+        if not self._pending_vectors:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        scores = np.vstack(self._pending_vectors) @ query
+        rows = np.arange(len(self._pending_vectors))
+        if wanted is not None:
+            valid = np.isin(_encode_ids(self._pending_node_ids), wanted)
+            rows = rows[valid]
+            scores = scores[valid]
+        rows, scores = self._top_k(scores, rows, k)
+        return rows + self.persisted_count, scores
+
+    def query(self, query, **kwargs):
+        row_mask = None
+        filters = from_metadata_filters(query.filters)
+        if filters is not None:
+            if self._filter_index is None:
+                raise ValueError("Metadata filters need a filter index; see attach_filter_index().")
+            row_mask = self._filter_index.mask("vector", self.persisted_node_ids, filters)
+        if query.mode != VectorStoreQueryMode.DEFAULT:
+            raise ValueError(f"MmapVectorStore only supports the default query mode, got '{query.mode}'.")
+
+        vector = np.asarray(query.query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+        wanted = self._encoded_filter(query.node_ids) if query.node_ids is not None else None
+
+        k = query.similarity_top_k
+        persisted_rows, persisted_scores = self._search_persisted(vector, k, wanted, row_mask)
+        if row_mask is None:
+            pending_rows, pending_scores = self._search_pending(vector, k, wanted)
+        else:
+            # Rows added since the last persist have no filter columns yet
+            pending_rows, pending_scores = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows, scores = self._top_k(
+            np.concatenate([persisted_scores, pending_scores]),
+            np.concatenate([persisted_rows, pending_rows]),
+            k
+        )
+        order = np.argsort(-scores, kind="stable")
+        rows, scores = rows[order], scores[order]
+
+        persisted = self.persisted_count
+        ids = []
+        for row in rows:
+            if row < persisted:
+                ids.append(self._node_ids[row].decode("utf-8"))
+            else:
+                ids.append(self._pending_node_ids[row - persisted])
+        return VectorStoreQueryResult(nodes=None, similarities=scores.tolist(), ids=ids)
+
+    def _write_vectors(self, path, keep, count, dim):
+        """Write kept persisted rows + pending rows to `path` block by block.
+
+        The new file is filled through a write-mode memmap, so a rewrite never
+        holds the whole matrix in RAM.
+        """
+        if not count or not dim:
+            _save_atomic(path, np.zeros((count, dim), dtype=self.dtype))
+            return
+        tmp_path = path + ".tmp.npy"
+        matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=self.dtype, shape=(count, dim))
+        row = 0
+        for start in range(0, self.persisted_count, SCORE_BLOCK_ROWS):
+            block = np.asarray(self._vectors[start:start + SCORE_BLOCK_ROWS])[keep[start:start + SCORE_BLOCK_ROWS]]
+            matrix[row:row + len(block)] = block
+            row += len(block)
+        if self._pending_vectors:
+            matrix[row:] = np.vstack(self._pending_vectors)
+        matrix.flush()
+        del matrix
+        os.replace(tmp_path, path)
+
+    def _append(self, persist_dir):
+        """Append the pending rows to the current files; False if they must be rewritten instead"""
+        if self._deleted.any() or not self.persisted_count or self._files is None:
+            return False
+        if os.path.abspath(persist_dir) != os.path.abspath(self._persist_dir or ""):
+            return False
+        count = self.persisted_count
+        vectors = np.vstack(self._pending_vectors).astype(self.dtype)
+        node_ids = _encode_ids(self._pending_node_ids).astype(self._node_ids.dtype)
+        ref_doc_ids = _encode_ids(self._pending_ref_doc_ids).astype(self._ref_doc_ids.dtype)
+        # Ids wider than the existing fixed-width arrays need a rewrite
+        if (np.char.str_len(node_ids) != np.char.str_len(_encode_ids(self._pending_node_ids))).any() \
+                or (np.char.str_len(ref_doc_ids) != np.char.str_len(_encode_ids(self._pending_ref_doc_ids))).any():
+            return False
+        # Release the maps before the files grow
+        self._vectors = self._node_ids = self._ref_doc_ids = None
+        paths = {name: os.path.join(persist_dir, fname) for name, fname in self._files.items()}
+        return (_append_rows(paths["node_ids"], count, node_ids)
+                and _append_rows(paths["ref_doc_ids"], count, ref_doc_ids)
+                and _append_rows(paths["vectors"], count, vectors))
+
+    def _rewrite(self, persist_dir, generation):
+        """Write all kept rows to new files named after `generation`; returns their names"""
+        keep = ~self._deleted
+        parts_ids = [_encode_ids(self._pending_node_ids)]
+        parts_refs = [_encode_ids(self._pending_ref_doc_ids)]
+        if self.persisted_count:
+            parts_ids.insert(0, np.asarray(self._node_ids)[keep])
+            parts_refs.insert(0, np.asarray(self._ref_doc_ids)[keep])
+        node_ids = np.concatenate(parts_ids).astype(f"S{max(p.dtype.itemsize for p in parts_ids)}")
+        ref_doc_ids = np.concatenate(parts_refs).astype(f"S{max(p.dtype.itemsize for p in parts_refs)}")
+
+        if self.persisted_count:
+            dim = self._vectors.shape[1]
+        else:
+            dim = len(self._pending_vectors[0]) if self._pending_vectors else 0
+        files = {name: f"{os.path.splitext(fname)[0]}-{generation[:12]}.npy" for name, fname in LEGACY_FILES.items()}
+        self._write_vectors(os.path.join(persist_dir, files["vectors"]), keep, len(node_ids), dim)
+        _save_atomic(os.path.join(persist_dir, files["node_ids"]), node_ids)
+        _save_atomic(os.path.join(persist_dir, files["ref_doc_ids"]), ref_doc_ids)
+        return files, len(node_ids), dim
+
+    def persist(self, persist_path, fs=None):
+        """Write pending rows and deletions to disk.
+
+        With no deletions since the last persist, the new rows are appended
+        to the current files, so each ingestion commit writes only its own
+        rows. Otherwise every kept row is rewritten into new files. Either
+        way the meta file, written atomically and last, is the commit point:
+        it names the files and the number of committed rows, so a crash or a
+        concurrent reader never pairs vectors with the wrong ids.
+
+        StorageContext passes `<dir>/default__vector_store.json`; only its
+        directory is used.
+        """
+        persist_dir = os.path.dirname(persist_path) or "."
+        if not self._dirty and self._persist_dir and os.path.abspath(persist_dir) == os.path.abspath(self._persist_dir):
+            return
+        os.makedirs(persist_dir, exist_ok=True)
+
+        # A new generation id invalidates indexes built over the previous rows
+        generation = uuid.uuid4().hex
+        old_files = self._files if self._persist_dir and os.path.abspath(persist_dir) == os.path.abspath(self._persist_dir) else None
+        persisted_count = self.persisted_count
+        dim = self._vectors.shape[1] if persisted_count else 0
+        if self._pending_vectors and self._append(persist_dir):
+            files, count = self._files, persisted_count + len(self._pending_node_ids)
+        else:
+            if self._files is not None and self._vectors is None:
+                # An append gave up after releasing the maps
+                self._open(self._persist_dir, self._read_meta(self._persist_dir))
+            files, count, dim = self._rewrite(persist_dir, generation)
+        _write_json_atomic(os.path.join(persist_dir, META_FILE), {
+            "dtype": self.dtype, "dim": int(dim), "count": count, "generation": generation, "files": files})
+        if old_files and old_files != files:
+            for fname in old_files.values():
+                if os.path.exists(os.path.join(persist_dir, fname)):
+                    os.remove(os.path.join(persist_dir, fname))
+
+        # Re-open the written files so memory goes back to the page cache
+        self._pending_vectors = []
+        self._pending_node_ids = []
+        self._pending_ref_doc_ids = []
+        self._persist_dir = persist_dir
+        self._open(persist_dir, self._read_meta(persist_dir))
+        self._dirty = False
+
+    @staticmethod
+    def _read_meta(persist_dir):
+        with open(os.path.join(persist_dir, META_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+
+def migrate_from_json(persist_dir, dtype="float32"):
+    """Convert a persisted SimpleVectorStore (JSON float lists) into the mmap layout"""
+    json_path = os.path.join(persist_dir, LEGACY_VECTOR_STORE_FILE)
+    if not os.path.exists(json_path):
+        raise FileNotFoundError(f"No JSON vector store found at '{json_path}'.")
+
+    print(f"Reading '{json_path}'...")
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    store = MmapVectorStore(dtype=dtype)
+    ref_doc_ids = data.get("text_id_to_ref_doc_id", {})
+    for node_id, embedding in data["embedding_dict"].items():
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        store._pending_vectors.append(vector / norm if norm > 0 else vector)
+        store._pending_node_ids.append(node_id)
+        store._pending_ref_doc_ids.append(ref_doc_ids.get(node_id) or "")
+    store._dirty = True
+    store.persist(os.path.join(persist_dir, LEGACY_VECTOR_STORE_FILE))
+
+    # Keep the original around, but out of the way of SimpleVectorStore's loader
+    os.replace(json_path, json_path + ".bak")
+    print(f"Migrated {store.node_count} embeddings to '{os.path.join(persist_dir, store._files['vectors'])}' ({dtype}). "
+          f"Original kept as '{json_path}.bak'.")
+    return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory-mapped vector store utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Convert the JSON SimpleVectorStore in a storage dir")
+    migrate.add_argument("--persist-dir", default="./storage")
+    migrate.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    quantize = subparsers.add_parser("quantize", help="Build (or with 'none', remove) compressed codes for a storage dir")
+    quantize.add_argument("--persist-dir", default="./storage")
+    quantize.add_argument("--kind", choices=["none", "int8", "pq"], default="int8")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_from_json(args.persist_dir, dtype=args.dtype)
+    elif args.command == "quantize":
+        from quantization import build_quantized_vectors
+        from shards import shard_dirs
+
+        # Every shard of a sharded store
+        for persist_dir in shard_dirs(args.persist_dir).values() or [args.persist_dir]:
+            build_quantized_vectors(persist_dir, kind=args.kind)
@@ -1,7 +1,9 @@
 import streamlit as st
 import pandas as pd
 import os
+import json
 from pathlib import Path
+from tracing import TRACE_FILE, load_traces
 
 st.set_page_config(page_title="Evaluation Dashboard", page_icon="📊", layout="wide")
 
@@ -12,131 +14,251 @@ st.markdown("---")
 
 # Path to benchmark results - FIXED FOR v2.0
 RESULTS_FILE = "benchmark_results.csv"
+SUMMARY_FILE = "benchmark_summary.json"
+
+# Pipeline stages in execution order ("retrieve" is vector + BM25 + fusion, run concurrently)
+STAGE_ORDER = ["queue", "table_lookup", "embed", "vector", "bm25", "fusion", "retrieve", "rerank", "synthesize", "llm"]
 
 # Check if results file exists
 if not os.path.exists(RESULTS_FILE):
     st.warning("⚠️ No evaluation results found. Please run `python evaluate.py` first to generate benchmark data.")
     st.info("💡 This will create the `benchmark_results.csv` file with performance metrics.")
-    st.stop()
-
-# Load benchmark results
-try:
-    df = pd.read_csv(RESULTS_FILE)
+else:
+    # Load benchmark results
+    try:
+        df = pd.read_csv(RESULTS_FILE)
     
-    # Display key metrics
-    st.header("🎯 Key Performance Metrics")
+        # Display key metrics
+        st.header("🎯 Key Performance Metrics")
     
-    col1, col2, col3, col4 = st.columns(4)
+        col1, col2, col3, col4 = st.columns(4)
     
-    # Calculate metrics
-    avg_latency = df[df["Latency (s)"] > 0]["Latency (s)"].mean()
-    successful_queries = len(df[df["Latency (s)"] > 0])
-    total_queries = len(df)
-    success_rate = (successful_queries / total_queries) * 100 if total_queries > 0 else 0
+        # Calculate metrics
+        avg_latency = df[df["Latency (s)"] > 0]["Latency (s)"].mean()
+        successful_queries = len(df[df["Latency (s)"] > 0])
+        total_queries = len(df)
+        success_rate = (successful_queries / total_queries) * 100 if total_queries > 0 else 0
     
-    with col1:
-        st.metric(
-            label="Average Latency",
-            value=f"{avg_latency:.2f}s",
-            delta=None,
-            help="Average query response time"
-        )
+        with col1:
+            st.metric(
+                label="Average Latency",
+                value=f"{avg_latency:.2f}s",
+                delta=None,
+                help="Average query response time"
+            )
     
-    with col2:
-        st.metric(
-            label="Success Rate",
-            value=f"{success_rate:.0f}%",
-            delta=None,
-            help="Percentage of successful queries"
-        )
+        with col2:
+            st.metric(
+                label="Success Rate",
+                value=f"{success_rate:.0f}%",
+                delta=None,
+                help="Percentage of successful queries"
+            )
+    
+        with col3:
+            st.metric(
+                label="Total Queries",
+                value=total_queries,
+                delta=None,
+                help="Number of benchmark queries"
+            )
+    
+        with col4:
+            st.metric(
+                label="Failed Queries",
+                value=total_queries - successful_queries,
+                delta=None,
+                help="Number of failed queries"
+            )
+    
+        # Load-test summary written by evaluate.py (percentiles over every measured request)
+        if os.path.exists(SUMMARY_FILE):
+            with open(SUMMARY_FILE, "r", encoding="utf-8") as f:
+                summary = json.load(f)
+            if "p50_s" in summary:
+                col1, col2, col3, col4, col5 = st.columns(5)
+                col1.metric("p50 Latency", f"{summary['p50_s']:.2f}s")
+                col2.metric("p95 Latency", f"{summary['p95_s']:.2f}s")
+                col3.metric("p99 Latency", f"{summary['p99_s']:.2f}s")
+                col4.metric("Throughput", f"{summary['qps']:.2f} QPS")
+                col5.metric("Error Rate", f"{summary['error_rate'] * 100:.1f}%")
+                st.caption(f"Engine: {summary.get('engine', 'app')} | Concurrency: {summary['concurrency']} | "
+                           f"Requests: {summary['requests']} | Fake LLM: {summary.get('fake_llm', False)}")
+    
+        st.markdown("---")
+    
+        # Latency Chart
+        st.header("📈 Query Performance Analysis")
     
-    with col3:
-        st.metric(
-            label="Total Queries",
-            value=total_queries,
-            delta=None,
-            help="Number of benchmark queries"
+        # Filter successful queries for chart
+        chart_df = df[df["Latency (s)"] > 0].copy()
+    
+        if not chart_df.empty:
+            # Create bar chart (mean over repeats of the same query)
+            st.bar_chart(
+                chart_df.groupby("Query")["Latency (s)"].mean(),
+                use_container_width=True
+            )
+        
+            st.caption("📊 Mean latency in seconds for each benchmark query")
+        else:
+            st.warning("No successful queries to display in chart.")
+    
+        st.markdown("---")
+    
+        # Detailed Results Table
+        st.header("📋 Detailed Results")
+    
+        # Display full dataframe
+        st.dataframe(
+            df,
+            use_container_width=True,
+            hide_index=True
         )
     
-    with col4:
-        st.metric(
-            label="Failed Queries",
-            value=total_queries - successful_queries,
-            delta=None,
-            help="Number of failed queries"
+        # Download button
+        csv = df.to_csv(index=False).encode('utf-8')
+        st.download_button(
+            label="⬇️ Download Results as CSV",
+            data=csv,
+            file_name="benchmark_results.csv",
+            mime="text/csv"
         )
     
-    st.markdown("---")
+        st.markdown("---")
     
-    # Latency Chart
-    st.header("📈 Query Performance Analysis")
+        # Performance Insights
+        st.header("💡 Performance Insights")
     
-    # Filter successful queries for chart
-    chart_df = df[df["Latency (s)"] > 0].copy()
+        col1, col2 = st.columns(2)
     
-    if not chart_df.empty:
-        # Create bar chart
-        st.bar_chart(
-            chart_df.set_index("Query")["Latency (s)"],
-            use_container_width=True
-        )
-        
-        st.caption("📊 Latency in seconds for each benchmark query")
-    else:
-        st.warning("No successful queries to display in chart.")
-    
-    st.markdown("---")
-    
-    # Detailed Results Table
-    st.header("📋 Detailed Results")
-    
-    # Display full dataframe
-    st.dataframe(
-        df,
-        use_container_width=True,
-        hide_index=True
-    )
-    
-    # Download button
-    csv = df.to_csv(index=False).encode('utf-8')
-    st.download_button(
-        label="⬇️ Download Results as CSV",
-        data=csv,
-        file_name="benchmark_results.csv",
-        mime="text/csv"
-    )
-    
-    st.markdown("---")
-    
-    # Performance Insights
-    st.header("💡 Performance Insights")
-    
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.subheader("✅ Strengths")
-        if success_rate >= 80:
-            st.success(f"High success rate ({success_rate:.0f}%)")
-        if avg_latency < 10:
-            st.success(f"Fast response times ({avg_latency:.2f}s average)")
+        with col1:
+            st.subheader("✅ Strengths")
+            if success_rate >= 80:
+                st.success(f"High success rate ({success_rate:.0f}%)")
+            if avg_latency < 10:
+                st.success(f"Fast response times ({avg_latency:.2f}s average)")
         
-        # Check for page citations
-        if "Pages Cited" in df.columns:
-            has_citations = df["Pages Cited"].notna().sum()
-            if has_citations > 0:
-                st.success(f"Page citations working ({has_citations} queries with sources)")
-    
-    with col2:
-        st.subheader("⚠️ Areas for Improvement")
-        if success_rate < 80:
-            st.warning(f"Success rate could be improved ({success_rate:.0f}%)")
-        if avg_latency > 10:
-            st.warning(f"Average latency is high ({avg_latency:.2f}s)")
+            # Check for page citations
+            if "Pages Cited" in df.columns:
+                has_citations = df["Pages Cited"].notna().sum()
+                if has_citations > 0:
+                    st.success(f"Page citations working ({has_citations} queries with sources)")
+    
+        with col2:
+            st.subheader("⚠️ Areas for Improvement")
+            if success_rate < 80:
+                st.warning(f"Success rate could be improved ({success_rate:.0f}%)")
+            if avg_latency > 10:
+                st.warning(f"Average latency is high ({avg_latency:.2f}s)")
         
-        failed_count = total_queries - successful_queries
-        if failed_count > 0:
-            st.warning(f"{failed_count} queries failed - check error logs")
+            failed_count = total_queries - successful_queries
+            if failed_count > 0:
+                st.warning(f"{failed_count} queries failed - check error logs")
+
+    except Exception as e:
+        st.error(f"❌ Error loading benchmark results: {e}")
+        st.info("Please ensure the `benchmark_results.csv` file is properly formatted.")
+
+st.markdown("---")
+
+# Per-query pipeline traces written by app.py and evaluate.py (see tracing.py)
+st.header("🔍 Query Pipeline Traces")
+
+# The most recent traces only: the log grows without bound
+TRACE_WINDOW = int(os.getenv("DASHBOARD_TRACE_WINDOW", "5000"))
+
+
+@st.cache_data(show_spinner=False)
+def load_recent_traces(trace_file, mtime, size, limit):
+    """Parsed once per version of the file (mtime and size are the cache key)"""
+    return load_traces(trace_file, limit=limit)
+
 
-except Exception as e:
-    st.error(f"❌ Error loading benchmark results: {e}")
-    st.info("Please ensure the `benchmark_results.csv` file is properly formatted.")
+trace_stat = os.stat(TRACE_FILE) if os.path.exists(TRACE_FILE) else None
+traces = load_recent_traces(TRACE_FILE, trace_stat.st_mtime if trace_stat else None,
+                            trace_stat.st_size if trace_stat else None, TRACE_WINDOW)
+if not traces:
+    st.info(f"No query traces yet. Ask a question in the app or run `python evaluate.py` to populate `{TRACE_FILE}`.")
+else:
+    rows = []
+    for t in traces:
+        row = {
+            "Time": pd.to_datetime(t["timestamp"], unit="s"),
+            "Query": t["query"],
+            "Source": t.get("source", "app"),
+            "Status": t.get("status", "ok"),
+            "Total (ms)": t.get("total_ms"),
+            "TTFT (ms)": t.get("ttft_ms"),
+            "Prompt Tokens": t.get("tokens", {}).get("prompt", 0),
+            "Completion Tokens": t.get("tokens", {}).get("completion", 0),
+            "Answer Cache": t.get("cache", {}).get("answer", ""),
+        }
+        for name, stage in t.get("stages", {}).items():
+            row[f"{name} (ms)"] = stage.get("ms")
+            if "count" in stage:
+                row[f"{name} (n)"] = stage["count"]
+        rows.append(row)
+    trace_df = pd.DataFrame(rows)
+    if len(traces) == TRACE_WINDOW:
+        st.caption(f"Showing the {TRACE_WINDOW} most recent traces (set `DASHBOARD_TRACE_WINDOW` to change).")
+
+    sources = sorted(trace_df["Source"].unique())
+    selected = st.multiselect("Sources", sources, default=[s for s in sources if not s.endswith("warmup")])
+    trace_df = trace_df[trace_df["Source"].isin(selected)]
+
+    if trace_df.empty:
+        st.warning("No traces for the selected sources.")
+    else:
+        ok_df = trace_df[trace_df["Status"] == "ok"]
+        total = ok_df["Total (ms)"].dropna()
+        cached = (trace_df["Answer Cache"].isin(["exact", "semantic"])).sum()
+        answered = (trace_df["Answer Cache"] != "").sum()
+
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("Traced Queries", len(trace_df))
+        col2.metric("p50 Total", f"{total.quantile(0.5) / 1000:.2f}s" if len(total) else "-")
+        col3.metric("p95 Total", f"{total.quantile(0.95) / 1000:.2f}s" if len(total) else "-")
+        col4.metric("p99 Total", f"{total.quantile(0.99) / 1000:.2f}s" if len(total) else "-")
+        col5.metric("Answer Cache Hits", f"{cached / answered * 100:.0f}%" if answered else "-")
+
+        # Stage breakdown
+        st.subheader("⏱️ Stage Breakdown")
+        stage_cols = [f"{name} (ms)" for name in STAGE_ORDER if f"{name} (ms)" in ok_df.columns]
+        stage_cols += sorted(c for c in ok_df.columns if c.endswith(" (ms)") and c not in stage_cols
+                             and c not in ("Total (ms)", "TTFT (ms)"))
+        if stage_cols:
+            breakdown = pd.DataFrame({
+                "Stage": [c[:-5] for c in stage_cols],
+                "Mean (ms)": [ok_df[c].mean() for c in stage_cols],
+                "p50 (ms)": [ok_df[c].quantile(0.5) for c in stage_cols],
+                "p95 (ms)": [ok_df[c].quantile(0.95) for c in stage_cols],
+                "Queries": [int(ok_df[c].notna().sum()) for c in stage_cols],
+            }).round(1)
+            st.bar_chart(breakdown.set_index("Stage")[["p50 (ms)", "p95 (ms)"]], use_container_width=True)
+            st.dataframe(breakdown, use_container_width=True, hide_index=True)
+            st.caption("Branch stages (vector, bm25) run concurrently inside `retrieve`; `llm` is generation time inside `synthesize`, so the gap is prompt packing.")
+
+        # Percentile trend
+        st.subheader("📉 Latency Percentiles Over Time")
+        bucket = st.selectbox("Bucket", ["1min", "15min", "1h", "1D"], index=2)
+        trend = ok_df.set_index("Time")["Total (ms)"].resample(bucket)
+        trend_df = pd.DataFrame({
+            "p50 (ms)": trend.quantile(0.5),
+            "p95 (ms)": trend.quantile(0.95),
+            "p99 (ms)": trend.quantile(0.99),
+        }).dropna()
+        if len(trend_df) > 1:
+            st.line_chart(trend_df, use_container_width=True)
+        else:
+            st.caption("Not enough time buckets for a trend yet; choose a smaller bucket.")
+
+        # Slowest queries
+        st.subheader("🐢 Slowest Queries")
+        slow_cols = ["Time", "Query", "Source", "Total (ms)", "TTFT (ms)", "Prompt Tokens", "Completion Tokens",
+                     "Answer Cache"] + stage_cols
+        st.dataframe(
+            trace_df.sort_values("Total (ms)", ascending=False).head(10)[slow_cols],
+            use_container_width=True,
+            hide_index=True
+        )
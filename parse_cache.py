@@ -0,0 +1,125 @@
+import os
+import gzip
+import json
+import hashlib
+from llama_index.core import Document
+from llama_index.core.readers.base import BaseReader
+
+PARSE_CACHE_DIR = "./cache/parse"
+PARSE_CACHE_MAX_MB = int(os.getenv("PARSE_CACHE_MAX_MB", "1024"))
+
+
+def file_sha256(path):
+    """Hash a file's contents in 1 MB blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParseCache:
+    """Directory of gzipped parser output (markdown + page metadata) with an LRU size cap.
+
+    Each entry is `<key>.json.gz`. Reads bump the file's mtime, so evicting the
+    oldest mtimes first gives least-recently-used order without a side index.
+    """
+
+    def __init__(self, cache_dir=PARSE_CACHE_DIR, max_bytes=PARSE_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(content_hash, options):
+        """Key on the file bytes plus every parser option that changes the output"""
+        payload = json.dumps({"sha256": content_hash, "options": options}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json.gz")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        except (OSError, EOFError, ValueError):
+            # Truncated or corrupt entry (gzip.BadGzipFile is an OSError): a miss, re-parsed and rewritten
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        os.utime(path, None)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Drop least-recently-used entries until the cache fits under max_bytes"""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".json.gz"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+            total += stat.st_size
+
+        entries.sort()
+        while total > self.max_bytes and entries:
+            _, size, name = entries.pop(0)
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+
+class CachedParser(BaseReader):
+    """Wrap a file parser (LlamaParse or a stub) so repeated files never leave the machine.
+
+    `options` must hold every setting that affects the parsed output
+    (result_type, premium_mode, language, ...); it is part of the cache key.
+    """
+
+    def __init__(self, parser, options, cache=None):
+        self.parser = parser
+        self.options = options
+        self.cache = cache or ParseCache()
+
+    def load_data(self, file_path, extra_info=None, **kwargs):
+        extra_info = dict(extra_info or {})
+        key = ParseCache.make_key(file_sha256(file_path), self.options)
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            return [
+                Document(text=page["text"], metadata={**extra_info, **page["metadata"]})
+                for page in entry["pages"]
+            ]
+
+        documents = self.parser.load_data(file_path, extra_info=extra_info, **kwargs)
+        if not documents:
+            # Don't pin a failed parse in the cache
+            return documents
+
+        # Store only what the parser produced; file metadata is re-attached on read
+        pages = []
+        for doc in documents:
+            page_metadata = {k: v for k, v in doc.metadata.items() if k not in extra_info}
+            pages.append({"text": doc.text, "metadata": page_metadata})
+        self.cache.put(key, {"file_name": os.path.basename(str(file_path)), "options": self.options, "pages": pages})
+
+        return documents
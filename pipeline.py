@@ -0,0 +1,444 @@
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from llama_index.core.retrievers import BaseRetriever, VectorIndexRetriever
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.response_synthesizers import get_response_synthesizer
+from llama_index.core.base.response.schema import Response
+from llama_index.core.schema import NodeWithScore, TextNode, QueryBundle
+from llama_index.retrievers.bm25 import BM25Retriever
+from bm25_index import BM25Index, PersistedBM25Retriever
+from tracing import current_trace, stage
+from rerank import make_reranker
+from table_store import TableStore, TABLE_LOOKUP_ENABLED
+from filter_index import FilterIndex, current_filters, to_metadata_filters
+from context_packing import make_context_packer, CONTEXT_TOKEN_BUDGET
+from shards import ShardedIndex, ShardedTableStore, SHARD_SEARCH_THREADS
+
+BRANCH_TIMEOUT_S = float(os.getenv("BRANCH_TIMEOUT_S", "10"))
+RRF_K = 60.0  # Same constant as QueryFusionRetriever's reciprocal_rerank mode
+
+# Shared across engines and Streamlit sessions. Sized with headroom because a
+# timed-out branch keeps its thread until the underlying call returns.
+_branch_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="retrieval-branch")
+# Per-shard searches; a separate pool, since branch threads block waiting on them
+_shard_pool = ThreadPoolExecutor(max_workers=SHARD_SEARCH_THREADS, thread_name_prefix="shard-search")
+
+
+def reciprocal_rank_fusion(results, similarity_top_k):
+    """Fuse ranked lists by summing 1 / (rank + k) per node"""
+    fused_scores = {}
+    hash_to_node = {}
+    for nodes_with_scores in results:
+        ranked = sorted(nodes_with_scores, key=lambda x: x.score or 0.0, reverse=True)
+        for rank, node_with_score in enumerate(ranked):
+            node_hash = node_with_score.node.hash
+            hash_to_node[node_hash] = node_with_score
+            fused_scores[node_hash] = fused_scores.get(node_hash, 0.0) + 1.0 / (rank + RRF_K)
+
+    fused = []
+    for node_hash, score in sorted(fused_scores.items(), key=lambda x: x[1], reverse=True)[:similarity_top_k]:
+        node_with_score = hash_to_node[node_hash]
+        node_with_score.score = score
+        fused.append(node_with_score)
+    return fused
+
+
+class ParallelFusionRetriever(BaseRetriever):
+    """Hybrid retriever that runs its branches concurrently and fuses them with RRF.
+
+    Each branch (e.g. vector: network-bound query embedding; BM25: CPU-bound
+    scoring) runs on the shared pool with its own timeout. A branch that times
+    out or raises is dropped and the query continues on the remaining ones;
+    only if every branch fails does retrieval fail. Per-branch timings of the
+    last query on the calling thread are available as `last_timings`.
+
+    A ShardedRetriever branch with merge="rank" contributes one ranked list
+    per shard to the fusion instead of a single merged list.
+    """
+
+    def __init__(self, retrievers, similarity_top_k=5, branch_timeout=BRANCH_TIMEOUT_S, **kwargs):
+        # retrievers: {"vector": VectorIndexRetriever, "bm25": ..., ...}
+        # branch_timeout: seconds for every branch, or {"vector": 10, "bm25": 2}
+        self._retrievers = dict(retrievers)
+        self._similarity_top_k = similarity_top_k
+        if isinstance(branch_timeout, dict):
+            self._timeouts = {name: branch_timeout.get(name, BRANCH_TIMEOUT_S) for name in self._retrievers}
+        else:
+            self._timeouts = {name: branch_timeout for name in self._retrievers}
+        self._local = threading.local()
+        super().__init__(**kwargs)
+
+    @property
+    def last_timings(self):
+        return getattr(self._local, "timings", {})
+
+    @staticmethod
+    def _run_branch(retriever, query_bundle):
+        """The branch's ranked lists for RRF, and the time taken"""
+        start_time = time.perf_counter()
+        if isinstance(retriever, ShardedRetriever) and retriever.merge == "rank":
+            lists = retriever.retrieve_per_shard(query_bundle)
+        else:
+            lists = [retriever.retrieve(query_bundle)]
+        return lists, time.perf_counter() - start_time
+
+    def _retrieve(self, query_bundle):
+        start_time = time.perf_counter()
+        # Each branch runs in a copy of the caller's context so it records into the active trace
+        futures = {
+            name: _branch_pool.submit(contextvars.copy_context().run, self._run_branch, retriever, query_bundle)
+            for name, retriever in self._retrievers.items()
+        }
+
+        timings = {}
+        results = []
+        errors = []
+        for name, future in futures.items():
+            # Deadlines run from the common start, so branches wait concurrently
+            remaining = self._timeouts[name] - (time.perf_counter() - start_time)
+            try:
+                lists, elapsed = future.result(timeout=max(remaining, 0))
+            except FutureTimeout:
+                timings[name] = {"status": "timeout", "ms": round(self._timeouts[name] * 1000, 1), "count": 0}
+                print(f"Retrieval branch '{name}' timed out after {self._timeouts[name]}s; continuing without it.")
+                continue
+            except Exception as e:
+                timings[name] = {"status": "error", "error": str(e), "count": 0}
+                errors.append(e)
+                print(f"Retrieval branch '{name}' failed: {e}; continuing without it.")
+                continue
+            timings[name] = {"status": "ok", "ms": round(elapsed * 1000, 1), "count": sum(len(n) for n in lists)}
+            results.extend(lists)
+
+        fusion_start = time.perf_counter()
+        fused = reciprocal_rank_fusion(results, self._similarity_top_k)
+        timings["fusion"] = {"ms": round((time.perf_counter() - fusion_start) * 1000, 2), "count": len(fused)}
+        timings["total_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+        self._local.timings = timings
+
+        if not results:
+            if errors:
+                raise errors[0]
+            raise TimeoutError("All retrieval branches timed out")
+        return fused
+
+
+class ShardedRetriever(BaseRetriever):
+    """Scatter-gather over the per-shard retrievers of one branch (vector or BM25).
+
+    Shards are searched concurrently on the shard pool. With merge="score"
+    their top-k lists are merged by score into one top-k: vector scores are
+    comparable across shards (one embedding model, embedded once per query
+    here). BM25 scores use each shard's own IDF and are not, so with
+    merge="rank" ParallelFusionRetriever fuses the per-shard lists with RRF
+    (`retrieve_per_shard()`), as does `retrieve()` on its own. A failing
+    shard is dropped unless every shard fails.
+    """
+
+    def __init__(self, retrievers, similarity_top_k=10, merge="score", **kwargs):
+        # retrievers: {shard name: retriever}
+        if merge not in ("score", "rank"):
+            raise ValueError(f"Unknown shard merge '{merge}'; use 'score' or 'rank'.")
+        self._retrievers = dict(retrievers)
+        self._similarity_top_k = similarity_top_k
+        self.merge = merge
+        super().__init__(**kwargs)
+
+    def _embed_once(self, query_bundle):
+        first = next(iter(self._retrievers.values()))
+        if isinstance(first, VectorIndexRetriever) and query_bundle.embedding is None and query_bundle.embedding_strs:
+            query_bundle = QueryBundle(query_bundle.query_str, custom_embedding_strs=query_bundle.custom_embedding_strs,
+                                       embedding=first._embed_model.get_agg_embedding_from_queries(
+                                           query_bundle.embedding_strs))
+        return query_bundle
+
+    def retrieve_per_shard(self, query_bundle):
+        """The top-k list of every shard that answered"""
+        query_bundle = self._embed_once(query_bundle)
+        # Each shard runs in a copy of the caller's context (trace, query filters)
+        futures = {
+            name: _shard_pool.submit(contextvars.copy_context().run, retriever.retrieve, query_bundle)
+            for name, retriever in self._retrievers.items()
+        }
+        lists = []
+        errors = []
+        for name, future in futures.items():
+            try:
+                lists.append(future.result())
+            except Exception as e:
+                errors.append(e)
+                print(f"Shard '{name}' failed: {e}; continuing without it.")
+        if errors and len(errors) == len(futures):
+            raise errors[0]
+        return lists
+
+    def _retrieve(self, query_bundle):
+        lists = self.retrieve_per_shard(query_bundle)
+        if self.merge == "rank":
+            return reciprocal_rank_fusion(lists, self._similarity_top_k)
+        merged = [node for nodes in lists for node in nodes]
+        merged.sort(key=lambda n: n.score or 0.0, reverse=True)
+        return merged[:self._similarity_top_k]
+
+
+def _branch(retrievers, similarity_top_k, merge="score"):
+    """The retriever itself for a single index, a ShardedRetriever over several shards"""
+    if list(retrievers) == [None]:
+        return retrievers[None]
+    return ShardedRetriever(retrievers, similarity_top_k=similarity_top_k, merge=merge)
+
+
+class FilteredVectorRetriever(VectorIndexRetriever):
+    """VectorIndexRetriever that passes the query's filter_index.query_filters() to the vector store"""
+
+    def _build_vector_store_query(self, query_bundle_with_embeddings):
+        query = super()._build_vector_store_query(query_bundle_with_embeddings)
+        filters = current_filters()
+        if filters is not None:
+            query.filters = to_metadata_filters(filters)
+        return query
+
+
+def load_filter_index(index, persist_dir):
+    """The FilterIndex of `persist_dir`, loaded once and shared through the index's vector store"""
+    filter_index = getattr(index.vector_store, "filter_index", None)
+    if filter_index is None:
+        filter_index = FilterIndex.load(persist_dir, index.docstore)
+        if hasattr(index.vector_store, "attach_filter_index"):
+            index.vector_store.attach_filter_index(filter_index)
+    return filter_index
+
+
+def timed_token_stream(token_gen, query_str, start_time):
+    """Pass tokens through unchanged, logging time-to-first-token and total time"""
+    first_token_at = None
+    for token in token_gen:
+        if first_token_at is None:
+            first_token_at = time.perf_counter()
+            print(f"TTFT {first_token_at - start_time:.2f}s for query: {query_str[:80]}")
+        yield token
+    print(f"Answer streamed in {time.perf_counter() - start_time:.2f}s total")
+
+
+def _stage_name(postprocessor):
+    name = postprocessor.class_name()
+    if "rerank" in name.lower():
+        return "rerank"
+    return "pack" if name == "ContextPacker" else name
+
+
+class HybridQueryEngine(RetrieverQueryEngine):
+    """RetrieverQueryEngine that records retrieval timings in `response.metadata`.
+
+    `synthesize_stream()` generates from already-retrieved nodes with a
+    streaming synthesizer, so callers can show sources before the first token.
+    Inside a tracing.QueryTrace, retrieval branches, postprocessors and
+    synthesis are recorded as stages.
+
+    With a `table_store`, direct numeric lookups are answered from the parsed
+    tables (`lookup_table()`) before any retrieval; everything else is RAG.
+
+    Inside filter_index.query_filters(), retrieval and table lookups only
+    consider nodes from the selected files, pages and years.
+
+    With a ContextPacker postprocessor, the context token counts before and
+    after packing are returned in `response.metadata["context"]`.
+    """
+
+    _streaming_synthesizer = None
+    table_store = None
+    docstore = None
+    filter_index = None
+    mode = "full"  # "degraded": vector-only, no rerank (served during warm-up)
+
+    @classmethod
+    def from_args(cls, retriever, llm=None, response_mode="compact", **kwargs):
+        engine = super().from_args(retriever=retriever, llm=llm, response_mode=response_mode, **kwargs)
+        engine._streaming_synthesizer = get_response_synthesizer(
+            llm=llm,
+            response_mode=response_mode,
+            streaming=True
+        )
+        return engine
+
+    def synthesize_stream(self, query_bundle, nodes):
+        """Return a StreamingResponse whose `response_gen` yields answer tokens"""
+        return self._streaming_synthesizer.synthesize(query=query_bundle, nodes=nodes)
+
+    def lookup_table(self, query_str):
+        """Response built from the table store for a direct numeric lookup, or None to fall back to RAG"""
+        if self.table_store is None:
+            return None
+        filters = current_filters()
+        keep = None
+        if filters is not None and self.filter_index is not None:
+            keep = lambda file_name, page_label: self.filter_index.accepts(file_name, page_label, filters)
+        with stage("table_lookup"):
+            hit = self.table_store.lookup(query_str, keep=keep)
+        trace = current_trace()
+        if trace is not None:
+            trace.set_cache("table", "hit" if hit else "miss")
+            if filters is not None:
+                trace.set("filters", filters)
+        if hit is None:
+            return None
+
+        # Cite the chunk each table came from, so sources render like a RAG answer
+        source_nodes = []
+        for match in hit["matches"]:
+            node = self.docstore.get_node(match["node_id"], raise_error=False) if self.docstore is not None else None
+            if node is None:
+                node = TextNode(text=match["label"], id_=match["node_id"],
+                                metadata={"file_name": match["file_name"], "page_label": match["page_label"]})
+            source_nodes.append(NodeWithScore(node=node, score=1.0))
+        return Response(response=hit["answer"], source_nodes=source_nodes,
+                        metadata={"table_lookup": {"ms": hit["ms"], "matches": len(hit["matches"])}})
+
+    def retrieve(self, query_bundle):
+        nodes = self._retriever.retrieve(query_bundle)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_retrieval_timings(getattr(self._retriever, "last_timings", {}))
+            if current_filters() is not None:
+                trace.set("filters", current_filters())
+        return self._apply_node_postprocessors(nodes, query_bundle=query_bundle)
+
+    def _apply_node_postprocessors(self, nodes, query_bundle, pack=True):
+        for node_postprocessor in self._node_postprocessors:
+            name = _stage_name(node_postprocessor)
+            if name == "pack" and not pack:
+                continue
+            with stage(name):
+                nodes = node_postprocessor.postprocess_nodes(nodes, query_bundle=query_bundle)
+            trace = current_trace()
+            if trace is not None:
+                trace.set_count(name, len(nodes))
+        return nodes
+
+    def _query(self, query_bundle):
+        response = self.lookup_table(query_bundle.query_str)
+        if response is not None:
+            return response
+        nodes = self.retrieve(query_bundle)
+        with stage("synthesize"):
+            response = self._response_synthesizer.synthesize(query=query_bundle, nodes=nodes)
+        timings = getattr(self.retriever, "last_timings", None)
+        if timings:
+            response.metadata = {**(response.metadata or {}), "retrieval_timings": timings}
+        trace = current_trace()
+        if trace is not None and "context" in trace.record:
+            response.metadata = {**(response.metadata or {}), "context": trace.record["context"]}
+        return response
+
+
+def build_query_engine(index, persist_dir, reranker=None, bm25_index=None, rerank=True, degraded=False,
+                       context_budget=CONTEXT_TOKEN_BUDGET):
+    """The hybrid (vector + BM25) + rerank engine served by app.py.
+
+    `reranker` and `bm25_index` may be passed already loaded (see warmup.py).
+    `degraded=True` builds the vector-only engine without rerank that serves
+    queries while those are still loading. The retrieved chunks are packed
+    into `context_budget` tokens before synthesis (0 sends them whole).
+
+    With a shards.ShardedIndex, every shard gets its own vector and BM25
+    retrievers (and `bm25_index` is a dict by shard name); each branch
+    searches all shards concurrently before fusion.
+    """
+    # Last postprocessor in both modes: trims what the LLM reads, not what is retrieved
+    packer = make_context_packer(context_budget)
+    vector_top_k = 5 if degraded else 10  # Increased for fusion
+
+    if isinstance(index, ShardedIndex):
+        shards = index.shards
+        bm25_indexes = bm25_index or {}
+    else:
+        shards = {None: (persist_dir, index)}
+        bm25_indexes = {None: bm25_index}
+
+    vector_retrievers = {}
+    bm25_retrievers = {}
+    filter_indexes = {}
+    for name, (shard_dir, shard_index) in shards.items():
+        # Per-row file/page/year columns, so filtered queries score only the matching rows
+        filter_indexes[name] = load_filter_index(shard_index, shard_dir)
+
+        # V2.0: CREATE HYBRID RETRIEVAL
+        # 1. Vector Retriever
+        vector_retrievers[name] = FilteredVectorRetriever(index=shard_index, similarity_top_k=vector_top_k)
+        if degraded:
+            continue
+
+        # 2. BM25 Retriever (Keyword Search), persisted by ingest.py and loaded on first query
+        if bm25_indexes.get(name) is not None or BM25Index.exists(shard_dir):
+            bm25_retrievers[name] = PersistedBM25Retriever(
+                persist_dir=shard_dir,
+                docstore=shard_index.docstore,
+                similarity_top_k=10,
+                index=bm25_indexes.get(name),
+                filter_index=filter_indexes[name]
+            )
+        else:
+            # Older stores: rebuild from the docstore until ingest.py is re-run (query filters are not applied)
+            bm25_retrievers[name] = BM25Retriever.from_defaults(
+                nodes=list(shard_index.docstore.docs.values()),
+                similarity_top_k=10
+            )
+    vector_retriever = _branch(vector_retrievers, vector_top_k)
+    if None in filter_indexes:
+        filter_index = filter_indexes[None]
+    else:
+        # Table-store answers of every shard are checked against all shards' file years
+        filter_index = FilterIndex.merged(persist_dir, filter_indexes.values())
+
+    if degraded:
+        engine = HybridQueryEngine.from_args(
+            retriever=ParallelFusionRetriever(retrievers={"vector": vector_retriever}, similarity_top_k=5),
+            node_postprocessors=[packer] if packer is not None else [],
+            response_mode="compact"
+        )
+        engine.mode = "degraded"
+        engine.filter_index = filter_index
+        attach_table_store(engine, index, persist_dir)
+        return engine
+
+    # 3. Reciprocal Rank Fusion (RRF), with both branches running concurrently
+    fusion_retriever = ParallelFusionRetriever(
+        # BM25 scores are per-shard (own IDF): each shard's ranking is fused on its own
+        retrievers={"vector": vector_retriever, "bm25": _branch(bm25_retrievers, 10, merge="rank")},
+        similarity_top_k=5
+    )
+
+    # 4. Reranker (Cross-Encoder), on the backend chosen by RERANK_BACKEND
+    if rerank and reranker is None:
+        reranker = make_reranker(top_n=5)
+
+    # 5. Create Query Engine with Hybrid Search + Reranking + context packing
+    engine = HybridQueryEngine.from_args(
+        retriever=fusion_retriever,
+        node_postprocessors=[p for p in (reranker, packer) if p is not None],
+        response_mode="compact"
+    )
+    engine.mode = "full"
+    engine.filter_index = filter_index
+
+    # 6. Numeric lookups straight from the parsed tables, built by ingest.py
+    attach_table_store(engine, index, persist_dir)
+    return engine
+
+
+def attach_table_store(engine, index, persist_dir):
+    """Serve direct numeric lookups from storage/tables.sqlite (of every shard), if ingest.py built it"""
+    if not TABLE_LOOKUP_ENABLED:
+        return
+    if isinstance(index, ShardedIndex):
+        stores = {name: TableStore.open(shard_dir) for name, (shard_dir, _) in index.shards.items()
+                  if TableStore.exists(shard_dir)}
+        if stores:
+            engine.table_store = ShardedTableStore(stores)
+            engine.docstore = index.docstore
+    elif TableStore.exists(persist_dir):
+        engine.table_store = TableStore.open(persist_dir)
+        engine.docstore = index.docstore
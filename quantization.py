@@ -0,0 +1,253 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+
+QUANT_FILE = "vectors_quant.npz"
+QUANT_META_FILE = "vectors_quant_meta.json"
+# Compressed codes built next to vectors.npy at ingestion: "none", "int8" or "pq"
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+# Approximate top k * QUANT_RESCORE_FACTOR rows are re-scored exactly from the full-precision vectors on disk
+QUANT_RESCORE_FACTOR = int(os.getenv("QUANT_RESCORE_FACTOR", "10"))
+# Product quantization: one byte per sub-vector, 256 centroids per sub-space
+PQ_SUBVECTORS = int(os.getenv("PQ_SUBVECTORS", "96"))
+PQ_CENTROIDS = 256
+PQ_TRAIN_SAMPLE = int(os.getenv("PQ_TRAIN_SAMPLE", "10000"))
+
+# Rows encoded per block; bounds the float32 temporaries
+QUANT_BLOCK_ROWS = 8192
+
+
+def _nearest(points, centroids):
+    """Index of the nearest centroid (Euclidean) for every point"""
+    return np.argmax(points @ centroids.T - 0.5 * np.einsum("kd,kd->k", centroids, centroids), axis=1)
+
+
+def kmeans(points, n_clusters, n_iter=10, seed=0):
+    """Euclidean k-means (Lloyd) for the low-dimensional sub-spaces of product quantization"""
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(len(points), size=n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = _nearest(points, centroids)
+        counts = np.bincount(labels, minlength=n_clusters)
+        # Per-cluster sums via one sort + reduceat, as in ann_index.spherical_kmeans()
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        nonempty = counts > 0
+        centroids[nonempty] = np.add.reduceat(points[order], starts[nonempty], axis=0) / counts[nonempty, None]
+        empty = ~nonempty
+        if empty.any():
+            centroids[empty] = points[rng.choice(len(points), size=int(empty.sum()))]
+    return centroids
+
+
+class Quantizer:
+    """Compressed codes for the rows of a vector matrix.
+
+    A query is scored approximately against the codes (held in memory),
+    then the best k * rescore_factor rows are read back from the
+    full-precision matrix (memory-mapped on disk) and scored exactly, so the
+    returned scores are the same cosine similarities as an exact scan.
+    """
+
+    kind = None
+    # Rows scored per block
+    block_rows = QUANT_BLOCK_ROWS
+
+    def __init__(self, arrays, generation=None):
+        self.arrays = arrays
+        self.generation = generation
+
+    @property
+    def count(self):
+        return len(self.arrays["codes"])
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def _prepare(self, query):
+        return query
+
+    def _score_block(self, prepared, index):
+        raise NotImplementedError
+
+    def scores(self, query, rows=None):
+        """Approximate scores of every row (or of `rows`)"""
+        prepared = self._prepare(query)
+        n = self.count if rows is None else len(rows)
+        parts = [self._score_block(prepared, slice(start, start + self.block_rows) if rows is None
+                                   else rows[start:start + self.block_rows])
+                 for start in range(0, n, self.block_rows)]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.float32)
+
+    def search(self, vectors, query, k, rows=None, rescore_factor=QUANT_RESCORE_FACTOR):
+        """Top-k (rows, scores) among `rows` (sorted; None = all); rescore_factor=0 skips rescoring"""
+        approx = self.scores(query, rows)
+        if rows is None:
+            rows = np.arange(self.count)
+        if not len(rows):
+            return rows, np.zeros(0, dtype=np.float32)
+
+        shortlist = min(len(rows), k * rescore_factor if rescore_factor > 0 else k)
+        top = np.argpartition(-approx, shortlist - 1)[:shortlist]
+        if rescore_factor > 0:
+            candidates = np.sort(rows[top])
+            scores = np.asarray(vectors[candidates], dtype=np.float32) @ query
+        else:
+            candidates, scores = rows[top], approx[top]
+        k = min(k, len(candidates))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return candidates[best], scores[best]
+
+    def save(self, persist_dir):
+        tmp_path = os.path.join(persist_dir, QUANT_FILE + ".tmp.npz")
+        np.savez(tmp_path, **self.arrays)
+        os.replace(tmp_path, os.path.join(persist_dir, QUANT_FILE))
+        with open(os.path.join(persist_dir, QUANT_META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"kind": self.kind, "generation": self.generation, "count": self.count,
+                       "bytes": int(self.nbytes)}, f)
+
+    @staticmethod
+    def load(persist_dir):
+        if not os.path.exists(os.path.join(persist_dir, QUANT_META_FILE)):
+            return None
+        with open(os.path.join(persist_dir, QUANT_META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with np.load(os.path.join(persist_dir, QUANT_FILE)) as data:
+            arrays = {name: data[name] for name in data.files}
+        return QUANTIZERS[meta["kind"]](arrays, generation=meta["generation"])
+
+
+class Int8Quantizer(Quantizer):
+    """Scalar quantization: int8 codes with one float32 scale per vector (about 4x smaller than float32).
+
+    Row x is stored as round(x / s) with s = max|x| / 127, and scored as
+    s * (codes @ query). NumPy has no fast int8 matmul, so each block is
+    decoded into a reused float32 buffer small enough to stay in cache: the
+    scan costs about as much as an exact float32 scan, and the saving is
+    memory (see benchmarks/quantization.py).
+    """
+
+    kind = "int8"
+    # 256 x 768 float32 is 768 KB: the decoded block stays in L2 for the matmul
+    block_rows = 256
+
+    def __init__(self, arrays, generation=None):
+        super().__init__(arrays, generation=generation)
+        self._local = threading.local()  # one decode buffer per searching thread
+
+    @classmethod
+    def build(cls, vectors, generation=None):
+        n, dim = vectors.shape
+        codes = np.empty((n, dim), dtype=np.int8)
+        scales = np.empty(n, dtype=np.float32)
+        for start in range(0, n, QUANT_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + QUANT_BLOCK_ROWS], dtype=np.float32)
+            scale = np.abs(block).max(axis=1) / 127
+            scale[scale == 0] = 1.0
+            codes[start:start + len(block)] = np.rint(block / scale[:, None])
+            scales[start:start + len(block)] = scale
+        return cls({"codes": codes, "scales": scales}, generation=generation)
+
+    def _decode_buffer(self):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = np.empty((self.block_rows, self.arrays["codes"].shape[1]), dtype=np.float32)
+        return buffer
+
+    def _score_block(self, query, index):
+        codes = self.arrays["codes"][index]
+        decoded = self._decode_buffer()[:len(codes)]
+        np.copyto(decoded, codes)
+        return (decoded @ query) * self.arrays["scales"][index]
+
+
+class ProductQuantizer(Quantizer):
+    """Product quantization: each vector split into m sub-vectors, each stored as one byte.
+
+    Every sub-space has its own k-means codebook of 256 centroids, trained on
+    a sample of rows. A query precomputes its inner product with every
+    centroid (an m x 256 table), so scoring a row is m table lookups. Codes
+    are stored sub-space major (m x n), so each lookup pass is one
+    contiguous gather.
+    """
+
+    kind = "pq"
+    block_rows = 65536
+
+    @classmethod
+    def build(cls, vectors, generation=None, n_subvectors=PQ_SUBVECTORS, n_centroids=PQ_CENTROIDS,
+              sample_size=PQ_TRAIN_SAMPLE, n_iter=10, seed=0):
+        n, dim = vectors.shape
+        # The largest sub-vector count that divides the dimension
+        m = max(d for d in range(1, min(n_subvectors, dim) + 1) if dim % d == 0)
+        n_centroids = min(n_centroids, n)
+        rng = np.random.default_rng(seed)
+        sample_rows = np.sort(rng.choice(n, size=min(n, max(sample_size, n_centroids)), replace=False))
+        sample = np.asarray(vectors[sample_rows], dtype=np.float32).reshape(len(sample_rows), m, dim // m)
+        codebooks = np.stack([kmeans(np.ascontiguousarray(sample[:, j]), n_centroids, n_iter=n_iter, seed=seed + j)
+                              for j in range(m)])
+
+        codes = np.empty((m, n), dtype=np.uint8)
+        for start in range(0, n, QUANT_BLOCK_ROWS):
+            block = np.asarray(vectors[start:start + QUANT_BLOCK_ROWS], dtype=np.float32).reshape(-1, m, dim // m)
+            for j in range(m):
+                codes[j, start:start + len(block)] = _nearest(block[:, j], codebooks[j])
+        return cls({"codes": codes, "codebooks": codebooks.astype(np.float32)}, generation=generation)
+
+    @property
+    def count(self):
+        return self.arrays["codes"].shape[1]
+
+    def _prepare(self, query):
+        codebooks = self.arrays["codebooks"]
+        m, _, dsub = codebooks.shape
+        return np.einsum("mkd,md->mk", codebooks, query.reshape(m, dsub))
+
+    def _score_block(self, table, index):
+        codes = self.arrays["codes"][:, index]
+        scores = np.zeros(codes.shape[1], dtype=np.float32)
+        for j in range(len(table)):
+            scores += table[j].take(codes[j])
+        return scores
+
+
+QUANTIZERS = {"int8": Int8Quantizer, "pq": ProductQuantizer}
+
+
+def _remove_quantized(persist_dir):
+    for name in (QUANT_FILE, QUANT_META_FILE):
+        if os.path.exists(os.path.join(persist_dir, name)):
+            os.remove(os.path.join(persist_dir, name))
+
+
+def build_quantized_vectors(persist_dir, kind=VECTOR_QUANTIZATION):
+    """Train and persist compressed codes for the memory-mapped vectors in `persist_dir` ("none" removes them)"""
+    from mmap_vector_store import MmapVectorStore
+
+    if kind == "none":
+        _remove_quantized(persist_dir)
+        return None
+    if kind not in QUANTIZERS:
+        raise ValueError(f"Unknown quantization '{kind}'; use 'none', 'int8' or 'pq'.")
+    if not MmapVectorStore.exists(persist_dir):
+        print("Quantization skipped: the store does not use the memory-mapped vector format.")
+        return None
+
+    store = MmapVectorStore.from_persist_dir(persist_dir, use_ann=False, use_quantized=False)
+    count = store.persisted_count
+    if not count:
+        _remove_quantized(persist_dir)
+        return None
+
+    start_time = time.time()
+    quantizer = QUANTIZERS[kind].build(store._vectors, generation=store.generation)
+    quantizer.save(persist_dir)
+    full_bytes = count * store._vectors.shape[1] * 4
+    print(f"Built {kind} codes for {count} vectors in {time.time() - start_time:.2f}s: "
+          f"{quantizer.nbytes / 1e6:.1f} MB in memory instead of {full_bytes / 1e6:.1f} MB of float32 "
+          f"({full_bytes / quantizer.nbytes:.1f}x smaller)")
+    return quantizer
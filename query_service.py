@@ -0,0 +1,585 @@
+import os
+import json
+import time
+import queue
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import request as urllib_request, error as urllib_error
+
+# One process owns the index, BM25 arrays, reranker and answer cache and serves
+# them over local HTTP; app.py, evaluate.py and inspect_doc.py become thin
+# clients when QUERY_SERVICE_URL is set. Only the standard library is imported
+# at module level, so clients never load llama_index or the models.
+#   python query_service.py                          # http://127.0.0.1:8765
+#   python query_service.py --fake-llm --fake-embed  # offline, for testing on one machine
+#   QUERY_SERVICE_URL=http://127.0.0.1:8765 streamlit run app.py
+
+QUERY_SERVICE_URL = os.getenv("QUERY_SERVICE_URL", "")
+QUERY_SERVICE_HOST = os.getenv("QUERY_SERVICE_HOST", "127.0.0.1")
+QUERY_SERVICE_PORT = int(os.getenv("QUERY_SERVICE_PORT", "8765"))
+QUERY_SERVICE_WORKERS = int(os.getenv("QUERY_SERVICE_WORKERS", "4"))
+QUERY_SERVICE_QUEUE_SIZE = int(os.getenv("QUERY_SERVICE_QUEUE_SIZE", "64"))
+QUERY_SERVICE_TIMEOUT_S = float(os.getenv("QUERY_SERVICE_TIMEOUT_S", "300"))
+# Longest /answer waits for the next event (queueing included) before the stream is ended with an error
+QUERY_SERVICE_STREAM_IDLE_S = float(os.getenv("QUERY_SERVICE_STREAM_IDLE_S", "120"))
+
+STORAGE_DIR = "./storage"
+SYSTEM_PROMPT = "You are an expert Financial Analyst with deep knowledge in corporate finance, accounting, and investment analysis. Your goal is to provide accurate, insightful answers based ONLY on the provided context. You MUST cite your sources including page numbers for every claim you make. If you are unsure, state that you don't know."
+
+
+class ServiceBusy(RuntimeError):
+    """Every worker is busy and the request queue is full (HTTP 503)"""
+
+
+class BadRequest(ValueError):
+    """Malformed request body (HTTP 400)"""
+
+
+class QueryServiceError(RuntimeError):
+    """Error response from the query service, raised by the client"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def node_to_dict(node_with_score):
+    return {
+        "node_id": node_with_score.node.node_id,
+        "text": node_with_score.node.get_content(),
+        "metadata": dict(node_with_score.node.metadata),
+        "score": node_with_score.score,
+    }
+
+
+def cited_pages(source_nodes):
+    """Sorted, de-duplicated page labels of serialized source nodes (as app.py shows them)"""
+    pages = {str(n["metadata"].get("page_label", "Unknown")) for n in source_nodes}
+    return ", ".join(sorted(pages, key=lambda x: int(x) if x.isdigit() else float("inf")))
+
+
+def request_filters(body):
+    """Normalized `filters` of a request body (see filter_index.py), or None"""
+    from filter_index import normalize_filters
+    filters = body.get("filters")
+    if filters is not None and not isinstance(filters, dict):
+        raise BadRequest("'filters' must be an object")
+    try:
+        return normalize_filters(filters)
+    except (TypeError, ValueError) as e:
+        raise BadRequest(f"Invalid filters: {e}") from None
+
+
+def configure_models(fake_llm=False, fake_embed=False, llm_delay=0.0, embed_delay=0.0, embed_dim=None):
+    """Global Settings (ensure they match app.py), or offline fakes for testing on one machine"""
+    from llama_index.core.settings import Settings
+    from tracing import install_tracing
+    from micro_batch import batched_query_embedding
+
+    if fake_llm:
+        from fakes import FakeLLM
+        Settings.llm = FakeLLM(delay=llm_delay)
+    else:
+        from llama_index.llms.google_genai import GoogleGenAI
+        Settings.llm = GoogleGenAI(model="gemini-3-flash-preview", system_prompt=SYSTEM_PROMPT)
+    if fake_embed:
+        from fakes import FakeEmbedding
+        # The query vector must match the dimension of the stored chunk vectors
+        Settings.embed_model = FakeEmbedding(embed_dim=embed_dim or 256, delay=embed_delay)
+    else:
+        from llama_index.embeddings.google_genai import GoogleGenAIEmbedding
+        Settings.embed_model = GoogleGenAIEmbedding(model_name="models/text-embedding-004")
+    # With MICRO_BATCH=1, concurrent requests' query embeddings share one call (micro_batch.py)
+    Settings.embed_model = batched_query_embedding(Settings.embed_model)
+    install_tracing()
+
+
+class QueryService:
+    """Owns one warm query engine and answers requests on a bounded worker pool.
+
+    At most `workers` requests run at once and up to `queue_size` more wait in
+    order; beyond that `submit()` raises ServiceBusy instead of queueing without
+    bound. Components load in the background (warmup.EngineWarmup), so early
+    requests are served by the degraded engine. Every request is traced with
+    the client's `source` and its time spent waiting in the queue.
+    """
+
+    def __init__(self, persist_dir=STORAGE_DIR, configure_models=configure_models,
+                 workers=QUERY_SERVICE_WORKERS, queue_size=QUERY_SERVICE_QUEUE_SIZE):
+        from warmup import EngineWarmup
+        from answer_cache import AnswerCache
+
+        self.persist_dir = persist_dir
+        self.workers = workers
+        self.queue_size = queue_size
+        self.warmup = EngineWarmup(persist_dir, configure_models)
+        # Shared by every client process, unlike the per-process cache in app.py
+        self.answer_cache = AnswerCache()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-worker")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._simple_engine = None
+        self.stats = {"requests": 0, "rejected": 0, "errors": 0, "queued": 0, "in_flight": 0}
+
+    def start(self):
+        self.warmup.start()
+        return self
+
+    def submit(self, fn, *args):
+        """Queue `fn(queue_ms, *args)` on the worker pool; returns its Future"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["rejected"] += 1
+            raise ServiceBusy(f"{self.workers} workers busy and {self.queue_size} requests queued")
+        queued_at = time.perf_counter()
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["queued"] += 1
+
+        def run():
+            with self._lock:
+                self.stats["queued"] -= 1
+                self.stats["in_flight"] += 1
+            try:
+                return fn((time.perf_counter() - queued_at) * 1000, *args)
+            except Exception:
+                with self._lock:
+                    self.stats["errors"] += 1
+                raise
+            finally:
+                with self._lock:
+                    self.stats["in_flight"] -= 1
+                self._slots.release()
+
+        return self._pool.submit(run)
+
+    def _engine(self, name="app"):
+        # "app": hybrid + rerank (degraded until warm); "simple": plain vector top-k
+        if name == "simple":
+            index = self.warmup.wait_for("index")
+            with self._lock:
+                if self._simple_engine is None:
+                    self._simple_engine = index.as_query_engine()
+            return self._simple_engine
+        return self.warmup.engine()
+
+    @staticmethod
+    def _trace(query, body, queue_ms):
+        from tracing import QueryTrace
+        trace = QueryTrace(query, source=body.get("source", "service"))
+        trace.add_stage("queue", queue_ms)
+        return trace
+
+    def health(self):
+        from index_loader import read_index_version
+        from micro_batch import batching_stats
+        with self._lock:
+            stats = dict(self.stats)
+        # "degraded": warm-up settled with a failed stage, so queries keep the degraded engine
+        if self.warmup.ready:
+            status = "ready"
+        elif self.warmup.settled:
+            status = "degraded"
+        else:
+            status = "warming"
+        return {
+            "status": status,
+            "warmup": self.warmup.status(),
+            "index_version": read_index_version(self.persist_dir),
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "stats": stats,
+            "answer_cache": dict(self.answer_cache.stats),
+            "micro_batch": batching_stats(),
+        }
+
+    def retrieve(self, queue_ms, body):
+        """Hybrid retrieval, reranked and packed into the context budget unless `rerank` is false"""
+        from llama_index.core import QueryBundle
+        from filter_index import query_filters
+        query = _require(body, "query")
+        filters = request_filters(body)
+        engine = self._engine()
+        with self._trace(query, body, queue_ms), query_filters(filters):
+            if body.get("rerank", True):
+                nodes = engine.retrieve(QueryBundle(query))
+            else:
+                nodes = engine.retriever.retrieve(QueryBundle(query))
+        return {"source_nodes": [node_to_dict(n) for n in nodes], "timings": engine.retriever.last_timings,
+                "mode": engine.mode}
+
+    def rerank(self, queue_ms, body):
+        """Rerank docstore nodes (`node_ids`) for `query` with the engine's reranker (whole, not packed)"""
+        from llama_index.core import QueryBundle
+        from llama_index.core.schema import NodeWithScore
+        query = _require(body, "query")
+        node_ids = _require(body, "node_ids")
+        engine = self._engine()
+        nodes = self.warmup.wait_for("index").docstore.get_nodes(node_ids, raise_error=False)
+        with self._trace(query, body, queue_ms):
+            nodes = engine._apply_node_postprocessors(
+                [NodeWithScore(node=n) for n in nodes if n is not None], query_bundle=QueryBundle(query), pack=False
+            )
+        return {"source_nodes": [node_to_dict(n) for n in nodes], "mode": engine.mode}
+
+    def query(self, queue_ms, body):
+        """Complete answer (table lookup or RAG), as evaluate.py and inspect_doc.py use it"""
+        from filter_index import query_filters
+        query = _require(body, "query")
+        filters = request_filters(body)
+        engine = self._engine(body.get("engine", "app"))
+        mode = getattr(engine, "mode", "simple")
+        with self._trace(query, body, queue_ms) as trace, query_filters(filters):
+            trace.set("mode", mode)
+            response = engine.query(query)
+        return {
+            "answer": response.response or "",
+            "source_nodes": [node_to_dict(n) for n in response.source_nodes],
+            "metadata": {**(response.metadata or {}), "mode": mode},
+        }
+
+    def answer_stream(self, queue_ms, body, emit, cancelled=None):
+        """The chat flow of app.py: answer cache, table lookup, then retrieve + streamed synthesis.
+
+        Emits a "sources" event before generation, "token" events while it
+        streams and a final "done" event with the whole answer. Once the
+        `cancelled` Event is set (the client went away), it stops without
+        finishing or caching the answer, freeing its worker.
+        """
+        from llama_index.core import QueryBundle
+        from llama_index.core.settings import Settings
+        from index_loader import read_index_version
+        from pipeline import timed_token_stream
+        from filter_index import query_filters, scoped_version
+
+        query = _require(body, "query")
+        filters = request_filters(body)
+        if cancelled is not None and cancelled.is_set():
+            return  # abandoned while queued
+        start_time = time.perf_counter()
+        engine = self._engine()
+        # Answers given under filters are cached apart from unfiltered ones
+        index_version = scoped_version(read_index_version(self.persist_dir), filters)
+        with self._trace(query, body, queue_ms) as trace, query_filters(filters):
+            trace.set("mode", engine.mode)
+            # Exact repeat first (free), then a direct table lookup (no embedding call),
+            # and only then embed once for the semantic layer and retrieval
+            cached = self.answer_cache.get_exact(query, index_version)
+            query_embedding = None
+            table_response = None
+            if cached is None:
+                table_response = engine.lookup_table(query)
+                if table_response is None:
+                    query_embedding = Settings.embed_model.get_query_embedding(query)
+                    cached = self.answer_cache.get_semantic(query_embedding, index_version)
+            trace.set_cache("answer", cached["layer"] if cached is not None else "miss")
+
+            if cached is not None:
+                emit({"event": "sources", "source_nodes": cached["source_nodes"], "mode": engine.mode,
+                      "cached": {"layer": cached["layer"], "similarity": cached["similarity"]}})
+                answer = cached["answer"]
+                emit({"event": "token", "text": answer})
+            elif table_response is not None:
+                # Direct numeric lookup: read the cell from the table store, no retrieval or LLM call
+                source_nodes = [node_to_dict(n) for n in table_response.source_nodes]
+                emit({"event": "sources", "source_nodes": source_nodes, "mode": engine.mode,
+                      "table_lookup": table_response.metadata["table_lookup"]})
+                answer = table_response.response
+                emit({"event": "token", "text": answer})
+                # Not embedded: only exact repeats are served from the cache
+                self.answer_cache.put(query, index_version, answer, cited_pages(source_nodes), source_nodes)
+            else:
+                query_bundle = QueryBundle(query, embedding=query_embedding)
+                nodes = engine.retrieve(query_bundle)
+                source_nodes = [node_to_dict(n) for n in nodes]
+                emit({"event": "sources", "source_nodes": source_nodes, "mode": engine.mode,
+                      "timings": engine.retriever.last_timings})
+                tokens = []
+                with trace.stage("synthesize"):
+                    streaming_response = engine.synthesize_stream(query_bundle, nodes)
+                    for token in timed_token_stream(streaming_response.response_gen, query, start_time):
+                        if cancelled is not None and cancelled.is_set():
+                            print(f"Client disconnected; stopped generating for query: {query[:80]}")
+                            trace.set("cancelled", True)
+                            return
+                        tokens.append(token)
+                        emit({"event": "token", "text": token})
+                answer = "".join(tokens)
+                self.answer_cache.put(query, index_version, answer, cited_pages(source_nodes), source_nodes,
+                                      query_embedding=query_embedding)
+        emit({"event": "done", "answer": answer})
+
+    def briefing(self, queue_ms, body):
+        """The Executive Briefing for the current index version, generated at most once"""
+        from index_loader import read_index_version
+        from briefing import load_briefing, get_briefing
+        index_version = read_index_version(self.persist_dir)
+        regenerate = bool(body.get("regenerate"))
+        artifact = None if regenerate else load_briefing(self.persist_dir, index_version)
+        if artifact is None:
+            index = self.warmup.wait_for("index")
+            artifact = get_briefing(index, self.persist_dir, index_version, regenerate=regenerate)
+        return {**artifact, "index_version": index_version}
+
+
+def _require(body, field):
+    if field not in body:
+        raise BadRequest(f"Missing field '{field}'")
+    return body[field]
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    """JSON over HTTP; POST /answer streams newline-delimited JSON events"""
+
+    service = None  # set by make_server()
+    stream_idle_s = QUERY_SERVICE_STREAM_IDLE_S
+    routes = {"/retrieve": "retrieve", "/rerank": "rerank", "/query": "query", "/briefing": "briefing"}
+
+    def log_message(self, format, *args):
+        pass  # one line per request would drown the engine's own logging
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, e):
+        if isinstance(e, ServiceBusy):
+            self._send_json(503, {"error": str(e)}, headers={"Retry-After": "1"})
+        elif isinstance(e, BadRequest):
+            self._send_json(400, {"error": str(e)})
+        else:
+            print(f"Query service error on {self.path}: {type(e).__name__}: {e}")
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, self.service.health())
+        else:
+            self._send_json(404, {"error": f"Unknown path '{self.path}'"})
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(body, dict):
+                raise BadRequest("Request body must be a JSON object")
+        except ValueError as e:
+            self._send_error(e if isinstance(e, BadRequest) else BadRequest(f"Invalid JSON: {e}"))
+            return
+        if self.path == "/answer":
+            self._stream_answer(body)
+            return
+        if self.path not in self.routes:
+            self._send_json(404, {"error": f"Unknown path '{self.path}'"})
+            return
+        try:
+            future = self.service.submit(getattr(self.service, self.routes[self.path]), body)
+            self._send_json(200, future.result(timeout=QUERY_SERVICE_TIMEOUT_S))
+        except Exception as e:
+            self._send_error(e)
+
+    def _stream_answer(self, body):
+        events = queue.Queue()
+        cancelled = threading.Event()
+        try:
+            # Malformed bodies get a 400 here, before the 200 of the stream is sent
+            _require(body, "query")
+            request_filters(body)
+            future = self.service.submit(self.service.answer_stream, body, events.put, cancelled)
+        except (BadRequest, ServiceBusy) as e:
+            self._send_error(e)
+            return
+        # The worker signals the end (or its error) once answer_stream returns
+        future.add_done_callback(
+            lambda f: events.put({"event": "error", "error": f"{type(f.exception()).__name__}: {f.exception()}"}
+                                 if f.exception() is not None else None)
+        )
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.end_headers()
+            while True:
+                try:
+                    event = events.get(timeout=self.stream_idle_s)
+                except queue.Empty:
+                    # A stuck worker must not pin this thread; stop it if it ever resumes
+                    cancelled.set()
+                    event = {"event": "error", "error": f"TimeoutError: no answer event in {self.stream_idle_s:g}s"}
+                if event is None:
+                    break
+                self.wfile.write(json.dumps(event, default=str).encode("utf-8") + b"\n")
+                self.wfile.flush()
+                if event["event"] == "error":
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away: stop generating so the worker slot is freed
+            cancelled.set()
+
+
+def make_server(service, host=QUERY_SERVICE_HOST, port=QUERY_SERVICE_PORT):
+    handler = type("BoundQueryRequestHandler", (QueryRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+class RemoteNode:
+    """Client-side copy of a source node, with the attributes app.py and evaluate.py read"""
+
+    def __init__(self, node_id, text, metadata):
+        self.node_id = node_id
+        self.text = text
+        self.metadata = metadata
+
+    def get_content(self):
+        return self.text
+
+
+class RemoteNodeWithScore:
+    def __init__(self, node, score=None):
+        self.node = node
+        self.score = score
+
+
+class RemoteResponse:
+    """Shaped like a llama_index Response: `response`, `source_nodes`, `metadata`"""
+
+    def __init__(self, response, source_nodes, metadata=None):
+        self.response = response
+        self.source_nodes = source_nodes
+        self.metadata = metadata or {}
+
+    def __str__(self):
+        return self.response
+
+
+def nodes_from_dicts(source_nodes):
+    return [RemoteNodeWithScore(RemoteNode(n["node_id"], n["text"], n["metadata"]), n.get("score"))
+            for n in source_nodes]
+
+
+class QueryServiceClient:
+    """Thin HTTP client for the query service (standard library only).
+
+    `query()` returns a RemoteResponse, so it stands in for a query engine in
+    evaluate.py and inspect_doc.py. `source` and `engine` are sent with every
+    request; the service records the trace under that source.
+    """
+
+    def __init__(self, url=QUERY_SERVICE_URL, timeout=QUERY_SERVICE_TIMEOUT_S, source="client", engine="app"):
+        if not url:
+            raise ValueError("No query service URL (set QUERY_SERVICE_URL)")
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.source = source
+        self.engine = engine
+
+    def _open(self, path, payload=None):
+        data = None
+        if payload is not None:
+            data = json.dumps({"source": self.source, **payload}).encode("utf-8")
+        req = urllib_request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            return urllib_request.urlopen(req, timeout=self.timeout)
+        except urllib_error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", e.reason)
+            except ValueError:
+                message = e.reason
+            raise QueryServiceError(f"Query service returned {e.code}: {message}", status=e.code) from None
+        except urllib_error.URLError as e:
+            raise QueryServiceError(f"Query service at {self.url} unreachable: {e.reason}") from None
+
+    def _call(self, path, payload=None):
+        with self._open(path, payload) as response:
+            return json.loads(response.read())
+
+    def health(self):
+        return self._call("/health")
+
+    def retrieve(self, query, rerank=True, source=None, filters=None):
+        result = self._call("/retrieve", {"query": query, "rerank": rerank, "filters": filters, **_source(source)})
+        return {**result, "source_nodes": nodes_from_dicts(result["source_nodes"])}
+
+    def rerank(self, query, node_ids, source=None):
+        result = self._call("/rerank", {"query": query, "node_ids": list(node_ids), **_source(source)})
+        return {**result, "source_nodes": nodes_from_dicts(result["source_nodes"])}
+
+    def query(self, query, source=None, filters=None):
+        result = self._call("/query", {"query": query, "engine": self.engine, "filters": filters, **_source(source)})
+        return RemoteResponse(result["answer"], nodes_from_dicts(result["source_nodes"]), result["metadata"])
+
+    def answer_stream(self, query, source=None, filters=None):
+        """Yield the chat events: "sources" (with RemoteNodeWithScore nodes), "token"..., "done".
+
+        An "error" event from the service is raised as QueryServiceError.
+        """
+        with self._open("/answer", {"query": query, "filters": filters, **_source(source)}) as response:
+            for line in response:
+                event = json.loads(line)
+                if event["event"] == "error":
+                    raise QueryServiceError(event["error"])
+                if event["event"] == "sources":
+                    event["source_nodes"] = nodes_from_dicts(event["source_nodes"])
+                yield event
+
+    def briefing(self, regenerate=False):
+        return self._call("/briefing", {"regenerate": regenerate})
+
+
+def _source(source):
+    return {"source": source} if source else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve one shared query engine over local HTTP")
+    parser.add_argument("--persist-dir", default=STORAGE_DIR)
+    parser.add_argument("--host", default=QUERY_SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=QUERY_SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=QUERY_SERVICE_WORKERS, help="Requests processed at once")
+    parser.add_argument("--queue-size", type=int, default=QUERY_SERVICE_QUEUE_SIZE,
+                        help="Requests waiting for a worker before new ones get 503")
+    parser.add_argument("--fake-llm", action="store_true", help="Offline FakeLLM instead of Gemini")
+    parser.add_argument("--fake-embed", action="store_true", help="Offline FakeEmbedding for query vectors")
+    parser.add_argument("--llm-delay", type=float, default=0.0, help="Simulated FakeLLM latency (s)")
+    parser.add_argument("--embed-delay", type=float, default=0.0, help="Simulated FakeEmbedding latency (s)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.persist_dir):
+        print(f"Storage directory '{args.persist_dir}' not found. Please run ingest.py first.")
+        return
+
+    from dotenv import load_dotenv
+    import nest_asyncio
+    from evaluate import stored_embed_dim
+
+    nest_asyncio.apply()
+    load_dotenv()
+    embed_dim = stored_embed_dim(args.persist_dir)
+    service = QueryService(
+        args.persist_dir,
+        configure_models=lambda: configure_models(args.fake_llm, args.fake_embed, args.llm_delay,
+                                                  args.embed_delay, embed_dim=embed_dim),
+        workers=args.workers,
+        queue_size=args.queue_size
+    ).start()
+    server = make_server(service, args.host, args.port)
+    print(f"Query service on http://{args.host}:{args.port} ({args.workers} workers, queue {args.queue_size})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import MetadataMode
+from pydantic import PrivateAttr
+from tracing import current_trace
+from micro_batch import MicroBatcher, MICRO_BATCH_ENABLED
+
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# onnx: ONNX Runtime; torch-int8: dynamically quantized PyTorch; torch: fp32 PyTorch (all batched + cached);
+# sentence-transformers: the stock SentenceTransformerRerank
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "onnx")
+# fp32 export published with the model; "onnx/model_quint8_avx2.onnx" is the dynamic int8 export
+RERANK_ONNX_FILE = os.getenv("RERANK_ONNX_FILE", "onnx/model.onnx")
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_THREADS = int(os.getenv("RERANK_THREADS", "0"))  # 0 = library default
+# Query + passage token budget; 512 matches SentenceTransformerRerank
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "50000"))
+# Pairs from concurrent queries are scored in one forward pass (see micro_batch.py)
+RERANK_MICRO_BATCH_WINDOW_MS = float(os.getenv("RERANK_MICRO_BATCH_WINDOW_MS", "5"))
+RERANK_MICRO_BATCH_MAX = int(os.getenv("RERANK_MICRO_BATCH_MAX", "64"))
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _uses_sigmoid(config):
+    """Whether CrossEncoder.predict applies a sigmoid for this model config (else it returns the logits).
+
+    An activation saved with the model wins (Identity for the ms-marco
+    models); otherwise single-label models get a sigmoid.
+    """
+    name = (config.get("sentence_transformers", {}).get("activation_fn")
+            or config.get("sbert_ce_default_activation_function"))
+    if name:
+        return name.endswith("Sigmoid")
+    return len(config.get("id2label", {"0": None, "1": None})) == 1
+
+
+class ScoreCache:
+    """Thread-safe LRU of (query hash, node id) -> cross-encoder score"""
+
+    def __init__(self, max_entries=RERANK_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def query_key(query):
+        return hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+    def get_many(self, query_key, node_ids):
+        found = {}
+        with self._lock:
+            for node_id in node_ids:
+                score = self._entries.get((query_key, node_id))
+                if score is not None:
+                    self._entries.move_to_end((query_key, node_id))
+                    found[node_id] = score
+            self.hits += len(found)
+            self.misses += len(node_ids) - len(found)
+        return found
+
+    def put_many(self, query_key, scores):
+        with self._lock:
+            for node_id, score in scores.items():
+                self._entries[(query_key, node_id)] = score
+                self._entries.move_to_end((query_key, node_id))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class OnnxCrossEncoder:
+    """Cross-encoder scored with ONNX Runtime and a `tokenizers` fast tokenizer.
+
+    `model` is a Hugging Face repo id or a local directory holding
+    tokenizer.json, config.json and the ONNX file. Scores use the activation
+    sentence-transformers' CrossEncoder would use for the model, so every
+    backend returns the same quantity (raw logits for ms-marco-MiniLM-L-6-v2).
+    """
+
+    def __init__(self, model=RERANK_MODEL, onnx_file=RERANK_ONNX_FILE, max_length=RERANK_MAX_LENGTH,
+                 num_threads=RERANK_THREADS):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError("The onnx rerank backend needs `pip install onnxruntime tokenizers`")
+
+        if os.path.isdir(model):
+            tokenizer_path = os.path.join(model, "tokenizer.json")
+            config_path = os.path.join(model, "config.json")
+            onnx_path = os.path.join(model, onnx_file)
+        else:
+            from huggingface_hub import hf_hub_download
+            tokenizer_path = hf_hub_download(model, "tokenizer.json")
+            config_path = hf_hub_download(model, "config.json")
+            onnx_path = hf_hub_download(model, onnx_file)
+
+        with open(config_path, "r", encoding="utf-8") as f:
+            self.sigmoid = _uses_sigmoid(json.load(f))
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        # Same strategy as CrossEncoder: with short queries only the passage is cut to the budget
+        self.tokenizer.enable_truncation(max_length=max_length, strategy="longest_first")
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def predict(self, pairs, batch_size=RERANK_BATCH_SIZE):
+        scores = []
+        for start in range(0, len(pairs), batch_size):
+            encodings = self.tokenizer.encode_batch(pairs[start:start + batch_size])
+            feed = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            logits = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+            logits = logits.reshape(len(encodings), -1)[:, 0]
+            scores.append(_sigmoid(logits) if self.sigmoid else logits)
+        return np.concatenate(scores) if scores else np.zeros(0, dtype=np.float32)
+
+
+class TorchCrossEncoder:
+    """sentence-transformers CrossEncoder, optionally with dynamic int8 quantization of its Linear layers"""
+
+    def __init__(self, model=RERANK_MODEL, quantize=True, max_length=RERANK_MAX_LENGTH, num_threads=RERANK_THREADS):
+        try:
+            import torch
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            raise ImportError("The torch rerank backends need `pip install torch sentence-transformers`")
+        if num_threads:
+            torch.set_num_threads(num_threads)  # process-wide in PyTorch
+        self.cross_encoder = CrossEncoder(model, max_length=max_length, device="cpu")
+        if quantize:
+            self.cross_encoder.model = torch.quantization.quantize_dynamic(
+                self.cross_encoder.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+    def predict(self, pairs, batch_size=RERANK_BATCH_SIZE):
+        return np.asarray(self.cross_encoder.predict(pairs, batch_size=batch_size, show_progress_bar=False))
+
+
+class FastCrossEncoderRerank(BaseNodePostprocessor):
+    """Drop-in replacement for SentenceTransformerRerank with a faster CPU backend.
+
+    Scores (query, passage) pairs in batches of `batch_size` with passages
+    truncated to `max_length` tokens, and keeps an LRU of
+    (query hash, node id) -> score so repeated questions skip the model.
+    With `micro_batch`, cache misses of concurrent queries are coalesced
+    into shared `predict` calls.
+    """
+
+    top_n: int = 5
+    model: str = RERANK_MODEL
+    backend: str = RERANK_BACKEND
+    batch_size: int = RERANK_BATCH_SIZE
+
+    _encoder = PrivateAttr(default=None)
+    _cache = PrivateAttr(default=None)
+    _batcher = PrivateAttr(default=None)
+
+    def __init__(self, top_n=5, model=RERANK_MODEL, backend=RERANK_BACKEND, batch_size=RERANK_BATCH_SIZE,
+                 max_length=RERANK_MAX_LENGTH, num_threads=RERANK_THREADS, onnx_file=RERANK_ONNX_FILE,
+                 cache_size=RERANK_CACHE_SIZE, micro_batch=MICRO_BATCH_ENABLED, **kwargs):
+        super().__init__(top_n=top_n, model=model, backend=backend, batch_size=batch_size, **kwargs)
+        if backend == "onnx":
+            self._encoder = OnnxCrossEncoder(model, onnx_file=onnx_file, max_length=max_length, num_threads=num_threads)
+        elif backend in ("torch-int8", "torch"):
+            self._encoder = TorchCrossEncoder(model, quantize=backend == "torch-int8", max_length=max_length,
+                                              num_threads=num_threads)
+        else:
+            raise ValueError(f"Unknown rerank backend '{backend}'; use 'onnx', 'torch-int8' or 'torch'.")
+        self._cache = ScoreCache(cache_size) if cache_size else None
+        if micro_batch:
+            encoder = self._encoder
+            self._batcher = MicroBatcher(
+                "rerank", lambda pairs: encoder.predict(pairs, batch_size=batch_size),
+                window_ms=RERANK_MICRO_BATCH_WINDOW_MS, max_batch_size=RERANK_MICRO_BATCH_MAX
+            )
+
+    @classmethod
+    def class_name(cls):
+        return "FastCrossEncoderRerank"
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def score(self, query, nodes):
+        """Cross-encoder score per node, computing only cache misses"""
+        query_key = ScoreCache.query_key(query)
+        node_ids = [n.node.node_id for n in nodes]
+        cached = self._cache.get_many(query_key, node_ids) if self._cache is not None else {}
+
+        missing = [n for n in nodes if n.node.node_id not in cached]
+        if missing:
+            pairs = [(query, n.node.get_content(metadata_mode=MetadataMode.EMBED)) for n in missing]
+            if self._batcher is not None:
+                new_scores = self._batcher.map(pairs)
+            else:
+                new_scores = self._encoder.predict(pairs, batch_size=self.batch_size)
+            computed = {n.node.node_id: float(s) for n, s in zip(missing, new_scores)}
+            if self._cache is not None:
+                self._cache.put_many(query_key, computed)
+            cached = {**cached, **computed}
+
+        trace = current_trace()
+        if trace is not None:
+            trace.set_cache("rerank", f"{len(nodes) - len(missing)}/{len(nodes)}")
+        return [cached[node_id] for node_id in node_ids]
+
+    def _postprocess_nodes(self, nodes, query_bundle=None):
+        if query_bundle is None:
+            raise ValueError("Missing query bundle in extra info.")
+        if not nodes:
+            return []
+        for node, score in zip(nodes, self.score(query_bundle.query_str, nodes)):
+            node.score = score
+        return sorted(nodes, key=lambda x: -x.score if x.score else 0)[:self.top_n]
+
+
+def make_reranker(top_n=5, backend=RERANK_BACKEND, fallback=True, **kwargs):
+    """Reranker for the configured backend, falling back to SentenceTransformerRerank if it is not installed or fails to load"""
+    if backend != "sentence-transformers":
+        try:
+            return FastCrossEncoderRerank(top_n=top_n, backend=backend, **kwargs)
+        except (ImportError, OSError, RuntimeError) as e:
+            if not fallback:
+                raise
+            print(f"Rerank backend '{backend}' unavailable ({e}); using SentenceTransformerRerank.")
+    from llama_index.core.postprocessor import SentenceTransformerRerank
+    return SentenceTransformerRerank(model=kwargs.get("model", RERANK_MODEL), top_n=top_n)
@@ -0,0 +1,212 @@
+import os
+import json
+import hashlib
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+
+# Sharded layout: <storage>/shards.json lists the shards, and each shard is a
+# complete store of its own (docstore, vectors, ANN, BM25, tables, filter
+# index, manifest) under <storage>/shards/<name>/. Shards are ingested and
+# reloaded independently; queries search them all (see pipeline.ShardedRetriever).
+#   collection: one shard per subdirectory of ./data ("default" for PDFs directly in it)
+#   hash:       files spread over `count` shards by a stable hash of the file name
+SHARDS_FNAME = "shards.json"
+SHARDS_DIRNAME = "shards"
+DEFAULT_SHARD = "default"
+SHARD_SCHEMES = ("collection", "hash")
+# Threads that search shards concurrently (shared by every query in the process)
+SHARD_SEARCH_THREADS = int(os.getenv("SHARD_SEARCH_THREADS", str(min(os.cpu_count() or 4, 16))))
+SHARD_LOAD_THREADS = int(os.getenv("SHARD_LOAD_THREADS", "4"))
+
+
+def parse_scheme(text):
+    """'collection' or 'hash:N' -> (scheme, count)"""
+    scheme, _, count = text.partition(":")
+    if scheme not in SHARD_SCHEMES:
+        raise ValueError(f"Unknown shard scheme '{scheme}'; use 'collection' or 'hash:N'.")
+    if scheme == "hash":
+        if not count.isdigit() or int(count) < 1:
+            raise ValueError("The hash scheme needs a shard count, e.g. 'hash:4'.")
+        return scheme, int(count)
+    return scheme, None
+
+
+def load_layout(persist_dir):
+    """The shards.json of a sharded store, or None for a single-directory store"""
+    path = os.path.join(persist_dir, SHARDS_FNAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_layout(persist_dir, scheme, count, shard_names):
+    os.makedirs(persist_dir, exist_ok=True)
+    layout = {"scheme": scheme, "count": count, "shards": sorted(shard_names)}
+    path = os.path.join(persist_dir, SHARDS_FNAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(layout, f, indent=2)
+    os.replace(path + ".tmp", path)
+    return layout
+
+
+def is_sharded(persist_dir):
+    return os.path.exists(os.path.join(persist_dir, SHARDS_FNAME))
+
+
+def shard_dir(persist_dir, name):
+    return os.path.join(persist_dir, SHARDS_DIRNAME, name)
+
+
+def shard_dirs(persist_dir):
+    """name -> directory of every ingested shard (empty for a single-directory store)"""
+    layout = load_layout(persist_dir)
+    if layout is None:
+        return {}
+    dirs = {name: shard_dir(persist_dir, name) for name in layout["shards"]}
+    return {name: path for name, path in dirs.items() if os.path.isdir(path)}
+
+
+def hash_shard(file_name, count):
+    """Stable shard of a file under the hash scheme (independent of PYTHONHASHSEED)"""
+    digest = hashlib.blake2b(file_name.encode("utf-8"), digest_size=8).digest()
+    return f"hash-{int.from_bytes(digest, 'big') % count:02d}"
+
+
+def plan_shards(data_dir, scheme, count=None):
+    """name -> (data directory, PDF file names) for every shard the corpus in `data_dir` maps to"""
+    top_level = sorted(f for f in os.listdir(data_dir) if f.endswith(".pdf"))
+    if scheme == "hash":
+        plan = {f"hash-{i:02d}": (data_dir, []) for i in range(count)}
+        for name in top_level:
+            plan[hash_shard(name, count)][1].append(name)
+        return plan
+
+    plan = {}
+    if top_level:
+        plan[DEFAULT_SHARD] = (data_dir, top_level)
+    for entry in sorted(os.listdir(data_dir)):
+        collection_dir = os.path.join(data_dir, entry)
+        if os.path.isdir(collection_dir):
+            files = sorted(f for f in os.listdir(collection_dir) if f.endswith(".pdf"))
+            if files:
+                plan[entry] = (collection_dir, files)
+    return plan
+
+
+def combined_version(persist_dir):
+    """Version of a sharded store: changes whenever any shard's manifest version does"""
+    from index_loader import read_index_version
+
+    versions = {name: read_index_version(path) for name, path in sorted(shard_dirs(persist_dir).items())}
+    if not versions:
+        return None
+    return hashlib.sha256(json.dumps(versions, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class ShardedDocstore:
+    """Read-only view over the docstores of every shard, for lookups by node id and full scans"""
+
+    def __init__(self, docstores):
+        self.docstores = dict(docstores)
+
+    @property
+    def docs(self):
+        return ChainMap(*(docstore.docs for docstore in self.docstores.values()))
+
+    def get_node(self, node_id, raise_error=True):
+        for docstore in self.docstores.values():
+            node = docstore.get_node(node_id, raise_error=False)
+            if node is not None:
+                return node
+        if raise_error:
+            raise ValueError(f"node_id {node_id} not found in any shard.")
+        return None
+
+    def get_nodes(self, node_ids, raise_error=True):
+        found = {}
+        for docstore in self.docstores.values():
+            missing = [node_id for node_id in node_ids if node_id not in found]
+            if not missing:
+                break
+            for node in docstore.get_nodes(missing, raise_error=False):
+                if node is not None:
+                    found[node.node_id] = node
+        if raise_error and len(found) < len(set(node_ids)):
+            raise ValueError(f"{len(set(node_ids)) - len(found)} node id(s) not found in any shard.")
+        return [found.get(node_id) for node_id in node_ids]
+
+    def iter_nodes(self, batch_size=None, **kwargs):
+        from sqlite_docstore import iter_docstore_nodes, DOCSTORE_BATCH_SIZE
+
+        for docstore in self.docstores.values():
+            yield from iter_docstore_nodes(docstore, batch_size or DOCSTORE_BATCH_SIZE)
+
+
+class ShardedIndex:
+    """Every shard's VectorStoreIndex, standing in for the single index where the app needs one.
+
+    `shards` maps name -> (persist_dir, index). pipeline.build_query_engine()
+    builds per-shard vector and BM25 branches from it; `docstore` and
+    `as_query_engine()` cover the briefing, table citations and the plain
+    vector engine.
+    """
+
+    def __init__(self, persist_dir, shards):
+        self.persist_dir = persist_dir
+        self.shards = dict(shards)
+        self.docstore = ShardedDocstore({name: index.docstore for name, (_, index) in self.shards.items()})
+
+    def as_retriever(self, similarity_top_k=2, **kwargs):
+        from pipeline import ShardedRetriever
+
+        return ShardedRetriever(
+            {name: index.as_retriever(similarity_top_k=similarity_top_k, **kwargs)
+             for name, (_, index) in self.shards.items()},
+            similarity_top_k=similarity_top_k
+        )
+
+    def as_query_engine(self, similarity_top_k=2, **kwargs):
+        from llama_index.core.query_engine import RetrieverQueryEngine
+
+        return RetrieverQueryEngine.from_args(self.as_retriever(similarity_top_k=similarity_top_k), **kwargs)
+
+
+def load_sharded_index(persist_dir, max_workers=SHARD_LOAD_THREADS):
+    """Load every shard of `persist_dir` concurrently into a ShardedIndex"""
+    from index_loader import load_index
+
+    dirs = shard_dirs(persist_dir)
+    if not dirs:
+        raise FileNotFoundError(f"'{persist_dir}' has no ingested shards; run `python ingest.py`.")
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-load") as pool:
+        indexes = dict(zip(dirs, pool.map(load_index, dirs.values())))
+    return ShardedIndex(persist_dir, {name: (dirs[name], indexes[name]) for name in dirs})
+
+
+class ShardedTableStore:
+    """Numeric lookups over the table stores of every shard.
+
+    Each shard answers on its own; the matches of all shards that answer
+    are listed together, each with its own source.
+    """
+
+    def __init__(self, stores):
+        self.stores = dict(stores)
+
+    @property
+    def table_count(self):
+        return sum(store.table_count for store in self.stores.values())
+
+    def lookup(self, query, keep=None, **kwargs):
+        hits = [hit for hit in (store.lookup(query, keep=keep, **kwargs) for store in self.stores.values())
+                if hit is not None]
+        if len(hits) <= 1:
+            return hits[0] if hits else None
+        return {"answer": "\n\n".join(hit["answer"] for hit in hits),
+                "matches": [match for hit in hits for match in hit["matches"]],
+                "ms": round(sum(hit["ms"] for hit in hits), 2)}
+
+    def close(self):
+        for store in self.stores.values():
+            store.close()
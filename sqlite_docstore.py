@@ -0,0 +1,408 @@
+import os
+import json
+import zlib
+import sqlite3
+import argparse
+import threading
+from collections.abc import Mapping
+from llama_index.core.storage.docstore.types import BaseDocumentStore, RefDocInfo
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+DOCSTORE_FNAME = "docstore.sqlite"
+LEGACY_DOCSTORE_FILE = "docstore.json"
+DOCSTORE_COMPRESS_LEVEL = int(os.getenv("DOCSTORE_COMPRESS_LEVEL", "6"))
+# Nodes decoded per query when iterating; bounds what a full scan keeps in memory
+DOCSTORE_BATCH_SIZE = int(os.getenv("DOCSTORE_BATCH_SIZE", "500"))
+SQLITE_MAX_PARAMS = 900
+
+
+def _pack(value):
+    return zlib.compress(value.encode("utf-8"), DOCSTORE_COMPRESS_LEVEL)
+
+
+def _unpack(blob):
+    return zlib.decompress(blob).decode("utf-8")
+
+
+def _chunks(items, size=SQLITE_MAX_PARAMS):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class LazyDocs(Mapping):
+    """Read-only `docs` view: node id -> node, decoded on access.
+
+    `values()` and `items()` stream the store in batches, so callers written
+    against SimpleDocumentStore's dict (`for node in docstore.docs.values()`)
+    keep working without holding every node at once.
+    """
+
+    def __init__(self, store):
+        self._store = store
+
+    def __getitem__(self, node_id):
+        node = self._store.get_document(node_id, raise_error=False)
+        if node is None:
+            raise KeyError(node_id)
+        return node
+
+    def __iter__(self):
+        return iter(self._store.node_ids())
+
+    def __len__(self):
+        return self._store.node_count
+
+    def __contains__(self, node_id):
+        return self._store.document_exists(node_id)
+
+    def values(self):
+        return self._store.iter_nodes()
+
+    def items(self):
+        return ((node.node_id, node) for node in self._store.iter_nodes())
+
+
+class SqliteDocumentStore(BaseDocumentStore):
+    """Docstore backed by one SQLite file instead of a JSON dict held in memory.
+
+    Each node is a row keyed by node id, with its ref doc id, file name and
+    page label in indexed columns. The node's JSON (metadata, relationships)
+    and its text are zlib-compressed into separate columns, so listing nodes
+    by file or page never decompresses text, and a lookup decodes only the
+    rows it returns. Nothing is cached: resident memory follows the nodes a
+    caller holds, not the corpus.
+
+    Writes stay in one open transaction until `persist()` commits them, so a
+    run that dies before persisting leaves the file as of the last persist,
+    like the JSON store. WAL mode lets other processes read meanwhile.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.executescript(
+            "PRAGMA journal_mode=WAL;"
+            "CREATE TABLE IF NOT EXISTS nodes ("
+            " node_id TEXT PRIMARY KEY, ref_doc_id TEXT, file_name TEXT, page_label TEXT,"
+            " data BLOB, text BLOB);"
+            "CREATE TABLE IF NOT EXISTS ref_docs (ref_doc_id TEXT PRIMARY KEY, metadata TEXT);"
+            "CREATE TABLE IF NOT EXISTS doc_hashes (doc_id TEXT PRIMARY KEY, doc_hash TEXT);"
+            "CREATE INDEX IF NOT EXISTS idx_nodes_ref_doc ON nodes (ref_doc_id);"
+            "CREATE INDEX IF NOT EXISTS idx_nodes_page ON nodes (file_name, page_label);"
+        )
+
+    @staticmethod
+    def exists(persist_dir):
+        return os.path.exists(os.path.join(persist_dir, DOCSTORE_FNAME))
+
+    @classmethod
+    def from_persist_dir(cls, persist_dir):
+        return cls(os.path.join(persist_dir, DOCSTORE_FNAME))
+
+    def close(self):
+        self.conn.close()
+
+    def persist(self, persist_path=None, fs=None):
+        """Commit pending writes; copy the database if persisting to another directory.
+
+        StorageContext passes `<dir>/docstore.json`; only its directory is used.
+        """
+        with self._lock:
+            self.conn.commit()
+            if persist_path is None:
+                return
+            target = os.path.join(os.path.dirname(persist_path) or ".", DOCSTORE_FNAME)
+            if self.path is not None and os.path.abspath(target) == os.path.abspath(self.path):
+                return
+            os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+            dest = sqlite3.connect(target)
+            try:
+                self.conn.backup(dest)
+            finally:
+                dest.close()
+
+    # Reads
+
+    def _decode(self, data, text):
+        node_json = json.loads(_unpack(data))
+        if text is not None:
+            node_json["__data__"]["text"] = _unpack(text)
+        return json_to_doc(node_json)
+
+    @property
+    def node_count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM nodes WHERE data IS NOT NULL").fetchone()[0]
+
+    def node_ids(self):
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                "SELECT node_id FROM nodes WHERE data IS NOT NULL ORDER BY rowid"
+            )]
+
+    def node_refs(self, file_name=None):
+        """(node_id, ref_doc_id, file_name, page_label) per node in insertion order; reads no text"""
+        query = "SELECT node_id, ref_doc_id, file_name, page_label FROM nodes WHERE data IS NOT NULL"
+        params = ()
+        if file_name is not None:
+            query += " AND file_name = ?"
+            params = (file_name,)
+        with self._lock:
+            return self.conn.execute(query + " ORDER BY rowid", params).fetchall()
+
+    def iter_nodes(self, batch_size=DOCSTORE_BATCH_SIZE, file_name=None):
+        """Yield every node in insertion order, decoding `batch_size` rows at a time"""
+        query = "SELECT rowid, data, text FROM nodes WHERE data IS NOT NULL AND rowid > ?"
+        if file_name is not None:
+            query += " AND file_name = ?"
+        query += " ORDER BY rowid LIMIT ?"
+        last_rowid = 0
+        while True:
+            params = (last_rowid, file_name, batch_size) if file_name is not None else (last_rowid, batch_size)
+            with self._lock:
+                rows = self.conn.execute(query, params).fetchall()
+            if not rows:
+                return
+            last_rowid = rows[-1][0]
+            for _, data, text in rows:
+                yield self._decode(data, text)
+
+    @property
+    def docs(self):
+        return LazyDocs(self)
+
+    def get_document(self, doc_id, raise_error=True):
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT data, text FROM nodes WHERE node_id = ? AND data IS NOT NULL", (doc_id,)
+            ).fetchone()
+        if row is None:
+            if raise_error:
+                raise ValueError(f"doc_id {doc_id} not found.")
+            return None
+        return self._decode(*row)
+
+    def get_nodes(self, node_ids, raise_error=True):
+        """Nodes for `node_ids` in the given order, fetched with one query per 900 ids"""
+        node_ids = list(node_ids)
+        rows = {}
+        with self._lock:
+            for chunk in _chunks(node_ids):
+                placeholders = ",".join("?" * len(chunk))
+                rows.update((node_id, (data, text)) for node_id, data, text in self.conn.execute(
+                    f"SELECT node_id, data, text FROM nodes WHERE data IS NOT NULL AND node_id IN ({placeholders})",
+                    chunk
+                ))
+        nodes = []
+        for node_id in node_ids:
+            if node_id in rows:
+                nodes.append(self._decode(*rows[node_id]))
+            elif raise_error:
+                raise ValueError(f"Node {node_id} not found")
+        return nodes
+
+    def document_exists(self, doc_id):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT 1 FROM nodes WHERE node_id = ? AND data IS NOT NULL", (doc_id,)
+            ).fetchone() is not None
+
+    def get_ref_doc_info(self, ref_doc_id):
+        with self._lock:
+            row = self.conn.execute("SELECT metadata FROM ref_docs WHERE ref_doc_id = ?", (ref_doc_id,)).fetchone()
+            if row is None:
+                return None
+            node_ids = [r[0] for r in self.conn.execute(
+                "SELECT node_id FROM nodes WHERE ref_doc_id = ? ORDER BY rowid", (ref_doc_id,)
+            )]
+        return RefDocInfo(node_ids=node_ids, metadata=json.loads(row[0]))
+
+    def get_all_ref_doc_info(self):
+        with self._lock:
+            infos = {
+                ref_doc_id: RefDocInfo(node_ids=[], metadata=json.loads(metadata))
+                for ref_doc_id, metadata in self.conn.execute("SELECT ref_doc_id, metadata FROM ref_docs")
+            }
+            for node_id, ref_doc_id in self.conn.execute(
+                "SELECT node_id, ref_doc_id FROM nodes WHERE ref_doc_id IS NOT NULL ORDER BY rowid"
+            ):
+                if ref_doc_id in infos:
+                    infos[ref_doc_id].node_ids.append(node_id)
+        return infos
+
+    def get_document_hash(self, doc_id):
+        with self._lock:
+            row = self.conn.execute("SELECT doc_hash FROM doc_hashes WHERE doc_id = ?", (doc_id,)).fetchone()
+        return row[0] if row else None
+
+    def get_all_document_hashes(self):
+        with self._lock:
+            return {doc_hash: doc_id for doc_id, doc_hash in self.conn.execute("SELECT doc_id, doc_hash FROM doc_hashes")}
+
+    # Writes
+
+    def add_documents(self, docs, allow_update=True, batch_size=None, store_text=True):
+        rows, refs_only, hashes, ref_docs = [], [], [], []
+        for node in docs:
+            if not allow_update and self.document_exists(node.node_id):
+                raise ValueError(f"node_id {node.node_id} already exists. Set allow_update to True to overwrite.")
+            metadata = node.metadata or {}
+            page_label = metadata.get("page_label")
+            location = (node.node_id, node.ref_doc_id, metadata.get("file_name"),
+                        None if page_label is None else str(page_label))
+            if store_text:
+                node_json = doc_to_json(node)
+                node_text = node_json["__data__"].pop("text", None)
+                rows.append(location + (_pack(json.dumps(node_json)),
+                                        None if node_text is None else _pack(node_text)))
+            else:
+                # Tracked for its ref doc only, as KVDocumentStore does when the vector store keeps the text
+                refs_only.append(location)
+            hashes.append((node.node_id, node.hash))
+            if node.ref_doc_id:
+                ref_docs.append((node.ref_doc_id, json.dumps(metadata)))
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self.conn.executemany("INSERT OR IGNORE INTO nodes VALUES (?, ?, ?, ?, NULL, NULL)", refs_only)
+            self.conn.executemany("INSERT OR REPLACE INTO doc_hashes VALUES (?, ?)", hashes)
+            # The first node of a ref doc sets its metadata, as in KVDocumentStore
+            self.conn.executemany("INSERT OR IGNORE INTO ref_docs VALUES (?, ?)", ref_docs)
+
+    def set_document_hash(self, doc_id, doc_hash):
+        self.set_document_hashes({doc_id: doc_hash})
+
+    def set_document_hashes(self, doc_hashes):
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO doc_hashes VALUES (?, ?)", list(doc_hashes.items()))
+
+    def delete_document(self, doc_id, raise_error=True):
+        with self._lock:
+            row = self.conn.execute("SELECT ref_doc_id FROM nodes WHERE node_id = ?", (doc_id,)).fetchone()
+            self.conn.execute("DELETE FROM nodes WHERE node_id = ?", (doc_id,))
+            self.conn.execute("DELETE FROM doc_hashes WHERE doc_id = ?", (doc_id,))
+            if row is not None and row[0] is not None:
+                # A ref doc goes away with its last node
+                self.conn.execute(
+                    "DELETE FROM ref_docs WHERE ref_doc_id = ? AND NOT EXISTS "
+                    "(SELECT 1 FROM nodes WHERE ref_doc_id = ?)", (row[0], row[0])
+                )
+        if row is None and raise_error:
+            raise ValueError(f"doc_id {doc_id} not found.")
+
+    def delete_ref_doc(self, ref_doc_id, raise_error=True):
+        with self._lock:
+            found = self.conn.execute("SELECT 1 FROM ref_docs WHERE ref_doc_id = ?", (ref_doc_id,)).fetchone()
+            if found is None:
+                if raise_error:
+                    raise ValueError(f"ref_doc_id {ref_doc_id} not found.")
+                return
+            self.conn.execute(
+                "DELETE FROM doc_hashes WHERE doc_id IN (SELECT node_id FROM nodes WHERE ref_doc_id = ?)", (ref_doc_id,)
+            )
+            self.conn.execute("DELETE FROM nodes WHERE ref_doc_id = ? OR node_id = ?", (ref_doc_id, ref_doc_id))
+            self.conn.execute("DELETE FROM doc_hashes WHERE doc_id = ?", (ref_doc_id,))
+            self.conn.execute("DELETE FROM ref_docs WHERE ref_doc_id = ?", (ref_doc_id,))
+
+    # Async variants: SQLite calls are short, so they run inline
+
+    async def async_add_documents(self, docs, allow_update=True, batch_size=None, store_text=True):
+        self.add_documents(docs, allow_update=allow_update, batch_size=batch_size, store_text=store_text)
+
+    async def aget_document(self, doc_id, raise_error=True):
+        return self.get_document(doc_id, raise_error=raise_error)
+
+    async def adelete_document(self, doc_id, raise_error=True):
+        self.delete_document(doc_id, raise_error=raise_error)
+
+    async def adocument_exists(self, doc_id):
+        return self.document_exists(doc_id)
+
+    async def aset_document_hash(self, doc_id, doc_hash):
+        self.set_document_hash(doc_id, doc_hash)
+
+    async def aset_document_hashes(self, doc_hashes):
+        self.set_document_hashes(doc_hashes)
+
+    async def aget_document_hash(self, doc_id):
+        return self.get_document_hash(doc_id)
+
+    async def aget_all_document_hashes(self):
+        return self.get_all_document_hashes()
+
+    async def aget_all_ref_doc_info(self):
+        return self.get_all_ref_doc_info()
+
+    async def aget_ref_doc_info(self, ref_doc_id):
+        return self.get_ref_doc_info(ref_doc_id)
+
+    async def adelete_ref_doc(self, ref_doc_id, raise_error=True):
+        self.delete_ref_doc(ref_doc_id, raise_error=raise_error)
+
+
+def iter_docstore_nodes(docstore, batch_size=DOCSTORE_BATCH_SIZE):
+    """Every node of any docstore; streamed in batches from SqliteDocumentStore (and shards.ShardedDocstore)"""
+    if hasattr(docstore, "iter_nodes"):
+        return docstore.iter_nodes(batch_size=batch_size)
+    return iter(docstore.docs.values())
+
+
+def _remove_database(path):
+    """Delete a SQLite database file with its -wal and -shm files"""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def migrate_from_json(persist_dir, batch_size=DOCSTORE_BATCH_SIZE):
+    """Convert a persisted SimpleDocumentStore (docstore.json) into docstore.sqlite"""
+    from llama_index.core.storage.docstore import SimpleDocumentStore
+
+    json_path = os.path.join(persist_dir, LEGACY_DOCSTORE_FILE)
+    if not os.path.exists(json_path):
+        raise FileNotFoundError(f"No JSON docstore found at '{json_path}'.")
+
+    print(f"Reading '{json_path}'...")
+    legacy = SimpleDocumentStore.from_persist_path(json_path)
+    path = os.path.join(persist_dir, DOCSTORE_FNAME)
+    # A .tmp left by an interrupted migration is started over
+    _remove_database(path + ".tmp")
+    store = SqliteDocumentStore(path + ".tmp")
+    nodes = list(legacy.docs.values())
+    for start in range(0, len(nodes), batch_size):
+        store.add_documents(nodes[start:start + batch_size])
+    # Hashes recorded for whole documents (not only their nodes) and the exact ref doc metadata
+    store.set_document_hashes({doc_id: doc_hash for doc_hash, doc_id in legacy.get_all_document_hashes().items()})
+    with store._lock:
+        store.conn.executemany("INSERT OR REPLACE INTO ref_docs VALUES (?, ?)", [
+            (ref_doc_id, json.dumps(info.metadata)) for ref_doc_id, info in (legacy.get_all_ref_doc_info() or {}).items()
+        ])
+    store.persist()
+    store.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    store.close()
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(path + ".tmp" + suffix):
+            os.remove(path + ".tmp" + suffix)
+    # Only now that the new database is complete: SQLite would replay an old -wal into it
+    _remove_database(path)
+    os.replace(path + ".tmp", path)
+
+    # Keep the original around, but out of the way of SimpleDocumentStore's loader
+    os.replace(json_path, json_path + ".bak")
+    json_size = os.path.getsize(json_path + ".bak") / 1e6
+    print(f"Migrated {len(nodes)} nodes to '{path}' ({os.path.getsize(path) / 1e6:.1f} MB, "
+          f"JSON was {json_size:.1f} MB). Original kept as '{json_path}.bak'.")
+    return SqliteDocumentStore(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite docstore utilities")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Convert the JSON docstore in a storage dir")
+    migrate.add_argument("--persist-dir", default="./storage")
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        migrate_from_json(args.persist_dir)
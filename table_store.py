@@ -0,0 +1,308 @@
+import os
+import re
+import time
+import sqlite3
+import threading
+
+TABLE_STORE_FNAME = "tables.sqlite"
+TABLE_LOOKUP_ENABLED = os.getenv("TABLE_LOOKUP", "1") != "0"
+TABLE_LOOKUP_MAX_MATCHES = int(os.getenv("TABLE_LOOKUP_MAX_MATCHES", "3"))
+
+# Questions that need reasoning over the text rather than reading a cell
+NON_LOOKUP_WORDS = {
+    "why", "explain", "compare", "comparison", "versus", "vs", "difference", "impact", "effect", "effects",
+    "affect", "affected", "driven", "drivers", "cause", "caused", "trend", "trends", "outlook", "risk", "risks",
+    "recommend", "recommendations", "recommended", "summarize", "summary", "analyze", "analysis", "describe",
+    "discuss", "assess", "assessment", "should", "could", "would", "policy", "policies", "reform", "reforms",
+}
+STOPWORDS = {
+    "what", "whats", "was", "were", "is", "are", "the", "a", "an", "of", "in", "for", "on", "at", "to", "by", "s",
+    "how", "much", "many", "did", "does", "do", "give", "me", "show", "tell", "value", "values", "figure", "number",
+    "level", "amount", "and", "its", "it", "as", "from", "with", "year", "years", "please", "which", "there",
+}
+# Measure words a question may add without naming a different indicator
+GENERIC_WORDS = {
+    "growth", "rate", "rates", "total", "annual", "average", "percent", "percentage", "ratio", "projected",
+    "projection", "forecast", "estimate", "estimated", "latest", "data", "figures",
+}
+# Qualifiers a question may leave out of an indicator's name ("GDP growth" -> "Real GDP", "inflation" -> "CPI inflation")
+QUALIFIER_WORDS = {"real", "cpi", "headline", "overall", "average"}
+YEAR_RE = re.compile(r"^(19|20)\d\d$")
+SEPARATOR_RE = re.compile(r"^\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?$")
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower().replace("'s", ""))
+
+
+def _cells(line):
+    return [cell.strip() for cell in line.strip().strip("|").split("|")]
+
+
+def parse_number(text):
+    """Float for a table cell like '1,234.5', '-0.3', '(0.3)', '5 .6' or '4.2%'; None otherwise"""
+    text = re.sub(r"(?<=\d)\s+(?=\.\d)", "", text.strip())
+    text = re.sub(r"\s*\d/$", "", text)  # trailing footnote marker
+    negative = text.startswith("(") and text.endswith(")")
+    text = text.strip("()%").replace(",", "").replace("−", "-")
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return -value if negative else value
+
+
+def core_label(label):
+    """Indicator name without parentheticals and footnote markers: 'Real GDP (2018 prices) 1/' -> 'Real GDP'"""
+    label = re.sub(r"\([^)]*\)", " ", label)
+    label = re.sub(r"\b\d+/", " ", label)
+    return " ".join(label.split())
+
+
+def extract_tables(text):
+    """Markdown tables in a page: [{"title", "header", "rows", "markdown"}]
+
+    A table is a run of `|` lines whose second line is a `| --- |` separator.
+    The title is the nearest non-empty line above the table.
+    """
+    lines = text.splitlines()
+    tables = []
+    i = 0
+    while i < len(lines) - 1:
+        if not (lines[i].lstrip().startswith("|") and SEPARATOR_RE.match(lines[i + 1].strip())):
+            i += 1
+            continue
+        end = i + 2
+        while end < len(lines) and lines[end].lstrip().startswith("|"):
+            end += 1
+        header = _cells(lines[i])
+        rows = [_cells(line) for line in lines[i + 2:end]]
+        title = next((lines[j].strip().lstrip("#").strip() for j in range(i - 1, max(i - 4, -1), -1)
+                      if lines[j].strip()), "")
+        if rows:
+            tables.append({"title": title, "header": header, "rows": rows, "markdown": "\n".join(lines[i:end])})
+        i = end
+    return tables
+
+
+class TableStore:
+    """SQLite store of the markdown tables found in parsed pages.
+
+    `tables` links each table to its file, page label and node id; `cells`
+    holds every cell with its parsed numeric value; `indicators` holds one row
+    label per table row, and `indicator_terms` is the term index used to find
+    candidate rows for a question without scanning the tables.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.executescript(
+            "PRAGMA journal_mode=WAL;"
+            "CREATE TABLE IF NOT EXISTS tables ("
+            " table_id INTEGER PRIMARY KEY, node_id TEXT NOT NULL, file_name TEXT, page_label TEXT,"
+            " title TEXT, n_rows INTEGER, n_cols INTEGER, markdown TEXT);"
+            "CREATE TABLE IF NOT EXISTS columns ("
+            " table_id INTEGER NOT NULL, col_idx INTEGER NOT NULL, label TEXT, PRIMARY KEY (table_id, col_idx));"
+            "CREATE TABLE IF NOT EXISTS cells ("
+            " table_id INTEGER NOT NULL, row_idx INTEGER NOT NULL, col_idx INTEGER NOT NULL, text TEXT, value REAL,"
+            " PRIMARY KEY (table_id, row_idx, col_idx));"
+            "CREATE TABLE IF NOT EXISTS indicators ("
+            " indicator_id INTEGER PRIMARY KEY, table_id INTEGER NOT NULL, row_idx INTEGER NOT NULL,"
+            " label TEXT, section TEXT);"
+            "CREATE TABLE IF NOT EXISTS indicator_terms (term TEXT NOT NULL, indicator_id INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_tables_node ON tables (node_id);"
+            "CREATE INDEX IF NOT EXISTS idx_indicator_terms ON indicator_terms (term);"
+        )
+
+    @staticmethod
+    def exists(persist_dir):
+        return os.path.exists(os.path.join(persist_dir, TABLE_STORE_FNAME))
+
+    @classmethod
+    def open(cls, persist_dir):
+        return cls(os.path.join(persist_dir, TABLE_STORE_FNAME))
+
+    def close(self):
+        self.conn.close()
+
+    @property
+    def table_count(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM tables").fetchone()[0]
+
+    def _insert_table(self, table, node_id, file_name, page_label):
+        header, rows = table["header"], table["rows"]
+        n_cols = max(len(header), *(len(row) for row in rows))
+        cursor = self.conn.execute(
+            "INSERT INTO tables (node_id, file_name, page_label, title, n_rows, n_cols, markdown) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (node_id, file_name, page_label, table["title"], len(rows), n_cols, table["markdown"])
+        )
+        table_id = cursor.lastrowid
+        self.conn.executemany(
+            "INSERT INTO columns (table_id, col_idx, label) VALUES (?, ?, ?)",
+            [(table_id, c, header[c] if c < len(header) else "") for c in range(n_cols)]
+        )
+        self.conn.executemany(
+            "INSERT INTO cells (table_id, row_idx, col_idx, text, value) VALUES (?, ?, ?, ?, ?)",
+            [(table_id, r, c, cell, parse_number(cell)) for r, row in enumerate(rows) for c, cell in enumerate(row)]
+        )
+
+        section = ""
+        for r, row in enumerate(rows):
+            label = row[0] if row else ""
+            if not label or parse_number(label) is not None:
+                continue
+            if not any(parse_number(cell) is not None for cell in row[1:]):
+                # A label without numbers heads the rows below it ("External sector")
+                section = label
+                continue
+            indicator_id = self.conn.execute(
+                "INSERT INTO indicators (table_id, row_idx, label, section) VALUES (?, ?, ?, ?)",
+                (table_id, r, label, section)
+            ).lastrowid
+            terms = set(tokenize(core_label(label))) - STOPWORDS
+            self.conn.executemany(
+                "INSERT INTO indicator_terms (term, indicator_id) VALUES (?, ?)",
+                [(term, indicator_id) for term in terms]
+            )
+
+    def update(self, tables=(), removed_node_ids=()):
+        """Apply an ingestion delta in one transaction.
+
+        tables: [(table, node_id, file_name, page_label)] from extract_tables
+        """
+        with self._lock, self.conn:
+            removed_node_ids = list(removed_node_ids)
+            for start in range(0, len(removed_node_ids), 500):
+                chunk = removed_node_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                table_ids = [row[0] for row in self.conn.execute(
+                    f"SELECT table_id FROM tables WHERE node_id IN ({placeholders})", chunk)]
+                self._delete_tables(table_ids)
+            for table, node_id, file_name, page_label in tables:
+                self._insert_table(table, node_id, file_name, page_label)
+
+    def _delete_tables(self, table_ids):
+        if not table_ids:
+            return
+        placeholders = ",".join("?" * len(table_ids))
+        self.conn.execute(
+            f"DELETE FROM indicator_terms WHERE indicator_id IN "
+            f"(SELECT indicator_id FROM indicators WHERE table_id IN ({placeholders}))", table_ids)
+        for name in ("indicators", "cells", "columns", "tables"):
+            self.conn.execute(f"DELETE FROM {name} WHERE table_id IN ({placeholders})", table_ids)
+
+    def lookup(self, query, max_matches=TABLE_LOOKUP_MAX_MATCHES, keep=None):
+        """Answer a direct numeric lookup ("What was real GDP growth in 2023?") from the stored tables.
+
+        Returns {"answer", "matches", "ms"} or None when the question is not a
+        plain lookup or no table row names every word of the indicator asked for.
+        `keep(file_name, page_label)` restricts the tables considered.
+        """
+        start_time = time.perf_counter()
+        tokens = tokenize(query)
+        if not tokens or NON_LOOKUP_WORDS & set(tokens) or ("how" in tokens and not {"much", "many"} & set(tokens)):
+            return None
+        years = [t for t in tokens if YEAR_RE.match(t)]
+        words = set(tokens) - STOPWORDS - set(years)
+        if not words:
+            return None
+
+        with self._lock:
+            placeholders = ",".join("?" * len(words))
+            candidates = self.conn.execute(
+                "SELECT i.indicator_id, i.table_id, i.row_idx, i.label, i.section, t.title, t.page_label, "
+                "t.file_name, t.node_id FROM indicators i JOIN tables t ON t.table_id = i.table_id "
+                f"WHERE i.indicator_id IN (SELECT DISTINCT indicator_id FROM indicator_terms WHERE term IN ({placeholders}))",
+                list(words)
+            ).fetchall()
+
+            scored = []
+            for indicator_id, table_id, row_idx, label, section, title, page_label, file_name, node_id in candidates:
+                if keep is not None and not keep(file_name, page_label):
+                    continue
+                core = set(tokenize(core_label(label))) - STOPWORDS
+                # Every word of the indicator's name must be in the question, bar one implied qualifier...
+                missing = core - words
+                if not core or len(missing) > 1 or (missing and (missing - QUALIFIER_WORDS or len(core) < 2)):
+                    continue
+                # ...and every other word of the question must be explained by the table or be a measure word
+                explained = core | set(tokenize(label)) | set(tokenize(section)) | set(tokenize(title)) | GENERIC_WORDS
+                if words - explained:
+                    continue
+                specificity = (not missing, len(core & words))
+                scored.append((specificity, table_id, row_idx, label, section, title, page_label, file_name, node_id))
+            if not scored:
+                return None
+
+            # Exact names beat implied qualifiers, and more specific names win ("Real GDP" over "GDP")
+            best = max(s[0] for s in scored)
+            matches = []
+            for specificity, table_id, row_idx, label, section, title, page_label, file_name, node_id in scored:
+                if specificity != best or len(matches) == max_matches:
+                    continue
+                columns = self.conn.execute(
+                    "SELECT col_idx, label FROM columns WHERE table_id = ? ORDER BY col_idx", (table_id,)).fetchall()
+                cells = dict(self.conn.execute(
+                    "SELECT col_idx, text FROM cells WHERE table_id = ? AND row_idx = ? AND value IS NOT NULL",
+                    (table_id, row_idx)).fetchall())
+                if years:
+                    columns = [(c, header) for c, header in columns if set(years) & set(tokenize(header))]
+                values = [(header or f"col {c}", cells[c]) for c, header in columns if c in cells and c > 0]
+                if not values:
+                    continue
+                matches.append({
+                    "label": label, "section": section, "title": title, "page_label": page_label,
+                    "file_name": file_name, "node_id": node_id, "values": values
+                })
+        if not matches:
+            return None
+
+        parts = []
+        for match in matches:
+            source = f"{match['title']}, page {match['page_label']}" if match["title"] else f"page {match['page_label']}"
+            # The section tells apart same-named rows ("Exports" under hydrocarbon vs external sector)
+            name = match["label"]
+            if match["section"] and len(matches) > 1:
+                name += f" ({match['section']})"
+            if len(match["values"]) == 1:
+                header, value = match["values"][0]
+                parts.append(f"**{name}**, {header}: **{value}** — {source}")
+            else:
+                table = "| " + " | ".join(h for h, _ in match["values"]) + " |\n"
+                table += "|" + " --- |" * len(match["values"]) + "\n"
+                table += "| " + " | ".join(v for _, v in match["values"]) + " |"
+                parts.append(f"**{name}** — {source}\n\n{table}")
+        return {"answer": "\n\n".join(parts), "matches": matches,
+                "ms": round((time.perf_counter() - start_time) * 1000, 2)}
+
+
+def tables_from_documents(documents, nodes):
+    """Tables of each parsed page, linked to the chunk that holds the table's header row"""
+    nodes_by_doc = {}
+    for node in nodes:
+        nodes_by_doc.setdefault(node.ref_doc_id, []).append(node)
+
+    found = []
+    for doc in documents:
+        doc_nodes = nodes_by_doc.get(doc.id_)
+        if not doc_nodes:
+            continue
+        for table in extract_tables(doc.text):
+            header_line = table["markdown"].splitlines()[0].strip()
+            node = next((n for n in doc_nodes if header_line in n.get_content()), doc_nodes[0])
+            found.append((table, node.node_id, doc.metadata.get("file_name"), doc.metadata.get("page_label")))
+    return found
+
+
+def tables_from_nodes(nodes):
+    """Tables found directly in chunk text; used to backfill stores ingested before the table store existed"""
+    return [
+        (table, node.node_id, node.metadata.get("file_name"), node.metadata.get("page_label"))
+        for node in nodes
+        for table in extract_tables(node.get_content())
+    ]
@@ -0,0 +1,38 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PASSAGES = [
+    "Real GDP grew by 2.4 percent in 2023, driven by the non-hydrocarbon sector.",
+    "Inflation eased to 3 percent as food and housing prices stabilized.",
+    "The fiscal surplus narrowed as hydrocarbon revenues declined.",
+    "The LNG expansion programme will raise production capacity by 2027.",
+]
+
+
+@pytest.fixture
+def tiny_store(tmp_path, monkeypatch):
+    """A persisted store (SQLite docstore, memory-mapped vectors) of a few pages, embedded with FakeEmbedding"""
+    from llama_index.core import VectorStoreIndex
+    from llama_index.core.schema import TextNode
+    from fakes import FakeEmbedding
+    from index_loader import new_storage_context
+
+    # No model downloads: an unavailable reranker fails its warm-up stage straight away
+    monkeypatch.setenv("HF_HUB_OFFLINE", "1")
+    persist_dir = str(tmp_path / "storage")
+    storage_context = new_storage_context(persist_dir)
+    nodes = [TextNode(text=text, metadata={"file_name": "report.pdf", "page_label": str(i + 1)})
+             for i, text in enumerate(PASSAGES)]
+    VectorStoreIndex(nodes, storage_context=storage_context, embed_model=FakeEmbedding())
+    storage_context.persist(persist_dir=persist_dir)
+    return persist_dir
+
+
+@pytest.fixture
+def no_tracing(monkeypatch):
+    """Keep test queries out of the trace log"""
+    import tracing
+    monkeypatch.setattr(tracing, "TRACING_ENABLED", False)
@@ -0,0 +1,85 @@
+import os
+import sys
+import pytest
+from pydantic import Field
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.schema import TextNode
+import embedding_cache
+from embedding_cache import EmbeddingCache, embed_nodes
+from fakes import FakeEmbedding
+
+
+class RateLimitedEmbedding(FakeEmbedding):
+    """FakeEmbedding whose first `failures` requests fail with `error`"""
+
+    failures: int = Field(default=0)
+    error: str = Field(default="429 RESOURCE_EXHAUSTED: quota exceeded")
+
+    async def _aget_text_embeddings(self, texts):
+        if self.failures:
+            self.failures -= 1
+            self.calls += 1
+            raise RuntimeError(self.error)
+        return await super()._aget_text_embeddings(texts)
+
+
+def make_nodes(texts):
+    return [TextNode(text=text) for text in texts]
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Record the retry waits instead of sleeping through them"""
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(embedding_cache.asyncio, "sleep", sleep)
+    return waits
+
+
+def test_reingest_hits_the_cache(tmp_path):
+    texts = [f"chunk {i} about fiscal policy" for i in range(10)]
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite"))
+    model = FakeEmbedding()
+    first = embed_nodes(make_nodes(texts), model, cache=cache, batch_size=4)
+    calls = model.calls
+
+    # A re-ingest: fresh nodes, one chunk changed
+    second = embed_nodes(make_nodes(texts[:-1] + ["a new chunk"]), model, cache=cache, batch_size=4)
+
+    assert model.calls == calls + 1  # only the changed chunk is embedded
+    assert cache.hits == 9
+    assert [n.embedding for n in second[:-1]] == [n.embedding for n in first[:-1]]
+    cache.close()
+
+
+def test_duplicates_are_embedded_once():
+    model = FakeEmbedding()
+    nodes = embed_nodes(make_nodes(["same text"] * 5), model, batch_size=2)
+
+    assert model.calls == 1
+    assert all(n.embedding == nodes[0].embedding for n in nodes)
+
+
+def test_rate_limit_errors_are_retried(no_backoff):
+    model = RateLimitedEmbedding(failures=2)
+    nodes = embed_nodes(make_nodes(["gdp growth", "inflation"]), model, batch_size=10, max_retries=3)
+
+    assert model.calls == 3
+    # Exponential backoff with up to 100% jitter: 1-2 s, then 2-4 s
+    assert len(no_backoff) == 2 and 1 <= no_backoff[0] < 2 and 2 <= no_backoff[1] < 4
+    assert nodes[0].embedding == FakeEmbedding().get_text_embedding("gdp growth")
+
+
+def test_other_errors_and_exhausted_retries_are_raised(no_backoff):
+    with pytest.raises(RuntimeError, match="bad request"):
+        embed_nodes(make_nodes(["x"]), RateLimitedEmbedding(failures=1, error="400 bad request"))
+    assert no_backoff == []
+
+    with pytest.raises(RuntimeError, match="429"):
+        embed_nodes(make_nodes(["x"]), RateLimitedEmbedding(failures=5), max_retries=2)
+    assert len(no_backoff) == 2
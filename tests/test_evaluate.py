@@ -0,0 +1,65 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core.base.response.schema import Response
+from llama_index.core.schema import NodeWithScore, TextNode
+import evaluate
+import pipeline
+
+
+class StubEngine:
+    """Answers every query with the query text; queries containing "fail" raise"""
+
+    def query(self, query):
+        if "fail" in query:
+            raise RuntimeError("branch down")
+        node = NodeWithScore(node=TextNode(text=f"context for {query}", metadata={"page_label": "7"}), score=1.0)
+        return Response(f"Answer: {query} grew 4.5%", source_nodes=[node])
+
+
+def test_load_queries_and_expected_facts(tmp_path):
+    path = tmp_path / "queries.jsonl"
+    path.write_text('{"query": "GDP growth?", "expected": ["4.5%"]}\n{"query": "Inflation?"}\n', encoding="utf-8")
+    txt = tmp_path / "queries.txt"
+    txt.write_text("# comment\nGDP growth?\n\nInflation?\n", encoding="utf-8")
+
+    assert evaluate.load_queries(str(path)) == evaluate.load_queries(str(txt)) == ["GDP growth?", "Inflation?"]
+    assert evaluate.load_expected(str(path)) == {"GDP growth?": ["4.5%"]}
+
+
+def test_run_load_records_every_request_and_errors(no_tracing):
+    queries = ["GDP growth?", "Inflation?", "fail please"]
+    rows, wall_time = evaluate.run_load(StubEngine(), queries, concurrency=3, repeat=4,
+                                        expected={"GDP growth?": ["4.5%", "LNG"]})
+    summary = evaluate.summarize(rows, wall_time, concurrency=3)
+
+    assert len(rows) == 12
+    assert summary["requests"] == 12 and summary["errors"] == 4
+    assert summary["error_rate"] == round(4 / 12, 4)
+    assert summary["p50_s"] <= summary["p95_s"] <= summary["p99_s"] <= summary["max_s"]
+    assert summary["qps"] > 0
+    gdp = next(r for r in rows if r["Query"] == "GDP growth?")
+    assert gdp["Pages Cited"] == "7" and gdp["Answer Facts"] == 0.5
+    assert next(r for r in rows if r["Query"] == "fail please")["Error"] == "RuntimeError"
+
+
+def test_run_evaluation_offline_against_the_app_engine(tiny_store, no_tracing, tmp_path, monkeypatch):
+    monkeypatch.setattr(evaluate, "STORAGE_DIR", tiny_store)
+    # Hybrid engine without the cross-encoder, which would need a model download
+    monkeypatch.setattr(pipeline, "make_reranker", lambda **kwargs: None)
+    queries = tmp_path / "queries.json"
+    queries.write_text(json.dumps([{"query": "How fast did real GDP grow?", "expected": ["2.4"]},
+                                   "What happened to inflation?"]), encoding="utf-8")
+
+    summary = evaluate.run_evaluation(
+        queries_file=str(queries), engine="app", concurrency=2, repeat=2, warmup=1, fake_llm=True, fake_embed=True,
+        results_file=str(tmp_path / "results.csv"), summary_file=str(tmp_path / "summary.json"), service_url="",
+    )
+
+    assert summary["requests"] == 4 and summary["errors"] == 0
+    assert summary["engine"] == "app" and summary["fake_llm"] and summary["fake_embed"]
+    assert "retrieval_p50_ms" in summary
+    assert json.loads((tmp_path / "summary.json").read_text(encoding="utf-8"))["requests"] == 4
@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from micro_batch import MicroBatcher
+
+# Every thread is joined with a timeout, so a caller left waiting fails the test instead of hanging it
+JOIN_TIMEOUT_S = 10
+
+
+def run_callers(batcher, items):
+    """Call `batcher(item)` for every item on its own thread; returns {item: result or exception}"""
+    outcomes = {}
+
+    def call(item):
+        try:
+            outcomes[item] = batcher(item)
+        except Exception as e:
+            outcomes[item] = e
+
+    threads = [threading.Thread(target=call, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(JOIN_TIMEOUT_S)
+    assert not any(thread.is_alive() for thread in threads), "a caller is still waiting"
+    return outcomes
+
+
+def test_concurrent_callers_get_their_own_results():
+    batches = []
+
+    def batch_fn(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    # A long window: the batch is taken once all 8 items are pending, never by the timer
+    batcher = MicroBatcher("test-results", batch_fn, window_ms=60_000, max_batch_size=8)
+    outcomes = run_callers(batcher, range(8))
+
+    assert outcomes == {item: item * 10 for item in range(8)}
+    assert len(batches) == 1 and sorted(batches[0]) == list(range(8))
+    assert batcher.stats()["batch_sizes"] == {8: 1}
+
+
+def test_map_splits_at_max_batch_size_and_keeps_order():
+    batches = []
+
+    def batch_fn(items):
+        batches.append(list(items))
+        return [-item for item in items]
+
+    batcher = MicroBatcher("test-split", batch_fn, window_ms=0, max_batch_size=4)
+
+    assert batcher.map(list(range(10))) == [-item for item in range(10)]
+    assert batches == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert batcher.stats()["max_seen_batch_size"] == 4
+
+
+def test_batch_exception_reaches_every_waiter():
+    error = RuntimeError("backend down")
+
+    def batch_fn(items):
+        raise error
+
+    batcher = MicroBatcher("test-errors", batch_fn, window_ms=60_000, max_batch_size=6)
+    outcomes = run_callers(batcher, range(6))
+
+    assert all(outcome is error for outcome in outcomes.values())
+    assert batcher.stats()["errors"] == 1
+
+
+def test_failed_batch_leaves_no_caller_waiting():
+    calls = []
+
+    def batch_fn(items):
+        calls.append(list(items))
+        if len(calls) == 1:
+            raise RuntimeError("first batch fails")
+        return [item + 1 for item in items]
+
+    # One batch at a time of 3: the callers whose items were not in the failed batch are still served
+    batcher = MicroBatcher("test-recovery", batch_fn, window_ms=0, max_batch_size=3)
+    with pytest.raises(RuntimeError, match="first batch fails"):
+        batcher.map([1, 2, 3, 4, 5])
+    assert calls == [[1, 2, 3], [4, 5]]
+
+    outcomes = run_callers(batcher, range(5))
+    assert outcomes == {item: item + 1 for item in range(5)}
+
+
+def test_wrong_result_count_is_raised_to_every_caller():
+    batcher = MicroBatcher("test-count", lambda items: items[:-1], window_ms=60_000, max_batch_size=3)
+    outcomes = run_callers(batcher, range(3))
+
+    assert all(isinstance(outcome, ValueError) for outcome in outcomes.values())
@@ -0,0 +1,91 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llama_index.core import Document
+from llama_index.core.readers.base import BaseReader
+from parse_cache import ParseCache, CachedParser
+
+OPTIONS = {"result_type": "markdown", "premium_mode": True, "language": "en"}
+
+
+class StubParser(BaseReader):
+    """Offline stand-in for LlamaParse: one Document per 'page' of the file, counting calls"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def load_data(self, file_path, extra_info=None, **kwargs):
+        self.calls += 1
+        with open(file_path, "r", encoding="utf-8") as f:
+            pages = f.read().split("\f")
+        return [Document(text=text, metadata={**(extra_info or {}), "page_label": str(i + 1)})
+                for i, text in enumerate(pages)]
+
+
+def write_pdf(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_hit_makes_no_parser_call(tmp_path):
+    parser = StubParser()
+    cached = CachedParser(parser, OPTIONS, cache=ParseCache(str(tmp_path / "cache")))
+    path = write_pdf(tmp_path, "report.pdf", "# Page one\fGDP table")
+
+    first = cached.load_data(path, extra_info={"file_name": "report.pdf"})
+    second = cached.load_data(path, extra_info={"file_name": "report.pdf"})
+
+    assert parser.calls == 1
+    assert cached.cache.hits == 1 and cached.cache.misses == 1
+    assert [d.text for d in second] == [d.text for d in first] == ["# Page one", "GDP table"]
+    # File metadata is re-attached on read, page metadata comes from the cache
+    assert [d.metadata for d in second] == [{"file_name": "report.pdf", "page_label": "1"},
+                                            {"file_name": "report.pdf", "page_label": "2"}]
+
+
+def test_changed_bytes_or_options_miss(tmp_path):
+    parser = StubParser()
+    cache = ParseCache(str(tmp_path / "cache"))
+    path = write_pdf(tmp_path, "report.pdf", "v1")
+
+    CachedParser(parser, OPTIONS, cache=cache).load_data(path)
+    CachedParser(parser, {**OPTIONS, "premium_mode": False}, cache=cache).load_data(path)
+    write_pdf(tmp_path, "report.pdf", "v2")
+    CachedParser(parser, OPTIONS, cache=cache).load_data(path)
+
+    assert parser.calls == 3
+
+
+def test_lru_eviction_drops_the_least_recently_read_entry(tmp_path):
+    cache = ParseCache(str(tmp_path / "cache"))
+    entry = {"pages": [{"text": "x" * 1000, "metadata": {}}]}
+    cache.put("a", entry)
+    cache.put("b", entry)
+    # Explicit mtimes: a and b are old, then reading a makes it the most recent
+    os.utime(cache._path("a"), (1_000, 1_000))
+    os.utime(cache._path("b"), (2_000, 2_000))
+    assert cache.get("a") is not None
+
+    size = os.path.getsize(cache._path("a"))
+    cache.max_bytes = 2 * size + size // 2
+    cache.put("c", entry)
+
+    assert os.path.exists(cache._path("a"))
+    assert not os.path.exists(cache._path("b"))
+    assert os.path.exists(cache._path("c"))
+
+
+def test_corrupt_entry_is_a_miss_and_removed(tmp_path):
+    cache = ParseCache(str(tmp_path / "cache"))
+    cache.put("a", {"pages": []})
+    with open(cache._path("a"), "rb") as f:
+        data = f.read()
+    with open(cache._path("a"), "wb") as f:
+        f.write(data[:len(data) // 2])
+
+    assert cache.get("a") is None
+    assert cache.misses == 1
+    assert not os.path.exists(cache._path("a"))
@@ -0,0 +1,101 @@
+import os
+import sys
+import json
+import threading
+import urllib.request
+import urllib.error
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import query_service
+from query_service import QueryService, QueryServiceClient, QueryServiceError, make_server, configure_models
+
+
+@pytest.fixture
+def service(tiny_store, no_tracing):
+    """QueryService over the tiny store with fake models: one worker, no queue, on a free local port"""
+    svc = QueryService(tiny_store, configure_models=lambda: configure_models(fake_llm=True, fake_embed=True),
+                       workers=1, queue_size=0).start()
+    svc.warmup.wait_for("index")
+    server = make_server(svc, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    svc.url = f"http://127.0.0.1:{server.server_address[1]}"
+    yield svc
+    server.shutdown()
+    server.server_close()
+
+
+def post(service, path, body):
+    """(status, body bytes) of a POST, error statuses included"""
+    request = urllib.request.Request(service.url + path, data=json.dumps(body).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def test_answer_streams_ndjson_events(service):
+    status, data = post(service, "/answer", {"query": "How fast did real GDP grow?", "source": "test"})
+    events = [json.loads(line) for line in data.splitlines()]
+
+    assert status == 200
+    assert events[0]["event"] == "sources" and events[0]["source_nodes"]
+    assert {e["event"] for e in events[1:-1]} == {"token"}
+    assert events[-1]["event"] == "done"
+    assert events[-1]["answer"] == "".join(e["text"] for e in events[1:-1])
+
+    # A repeat is served from the answer cache, as one token
+    client_events = list(QueryServiceClient(service.url).answer_stream("How fast did real GDP grow?"))
+    assert client_events[0]["cached"]["layer"] == "exact"
+    assert client_events[-1]["answer"] == events[-1]["answer"]
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/answer", {}),
+    ("/answer", {"query": "GDP", "filters": "report.pdf"}),
+    ("/answer", {"query": "GDP", "filters": {"pages": "ten"}}),
+    ("/query", {"filters": None}),
+    ("/retrieve", ["not", "an", "object"]),
+])
+def test_malformed_requests_get_400(service, path, body):
+    status, data = post(service, path, body)
+
+    assert status == 400
+    assert "error" in json.loads(data)
+
+
+def test_full_queue_gets_503(service):
+    release = threading.Event()
+    # Occupy the only worker slot (workers=1, queue_size=0)
+    blocker = service.submit(lambda queue_ms: release.wait(30))
+    try:
+        for path in ("/query", "/answer"):
+            status, data = post(service, path, {"query": "GDP"})
+            assert status == 503
+            assert "busy" in json.loads(data)["error"]
+        with pytest.raises(QueryServiceError) as error:
+            QueryServiceClient(service.url).query("GDP")
+        assert error.value.status == 503
+        assert service.health()["stats"]["rejected"] == 3
+    finally:
+        release.set()
+        blocker.result(timeout=30)
+
+    # Served again once the slot is free
+    assert post(service, "/query", {"query": "GDP"})[0] == 200
+
+
+def test_stream_ends_with_an_error_event_when_the_worker_stalls(service, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(query_service.QueryRequestHandler, "stream_idle_s", 0.2)
+    monkeypatch.setattr(service, "answer_stream", lambda queue_ms, body, emit, cancelled: release.wait(30))
+    try:
+        status, data = post(service, "/answer", {"query": "GDP"})
+    finally:
+        release.set()
+
+    assert status == 200
+    assert json.loads(data.splitlines()[-1]) == {"event": "error", "error": "TimeoutError: no answer event in 0.2s"}
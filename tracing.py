@@ -0,0 +1,244 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from llama_index.core.instrumentation import get_dispatcher
+from llama_index.core.instrumentation.event_handlers import BaseEventHandler
+from llama_index.core.instrumentation.events.embedding import EmbeddingStartEvent, EmbeddingEndEvent
+from llama_index.core.instrumentation.events.llm import (
+    LLMChatStartEvent, LLMChatInProgressEvent, LLMChatEndEvent,
+    LLMCompletionStartEvent, LLMCompletionInProgressEvent, LLMCompletionEndEvent,
+)
+from llama_index.core.utils import get_tokenizer
+from pydantic import PrivateAttr
+
+TRACE_FILE = os.getenv("TRACE_FILE", "./logs/query_traces.jsonl")
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "1") != "0"
+
+_current = contextvars.ContextVar("query_trace", default=None)
+_write_lock = threading.Lock()
+
+
+def current_trace():
+    """The QueryTrace active in this context, or None"""
+    return _current.get()
+
+
+class QueryTrace:
+    """Per-query record of stage durations, candidate counts, tokens and cache hits.
+
+    Used as a context manager around one query; while active, `stage()` calls
+    and the LLM/embedding instrumentation handler add to it, and on exit one
+    JSON line is appended to `trace_file`. Thread-safe, since retrieval
+    branches record from the branch pool.
+    """
+
+    def __init__(self, query, source="app", trace_file=TRACE_FILE):
+        self.trace_file = trace_file
+        self.record = {
+            "trace_id": uuid.uuid4().hex,
+            "timestamp": time.time(),
+            "source": source,
+            "query": query,
+            "status": "ok",
+            "total_ms": None,
+            "stages": {},
+            "tokens": {"prompt": 0, "completion": 0, "estimated": False},
+            "cache": {},
+        }
+        self._lock = threading.Lock()
+        self._start = None
+        self._token = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        if exc is not None:
+            self.record["status"] = "error"
+            self.record["error"] = f"{exc_type.__name__}: {exc}"
+        self.finish()
+        return False
+
+    def add_stage(self, name, ms, count=None, status=None):
+        """Add a stage timing; repeated stages (e.g. several LLM calls) accumulate"""
+        with self._lock:
+            stage = self.record["stages"].setdefault(name, {"ms": 0.0, "calls": 0})
+            stage["ms"] = round(stage["ms"] + ms, 2)
+            stage["calls"] += 1
+            if count is not None:
+                stage["count"] = count
+            if status is not None and status != "ok":
+                stage["status"] = status
+
+    @contextmanager
+    def stage(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, (time.perf_counter() - start_time) * 1000)
+
+    def add_retrieval_timings(self, timings):
+        """Copy ParallelFusionRetriever.last_timings (per-branch ms, counts, status)"""
+        if "total_ms" in timings:
+            self.add_stage("retrieve", timings["total_ms"])
+        for name, timing in timings.items():
+            if isinstance(timing, dict):
+                self.add_stage(name, timing.get("ms", 0.0), count=timing.get("count"), status=timing.get("status"))
+
+    def set_count(self, name, count):
+        with self._lock:
+            self.record["stages"].setdefault(name, {"ms": 0.0, "calls": 0})["count"] = count
+
+    def add_tokens(self, prompt, completion, estimated=False):
+        with self._lock:
+            tokens = self.record["tokens"]
+            tokens["prompt"] += prompt
+            tokens["completion"] += completion
+            tokens["estimated"] = tokens["estimated"] or estimated
+
+    def set_cache(self, name, result):
+        with self._lock:
+            self.record["cache"][name] = result
+
+    def set(self, key, value):
+        with self._lock:
+            self.record[key] = value
+
+    def finish(self):
+        if self.record["total_ms"] is None and self._start is not None:
+            self.record["total_ms"] = round((time.perf_counter() - self._start) * 1000, 1)
+        if not TRACING_ENABLED:
+            return
+        line = json.dumps(self.record, default=str)
+        os.makedirs(os.path.dirname(self.trace_file) or ".", exist_ok=True)
+        with _write_lock:
+            with open(self.trace_file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+@contextmanager
+def stage(name):
+    """Time a block into the active trace; a no-op outside a traced query"""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
+
+
+def _count_tokens(text):
+    return len(get_tokenizer()(text)) if text else 0
+
+
+class TraceEventHandler(BaseEventHandler):
+    """Records embedding and LLM calls (duration, time to first token, tokens) into the active trace"""
+
+    @classmethod
+    def class_name(cls):
+        return "TraceEventHandler"
+
+    # Calls in progress: (kind, span_id) -> {"start", "prompt", "first_token"}
+    _pending: dict = PrivateAttr(default_factory=dict)
+    _pending_lock: object = PrivateAttr(default_factory=threading.Lock)
+
+    def handle(self, event, **kwargs):
+        trace = current_trace()
+        if trace is None:
+            return
+        now = time.perf_counter()
+
+        if isinstance(event, EmbeddingStartEvent):
+            with self._pending_lock:
+                self._pending[("embed", event.span_id)] = {"start": now}
+        elif isinstance(event, EmbeddingEndEvent):
+            with self._pending_lock:
+                pending = self._pending.pop(("embed", event.span_id), None)
+            if pending:
+                trace.add_stage("embed", (now - pending["start"]) * 1000, count=len(event.chunks))
+        elif isinstance(event, (LLMChatStartEvent, LLMCompletionStartEvent)):
+            prompt = event.prompt if isinstance(event, LLMCompletionStartEvent) else \
+                "\n".join(str(m.content or "") for m in event.messages)
+            with self._pending_lock:
+                self._pending[("llm", event.span_id)] = {"start": now, "prompt": prompt, "first_token": None}
+        elif isinstance(event, (LLMChatInProgressEvent, LLMCompletionInProgressEvent)):
+            with self._pending_lock:
+                pending = self._pending.get(("llm", event.span_id))
+                if pending and pending["first_token"] is None:
+                    pending["first_token"] = now
+        elif isinstance(event, (LLMChatEndEvent, LLMCompletionEndEvent)):
+            with self._pending_lock:
+                pending = self._pending.pop(("llm", event.span_id), None)
+            if not pending:
+                return
+            trace.add_stage("llm", (now - pending["start"]) * 1000)
+            if pending["first_token"] is not None and "ttft_ms" not in trace.record:
+                trace.set("ttft_ms", round((pending["first_token"] - pending["start"]) * 1000, 1))
+            self._record_tokens(trace, pending["prompt"], event.response)
+
+    @staticmethod
+    def _record_tokens(trace, prompt, response):
+        if response is None:
+            return
+        # Gemini reports usage on the (final) response; other LLMs are estimated with the global tokenizer
+        usage = getattr(response, "additional_kwargs", None) or {}
+        if usage.get("prompt_tokens") is not None:
+            trace.add_tokens(usage["prompt_tokens"], usage.get("completion_tokens") or 0)
+            return
+        text = response.message.content if hasattr(response, "message") else response.text
+        trace.add_tokens(_count_tokens(prompt), _count_tokens(text or ""), estimated=True)
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install_tracing():
+    """Attach the trace handler to the root instrumentation dispatcher (idempotent)"""
+    global _installed
+    with _install_lock:
+        if not _installed:
+            get_dispatcher().add_event_handler(TraceEventHandler())
+            _installed = True
+
+
+def _tail_lines(f, limit, block_size=1 << 16):
+    """The last `limit` lines of a binary file, read backwards from the end"""
+    f.seek(0, os.SEEK_END)
+    position = f.tell()
+    data = b""
+    while position > 0 and data.count(b"\n") <= limit:
+        step = min(block_size, position)
+        position -= step
+        f.seek(position)
+        data = f.read(step) + data
+    lines = data.splitlines()
+    if position > 0:
+        lines = lines[1:]  # starts mid-line
+    return lines[-limit:]
+
+
+def load_traces(trace_file=TRACE_FILE, limit=None):
+    """Read trace records, newest last; skips partially written lines.
+
+    With `limit`, only the end of the file is read, so the cost does not
+    grow with the log.
+    """
+    if not os.path.exists(trace_file):
+        return []
+    records = []
+    with open(trace_file, "rb") as f:
+        for line in (_tail_lines(f, limit) if limit else f):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
@@ -0,0 +1,139 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Nothing heavy is imported at module level: app.py imports this before its first
+# render, and llama_index / the model clients are loaded by the warm-up threads.
+
+STAGES = ("models", "index", "bm25", "reranker")
+
+
+class EngineWarmup:
+    """Loads the query engine's components on background threads.
+
+    - models: LLM + embedding clients (`configure_models` sets Settings)
+    - index: the persisted index; waits for models, because the index binds
+      Settings.embed_model when it is loaded
+    - bm25: the persisted keyword index (memory-mapped)
+    - reranker: the cross-encoder
+
+    `status()` reports progress per stage. `engine()` returns the full hybrid +
+    rerank engine once every stage has settled, and before that a degraded
+    vector-only engine (no BM25, no rerank) as soon as the index is loaded.
+    """
+
+    def __init__(self, persist_dir, configure_models, reranker_kwargs=None):
+        self.persist_dir = persist_dir
+        self.configure_models = configure_models
+        self.reranker_kwargs = reranker_kwargs or {}
+        self._pool = ThreadPoolExecutor(max_workers=len(STAGES) + 1, thread_name_prefix="warmup")
+        self._lock = threading.Lock()
+        self._futures = {}
+        self._status = {name: {"state": "pending", "seconds": None, "error": None} for name in STAGES}
+        self._engines = {}
+        self.started_at = None
+
+    def start(self):
+        with self._lock:
+            if self._futures:
+                return self
+            self.started_at = time.perf_counter()
+            # Importing llama_index from several threads at once can see partially
+            # initialized modules, so the package is imported once before the stages fan out
+            core = self._pool.submit(self._import_core)
+            models = self._submit("models", self._load_models, core)
+            self._submit("index", self._load_index, models)
+            self._submit("bm25", self._load_bm25, core)
+            self._submit("reranker", self._load_reranker, core)
+        return self
+
+    def _submit(self, name, fn, *depends_on):
+        def run():
+            try:
+                for future in depends_on:
+                    future.result()  # a failed dependency fails this stage too
+                self._status[name]["state"] = "loading"
+                start_time = time.perf_counter()
+                result = fn()
+            except Exception as e:
+                self._status[name].update(state="failed", error=str(e))
+                print(f"Warm-up stage '{name}' failed: {e}")
+                raise
+            self._status[name].update(state="ready", seconds=round(time.perf_counter() - start_time, 2))
+            return result
+
+        self._futures[name] = self._pool.submit(run)
+        return self._futures[name]
+
+    def _import_core(self):
+        import llama_index.core  # noqa: F401
+
+    def _load_models(self):
+        self.configure_models()
+
+    def _load_index(self):
+        from index_loader import load_index
+        from pipeline import build_query_engine
+        index = load_index(self.persist_dir)
+        # Ready for queries that arrive before BM25 and the reranker
+        self._engines["degraded"] = build_query_engine(index, self.persist_dir, degraded=True)
+        return index
+
+    def _load_bm25(self):
+        from bm25_index import BM25Index
+        from shards import shard_dirs
+        dirs = shard_dirs(self.persist_dir)
+        if dirs:
+            # Sharded store: build_query_engine takes one index per shard
+            return {name: BM25Index.load(path) for name, path in dirs.items() if BM25Index.exists(path)}
+        if not BM25Index.exists(self.persist_dir):
+            return None  # build_query_engine falls back to BM25Retriever over the docstore
+        return BM25Index.load(self.persist_dir)
+
+    def _load_reranker(self):
+        from rerank import make_reranker
+        return make_reranker(top_n=5, **self.reranker_kwargs)
+
+    def status(self):
+        return {name: dict(status) for name, status in self._status.items()}
+
+    @property
+    def settled(self):
+        """Every stage finished, successfully or not"""
+        return bool(self._futures) and all(f.done() for f in self._futures.values())
+
+    @property
+    def ready(self):
+        return self.settled and all(s["state"] == "ready" for s in self._status.values())
+
+    def progress(self):
+        """Fraction of stages that have settled"""
+        return sum(f.done() for f in self._futures.values()) / len(STAGES) if self._futures else 0.0
+
+    def wait_for(self, name, timeout=None):
+        """Block until a stage is loaded and return its result (re-raises its error)"""
+        self.start()
+        return self._futures[name].result(timeout=timeout)
+
+    def _result(self, name):
+        future = self._futures[name]
+        return future.result() if future.done() and future.exception() is None else None
+
+    def engine(self, timeout=None):
+        """The full engine once warm-up has settled, else the degraded one (see `engine.mode`).
+
+        Waits for the index (and models), which every mode needs.
+        """
+        index = self.wait_for("index", timeout=timeout)
+        if not self.settled:
+            return self._engines["degraded"]
+        with self._lock:
+            if "full" not in self._engines:
+                from pipeline import build_query_engine
+                reranker = self._result("reranker")
+                self._engines["full"] = build_query_engine(
+                    index, self.persist_dir, reranker=reranker, bm25_index=self._result("bm25"),
+                    rerank=reranker is not None
+                )
+                print(f"Query engine warm in {time.perf_counter() - self.started_at:.2f}s: {self.status()}")
+            return self._engines["full"]